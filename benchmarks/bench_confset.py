@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# Copyright (c) 2012-2015, Dwight Hubbard.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Confset benchmark suite
+
+Generates synthetic configuration directories, times the main confset
+operations against them and compares the results with a stored baseline.
+
+Usage::
+
+    python benchmarks/bench_confset.py --save        # record a baseline
+    python benchmarks/bench_confset.py               # compare with the baseline
+
+The run fails, with exit code 1, when a benchmark is slower than its
+baseline by more than the threshold.  Baselines are machine specific, so
+record one on the machine that runs the comparison.
+"""
+from __future__ import print_function
+import contextlib
+import json
+import optparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import confset  # noqa: E402
+
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+DEFAULT_THRESHOLD = 0.25
+DEFAULT_MIN_DELTA = 0.005
+
+# name: (number of files, settings per file, help lines per setting)
+PROFILES = {
+    'quick': {
+        'small_tree': (10, 10, 2),
+        'wide_tree': (500, 20, 2),
+        'large_file': (1, 10000, 3),
+        'long_help': (20, 50, 40),
+    },
+    'full': {
+        'small_tree': (10, 10, 2),
+        'wide_tree': (10000, 20, 2),
+        'large_file': (1, 100000, 3),
+        'long_help': (200, 50, 200),
+    },
+}
+
+CLI_BOOTSTRAP = '''
+import sys
+import confset.confset
+confset.confset.CONF_PATH[:] = [sys.argv[1]]
+confset.confset.CACHE_DIR = sys.argv[2]
+from confset.cli import main
+sys.argv = ['confset'] + sys.argv[3:]
+sys.exit(main())
+'''
+
+
+def generate_tree(root, files, settings_per_file, help_lines):
+    """
+    Generate a directory of synthetic config files
+    :param root: Directory to create the files in
+    :param files: Number of files
+    :param settings_per_file: Number of settings in each file
+    :param help_lines: Number of help comment lines before each setting
+    """
+    for file_number in range(files):
+        with open(os.path.join(root, 'conf%05d' % file_number), 'w') as file_handle:
+            file_handle.write('# Synthetic configuration file %d\n\n' % file_number)
+            for setting_number in range(settings_per_file):
+                for line_number in range(help_lines):
+                    file_handle.write(
+                        '# Help line %d for SETTING_%d, describing what the setting does\n' % (
+                            line_number, setting_number
+                        )
+                    )
+                file_handle.write('SETTING_%d="value %d of file %d"\n\n' % (setting_number, setting_number, file_number))
+    # Real config directories are rarely modified, age the directory so it is
+    # treated like one.
+    old = time.time() - 3600
+    os.utime(root, (old, old))
+
+
+@contextlib.contextmanager
+def confset_root(root, cache_dir):
+    """
+    Point confset at a synthetic config directory and cache directory
+    """
+    saved_paths = list(confset.confset.CONF_PATH)
+    saved_cache_dir = confset.confset.CACHE_DIR
+    saved_virtual_env = os.environ.pop('VIRTUAL_ENV', None)
+    confset.confset.CONF_PATH[:] = [root]
+    confset.confset.CACHE_DIR = cache_dir
+    try:
+        yield
+    finally:
+        confset.confset.CONF_PATH[:] = saved_paths
+        confset.confset.CACHE_DIR = saved_cache_dir
+        if saved_virtual_env is not None:
+            os.environ['VIRTUAL_ENV'] = saved_virtual_env
+
+
+def best_time(func, repeat, setup=None):
+    """
+    Time a function
+    :param func: Function to time
+    :param repeat: Number of timed runs
+    :param setup: Function run before each timed run
+    :return: (float) The fastest run in seconds
+    """
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run_tree_benchmarks(name, root, cache_dir, repeat):
+    """
+    Run the benchmarks against one synthetic tree
+    :return: (dict) Benchmark times keyed by benchmark name
+    """
+    results = {}
+    namespaces = sorted(os.listdir(root))
+    first = namespaces[0]
+
+    def clear_cache():
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    def load_all():
+        for namespace in namespaces:
+            confset.ConfigSettings(namespace).load()
+
+    def print_all():
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            confset.print_settings(info=True)
+
+    def set_one():
+        confset.ConfigSettings(first, backup=False).set('SETTING_0', '"changed %f"' % time.time())
+
+    def cli_get():
+        subprocess.check_call(
+            [sys.executable, '-c', CLI_BOOTSTRAP, root, cache_dir, '%s.SETTING_0' % first],
+            stdout=subprocess.DEVNULL
+        )
+
+    with confset_root(root, cache_dir):
+        results[name + '.load_cold'] = best_time(load_all, repeat, setup=clear_cache)
+        results[name + '.load_warm'] = best_time(load_all, repeat)
+        results[name + '.settings'] = best_time(confset.settings, repeat, setup=clear_cache)
+        results[name + '.print_settings'] = best_time(print_all, repeat, setup=clear_cache)
+        results[name + '.set'] = best_time(set_one, repeat)
+        results[name + '.cli_get'] = best_time(cli_get, repeat)
+    return results
+
+
+def run_benchmarks(profile='quick', repeat=3):
+    """
+    Run all benchmarks of a profile
+    :return: (dict) Benchmark times keyed by benchmark name
+    """
+    results = {}
+    for name, (files, settings_per_file, help_lines) in sorted(PROFILES[profile].items()):
+        root = tempfile.mkdtemp(prefix='confset_bench_')
+        cache_dir = tempfile.mkdtemp(prefix='confset_bench_cache_')
+        try:
+            generate_tree(root, files, settings_per_file, help_lines)
+            results.update(run_tree_benchmarks(name, root, cache_dir, repeat))
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+            shutil.rmtree(cache_dir, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline, threshold, min_delta=DEFAULT_MIN_DELTA):
+    """
+    Compare benchmark results with a baseline
+
+    A benchmark regressed when it is slower than the baseline by more than
+    threshold, as a fraction of the baseline, and by more than min_delta
+    seconds, which keeps timer noise on very fast benchmarks from failing
+    the run.
+    :return: (list) Names of the benchmarks that regressed past the threshold
+    """
+    regressions = []
+    for name in sorted(results):
+        current = results[name]
+        previous = baseline.get(name)
+        if previous:
+            change = (current - previous) / previous
+            regressed = change > threshold and current - previous > min_delta
+            status = 'REGRESSION' if regressed else 'ok'
+            print('%-32s %10.4fs %10.4fs %+7.1f%% %s' % (name, current, previous, change * 100, status))
+            if regressed:
+                regressions.append(name)
+        else:
+            print('%-32s %10.4fs %11s %8s new' % (name, current, '-', '-'))
+    return regressions
+
+
+def main():
+    parser = optparse.OptionParser(usage='bench_confset.py [options]')
+    parser.add_option('--profile', default='quick', choices=sorted(PROFILES), help='Benchmark size profile')
+    parser.add_option('--repeat', default=3, type='int', help='Number of timed runs per benchmark')
+    parser.add_option('--baseline', default=DEFAULT_BASELINE, help='Baseline file')
+    parser.add_option('--save', default=False, action='store_true', help='Save the results as the new baseline')
+    parser.add_option(
+        '--threshold', default=DEFAULT_THRESHOLD, type='float',
+        help='Allowed slowdown relative to the baseline, 0.25 means 25%'
+    )
+    parser.add_option(
+        '--min-delta', default=DEFAULT_MIN_DELTA, type='float',
+        help='Slowdowns smaller than this many seconds are never treated as a regression'
+    )
+    options, args = parser.parse_args()
+
+    results = run_benchmarks(profile=options.profile, repeat=options.repeat)
+    baseline = {}
+    if os.path.exists(options.baseline):
+        with open(options.baseline) as file_handle:
+            baseline = json.load(file_handle).get(options.profile, {})
+    regressions = compare(results, baseline, options.threshold, options.min_delta)
+
+    if options.save:
+        saved = {}
+        if os.path.exists(options.baseline):
+            with open(options.baseline) as file_handle:
+                saved = json.load(file_handle)
+        saved[options.profile] = results
+        with open(options.baseline, 'w') as file_handle:
+            json.dump(saved, file_handle, indent=4, sort_keys=True)
+        print('Saved baseline to %s' % options.baseline)
+        return 0
+    if regressions:
+        print('%d benchmark(s) regressed by more than %d%%: %s' % (
+            len(regressions), options.threshold * 100, ', '.join(regressions)
+        ))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
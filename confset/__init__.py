@@ -4,10 +4,10 @@
 """
 Import confset into the module namespace
 """
-import json
-import os
-from .confset import config_files, config_paths, settings, print_settings, CONF_PATH, ConfigSettings, \
-    ConfsetException, METADATA_DIR
+from .confset import config_files, config_layout, config_paths, discover_config_files, iter_settings, settings, \
+    print_settings, SettingRecord, CONF_PATH, ConfigSettings, ConfsetConflict, ConfsetException, METADATA_DIR, Overlay, \
+    ResolvedSetting, Setting, SettingFilter, SettingsView
+from .serializers import setting_dicts, write_json, write_ndjson
 
 
 all = ['confset', 'metadata']
@@ -48,31 +48,76 @@ Attributes:
     __git_hash__(str):
         The git hash value for the code used to build this module.
 """
-import json
 import os
+import sys
+import types
 
 
 _metadata_file = os.path.join(
     os.path.dirname(__file__),
     'package_metadata.json'
 )
-
-if os.path.exists(_metadata_file):  # pragma: no cover
-    with open(_metadata_file) as _file_handle:
-        _package_metadata = json.load(_file_handle)
-else:  # pragma: no cover
-    _package_metadata = {
-        'version': '0.0.0'
-    }
-
-__version__ = str(_package_metadata.get('version', '0.0.0'))
-__git_version__ = str(_package_metadata.get('git_version', ''))
-__ci_tag__ = str(_package_metadata.get('ci_tag', ''))
-__ci_build_number__ = str(_package_metadata.get('ci_build_number', ''))
-__git_branch__ = str(_package_metadata.get('git_branch', ''))
-__git_origin__ = str(_package_metadata.get('git_origin', ''))
-__git_hash__ = str(_package_metadata.get('git_hash', ''))
-__git_base_url__ = 'https://github.com/dwighthubbard/confset'
-if __git_origin__.endswith('.git'):  # pragma: no cover
-    __git_base_url__ = __git_origin__[:-4].strip('/')
-__source_url__ = __git_base_url__ + '/tree/' + __git_hash__
+_package_metadata = None
+_metadata_attributes = {
+    '__version__': ('version', '0.0.0'),
+    '__git_version__': ('git_version', ''),
+    '__ci_tag__': ('ci_tag', ''),
+    '__ci_build_number__': ('ci_build_number', ''),
+    '__git_branch__': ('git_branch', ''),
+    '__git_origin__': ('git_origin', ''),
+    '__git_hash__': ('git_hash', ''),
+}
+_lazy_attributes = {
+    'aload': 'aio', 'aload_many': 'aio', 'aiter_settings': 'aio', 'SettingsDiff': 'watch', 'Watcher': 'watch'
+}
+
+
+def _metadata():
+    """
+    Read the package metadata the first time it is needed
+
+    :return: (dict) The package metadata
+    """
+    global _package_metadata
+    if _package_metadata is None:
+        if os.path.exists(_metadata_file):  # pragma: no cover
+            import json
+            with open(_metadata_file) as _file_handle:
+                _package_metadata = json.load(_file_handle)
+        else:  # pragma: no cover
+            _package_metadata = {
+                'version': '0.0.0'
+            }
+    return _package_metadata
+
+
+class _LazyModule(types.ModuleType):
+    """
+    The confset package, resolving the build metadata, the asyncio interface and the watcher on first access
+
+    None of them are needed to get or set a setting, so they are not loaded
+    when the command line tool starts.  The package module is made an
+    instance of this class, since a module level __getattr__ needs Python 3.7.
+    """
+
+    def __getattr__(self, name):
+        if name in _metadata_attributes:
+            key, default = _metadata_attributes[name]
+            value = str(_metadata().get(key, default))
+        elif name == '__git_base_url__':
+            value = 'https://github.com/dwighthubbard/confset'
+            git_origin = self.__git_origin__
+            if git_origin.endswith('.git'):  # pragma: no cover
+                value = git_origin[:-4].strip('/')
+        elif name == '__source_url__':
+            value = self.__git_base_url__ + '/tree/' + self.__git_hash__
+        elif name in _lazy_attributes:
+            import importlib
+            value = getattr(importlib.import_module('.' + _lazy_attributes[name], __name__), name)
+        else:
+            raise AttributeError('module %r has no attribute %r' % (__name__, name))
+        setattr(self, name, value)
+        return value
+
+
+sys.modules[__name__].__class__ = _LazyModule
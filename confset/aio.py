@@ -0,0 +1,101 @@
+# Copyright (c) 2012-2015, Dwight Hubbard.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+asyncio interface to confset
+
+The file access is done in the default executor of the running event loop,
+so reading, backing up and writing config files never blocks the loop.  The
+parsing and writing is done by the regular ConfigSettings class.
+"""
+import asyncio
+import collections
+import functools
+from .confset import ConfigSettings, config_files, config_records, load_config
+
+
+DEFAULT_JOBS = 8
+# asyncio.get_running_loop() is new in Python 3.7, before that get_event_loop() returns the running loop in a coroutine
+_running_loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Run a blocking function in the default executor of the running event loop
+    :param func:
+    :return: The return value of func
+    """
+    loop = _running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+def _load(conffile, kwargs):
+    conf = ConfigSettings(conffile, **kwargs)
+    conf.load()
+    return conf
+
+
+async def aload(conffile, **kwargs):
+    """
+    Load a config file without blocking the event loop
+    :param conffile: Name of the config file
+    :param kwargs: Keyword arguments passed to ConfigSettings
+    :return: (ConfigSettings) with the settings loaded
+    """
+    return await run_blocking(_load, conffile, kwargs)
+
+
+async def aload_many(conffiles, **kwargs):
+    """
+    Load several config files concurrently
+    :param conffiles: Names of the config files
+    :param kwargs: Keyword arguments passed to ConfigSettings
+    :return: (list) of ConfigSettings in the same order as conffiles
+    """
+    return await asyncio.gather(*[aload(conffile, **kwargs) for conffile in conffiles])
+
+
+def aiter_settings(jobs=DEFAULT_JOBS):
+    """
+    Iterate over all settings, loading up to jobs config files concurrently
+
+    Config files that can't be read are skipped and the settings are yielded
+    in config_files() order.
+    :param jobs: Number of config files to load concurrently
+    :return: async iterator of SettingRecord(namespace, key, value, help) tuples
+    """
+    return _SettingsIterator(jobs)
+
+
+class _SettingsIterator(object):
+    """
+    Async iterator over all settings, see aiter_settings()
+
+    This is a class rather than an async generator, which needs Python 3.6.
+    :param jobs: Number of config files to load concurrently
+    """
+
+    def __init__(self, jobs):
+        self.jobs = max(jobs, 1)
+        self.namespaces = None
+        self.pending = collections.deque()
+        self.records = collections.deque()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self.records:
+            if self.namespaces is None:
+                self.namespaces = iter(await run_blocking(config_files))
+            loop = _running_loop()
+            for namespace in self.namespaces:
+                self.pending.append(loop.run_in_executor(None, load_config, namespace))
+                if len(self.pending) >= self.jobs:
+                    break
+            if not self.pending:
+                raise StopAsyncIteration
+            conf = await self.pending.popleft()
+            if conf is not None:
+                self.records.extend(config_records(conf))
+        return self.records.popleft()
@@ -2,12 +2,77 @@ from __future__ import print_function
 import re
 import sys
 import confset
+import confset.client
+import confset.manifest
 import optparse
 
 
+ARGUMENT_RE = re.compile(
+    r'^(?P<namespace>[a-zA-Z0-9\-\_\*\?\[\]]+)(\.(?P<attribute>[a-zA-Z0-9\-\_\*\?\[\]]+))?(=(?P<value>.*))?$'
+)
+GLOB_CHARACTERS = '*?['
+
+
+def is_glob(name):
+    """
+    Check if a setting or file name is a glob pattern
+    :param name: (str) or None
+    :return: (bool)
+    """
+    return bool(name) and any(character in name for character in GLOB_CHARACTERS)
+
+
 def create_arg_parser():
     parser = optparse.OptionParser(usage='confset [setting]|[setting=value]')
     parser.add_option('--info', default=False, action='store_true', help='Print help information for options')
+    parser.add_option(
+        '--format', default='text', choices=['text', 'json', 'ndjson'],
+        help='Output format, text, a json array or ndjson with one setting per line'
+    )
+    parser.add_option(
+        '--apply', default=None, metavar='MANIFEST',
+        help='Apply the file.KEY=value, json or yaml settings in MANIFEST, - reads the manifest from stdin'
+    )
+    parser.add_option(
+        '--manifest-format', default=None, choices=['keyvalue', 'json', 'yaml'],
+        help='Format of the --apply manifest, by default detected from the file extension or contents'
+    )
+    parser.add_option(
+        '--check', default=False, action='store_true',
+        help='Show the settings of name.attr=value or the --apply manifest that differ, without changing anything'
+    )
+    parser.add_option(
+        '--converge', default=False, action='store_true',
+        help='Only change the settings of name.attr=value or the --apply manifest that differ and show them'
+    )
+    parser.add_option(
+        '--regex', default=False, action='store_true',
+        help='Treat the argument as a regular expression matched against the file.KEY setting names'
+    )
+    parser.add_option(
+        '--no-backup', dest='backup', default=True, action='store_false',
+        help='Do not keep a backup of the configuration file when changing a setting'
+    )
+    parser.add_option(
+        '-j', '--jobs', default=None, type='int',
+        help='Number of configuration files to load in parallel when showing all settings or to update with --apply'
+    )
+    parser.add_option(
+        '--stream', default=False, action='store_true',
+        help='Print the settings of each configuration file as soon as it is loaded, without aligning the help text'
+    )
+    parser.add_option(
+        '--serve', default=False, action='store_true',
+        help='Run a daemon that keeps the settings loaded and answers confset commands over a unix socket'
+    )
+    parser.add_option(
+        '--stats', default=False, action='store_true',
+        help='Print timing and I/O statistics for the command on stderr'
+    )
+    parser.add_option(
+        '--stats-format', default='text', choices=['text', 'json'],
+        help='Format of the --stats output, text or json'
+    )
     return parser
 
 
@@ -19,12 +84,30 @@ class ConfsetArguments(object):
         :param args: (list) List of arguments
         :param options: (object) argument option object
         """
-        self.args = self.parse_arguments(args)
         self.arg_options = options
+        self.pattern = None
+        if getattr(options, 'regex', False):
+            self.pattern = ' '.join(args or []).strip()
+            self.args = {'namespace': None, 'attribute': None, 'value': None}
+        else:
+            self.args = self.parse_arguments(args)
         self.name = self.args['namespace']
         self.attr = self.args['attribute']
         self.value = self.args['value']
-        self.confset = self.__get_confset()
+        if is_glob(self.name):
+            # A pattern spanning several files, filter the settings of all of them
+            self.pattern = '%s.%s' % (self.name, self.attr) if self.attr else self.name
+            self.name = self.attr = None
+        self._confset = None
+
+    @property
+    def confset(self):
+        """
+        The confset object the command operates on, see __get_confset()
+        """
+        if self._confset is None:
+            self._confset = self.__get_confset()
+        return self._confset
 
     def __get_confset(self):
         """
@@ -36,12 +119,14 @@ class ConfsetArguments(object):
         else if only has self.name (e.g: `confset name`):
             return confset.ConfigSettings('name')
 
-        else (e.g: `confset`):
+        else (e.g: `confset` or `confset 'ntp*.NTP*'`):
             return confset
 
         :return: (object) confset object
         """
-        res = confset if self.name is None else confset.ConfigSettings(self.name)
+        if self.name is None:
+            return confset
+        res = confset.ConfigSettings(self.name, backup=getattr(self.arg_options, 'backup', True))
         return res
 
     def parse_arguments(self, args=None):
@@ -56,6 +141,8 @@ class ConfsetArguments(object):
             $ confset name.attr=value
             $ confset name.attr="value with space"
             $ confset name.attr=value_without_space
+            $ confset 'name*.attr*'
+            $ confset '*.attr'
             ```
 
         **Invalid arguments**
@@ -67,6 +154,9 @@ class ConfsetArguments(object):
             $ confset name.attr=value with space
             $ confset name.attr=value name.attr1=value
             $ confset name.attr=value; name.attr1=value
+            $ confset 'name*.attr=value'
+            $ confset name.my-attr=value
+            $ confset 'name.attr=value; command'
             ```
 
         :param args: (list) List of arguments
@@ -80,8 +170,7 @@ class ConfsetArguments(object):
             ```
         """
         args = ' '.join(args).strip()
-        rgx_p = r'^(?P<namespace>[a-zA-Z0-9\-\_]+)(\.(?P<attribute>[a-zA-Z0-9\-\_]+))?(=(?P<value>.*))?$'
-        rgx_m = re.match(rgx_p, args)
+        rgx_m = ARGUMENT_RE.match(args)
         res = rgx_m.groupdict() if rgx_m else {'namespace': None, 'attribute': None, 'value': None}
         if (args and not rgx_m) or not self.verify_arguments(res):
             print(
@@ -90,6 +179,13 @@ class ConfsetArguments(object):
                 sep='\n'
             )
             sys.exit(1)
+        if res['value'] is not None:
+            try:
+                confset.confset.check_setting_name(res['namespace'], res['attribute'])
+                confset.confset.check_setting_value(res['value'])
+            except confset.ConfsetException as exc:
+                print(exc, file=sys.stderr)
+                sys.exit(1)
         return res
 
     @staticmethod
@@ -116,6 +212,8 @@ class ConfsetArguments(object):
             }
         :return: (bool) Arguments verified result
         """
+        if data['value'] is not None and (is_glob(data['namespace']) or is_glob(data['attribute'])):
+            return False
         if data['value']:
             if not data['namespace'] or not data['attribute']:
                 return False
@@ -129,23 +227,123 @@ class ConfsetArguments(object):
         Get conf filter based on the conf name and attribute
         :return: (str)
 
+            if user provides a pattern:
+                filter = 'name*.attribute*'
             if user provides conf name and attribute:
                 filter = 'name.attribute'
             else:
                 filter = ''
         """
+        if self.pattern is not None:
+            return self.pattern
         res = '%s.%s' % (self.name, self.attr) if self.name and self.attr else ''
         return res
 
     def execute(self):
         """
         Execute the actual confset command based on the args.
-        :return: N/A
+        :return: (int) exit code for --apply, otherwise N/A
         """
+        options = self.arg_options
+        if getattr(options, 'apply', None) or (
+            (getattr(options, 'check', False) or getattr(options, 'converge', False)) and self.value is not None
+        ):
+            return self.apply_manifest()
+
+        if getattr(self.arg_options, 'serve', False):
+            from confset.server import serve
+            serve()
+            return 0
+
+        if self.forward():
+            return
+
         if self.name and self.attr and self.value is not None:
             self.confset.set(self.attr, self.value)
 
+        output_format = getattr(self.arg_options, 'format', 'text')
+        if output_format in ('json', 'ndjson'):
+            writer = confset.write_json if output_format == 'json' else confset.write_ndjson
+            writer(
+                jobs=getattr(self.arg_options, 'jobs', None),
+                setting_filter=self.get_filters() or self.name,
+                regex=getattr(self.arg_options, 'regex', False)
+            )
+            return
+
+        kwargs = {}
+        if self.name is None and getattr(self.arg_options, 'jobs', None):
+            kwargs['jobs'] = self.arg_options.jobs
+        if self.name is None and getattr(self.arg_options, 'stream', False):
+            kwargs['align'] = False
+        if self.name is None and getattr(self.arg_options, 'regex', False):
+            kwargs['regex'] = True
         self.confset.print_settings(
             setting_filter=self.get_filters(),
-            info=self.arg_options.info
+            info=self.arg_options.info,
+            **kwargs
+        )
+
+    def forward(self):
+        """
+        Send the command to a running confset --serve daemon
+
+        Only plain text commands are forwarded, the others always read the
+        config files directly.  The requests include the directories this
+        process searches for config files, so the daemon only answers if it
+        searches the same ones.
+        :return: (bool) True if the daemon handled the command, False if it has to be run directly
+        """
+        options = self.arg_options
+        if (
+            getattr(options, 'format', 'text') != 'text' or getattr(options, 'stream', False) or
+            getattr(options, 'stats', False)
+        ):
+            return False
+        paths = confset.config_paths()
+        if self.name and self.attr and self.value is not None:
+            response = confset.client.request({
+                'op': 'set', 'namespace': self.name, 'key': self.attr, 'value': self.value,
+                'backup': getattr(options, 'backup', True), 'paths': paths
+            })
+            if not response or not response.get('ok'):
+                return False
+        response = confset.client.request({
+            'op': 'print', 'namespace': self.name, 'filter': self.get_filters(), 'info': bool(options.info),
+            'regex': getattr(options, 'regex', False), 'paths': paths
+        })
+        if not response or not response.get('ok'):
+            return False
+        sys.stdout.write(response['output'])
+        return True
+
+    def apply_manifest(self):
+        """
+        Apply the settings in the --apply manifest, or the name.attr=value setting with --check or
+        --converge, and print a summary line per file
+        :return: (int) 1 if a file could not be updated or, with --check, if any setting differs, otherwise 0
+        """
+        check = getattr(self.arg_options, 'check', False)
+        if getattr(self.arg_options, 'apply', None):
+            try:
+                changes = confset.manifest.read_manifest(
+                    self.arg_options.apply, manifest_format=getattr(self.arg_options, 'manifest_format', None)
+                )
+            except (confset.ConfsetException, IOError) as exc:
+                print('Unable to read the manifest: %s' % exc, file=sys.stderr)
+                return 1
+        else:
+            changes = {self.name: {self.attr: self.value}}
+        results = confset.manifest.apply_manifest(
+            changes,
+            jobs=getattr(self.arg_options, 'jobs', None) or confset.manifest.DEFAULT_JOBS,
+            backup=getattr(self.arg_options, 'backup', True),
+            check=check
         )
+        if results:
+            print(confset.manifest.format_results(
+                results, show_changes=check or getattr(self.arg_options, 'converge', False), check=check
+            ))
+        if any(result.error for result in results):
+            return 1
+        return 1 if check and any(result.changed for result in results) else 0
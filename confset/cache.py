@@ -0,0 +1,294 @@
+# Copyright (c) 2012-2015, Dwight Hubbard.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+On-disk cache of parsed configuration files
+
+Each entry is keyed by the identity of the configuration file (path, inode,
+size and modification time in nanoseconds) and holds the parsed settings so
+an unchanged file does not have to be parsed again.
+
+The key index of a file, see store_index(), is a JSON header line followed
+by fixed width records sorted by setting name, so a single setting is found
+with a binary search without reading the rest of the index.
+"""
+import bisect
+import logging
+import os
+import struct
+import threading
+
+
+MAX_CACHE_BYTES = 8 * 1024 * 1024
+SETTINGS_SUFFIX = '.json'
+INDEX_SUFFIX = '.index'
+STATE_SUFFIX = '.state.json'
+ENTRY_SUFFIXES = (SETTINGS_SUFFIX, INDEX_SUFFIX, STATE_SUFFIX)
+# The help_start, line_start, value_start and value_end offsets of a setting in the key index
+INDEX_SPAN = struct.Struct('>qqqq')
+EVICT_INTERVAL = 64
+MAX_ENTRY_NAME = 255
+# Entries stored with a different version were made by an incompatible parser and are ignored
+FORMAT_VERSION = 2
+_stores_until_evict = 0
+logger = logging.getLogger(__name__)
+
+
+def file_identity(filename, file_descriptor=None):
+    """
+    Get the identity of a file
+
+    :param filename: Full path of the file
+    :param file_descriptor: Open file descriptor of the file to fstat instead of looking up filename
+    :return: (list) [path, inode, size, mtime_ns] or None if the file can't be stat'ed
+    """
+    try:
+        if file_descriptor is None:
+            stat_result = os.stat(filename)
+        else:
+            stat_result = os.fstat(file_descriptor)
+    except OSError:
+        return None
+    return [os.path.abspath(filename), stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns]
+
+
+def entry_filename(cache_dir, filename, suffix=SETTINGS_SUFFIX):
+    """
+    Get the cache entry filename for a configuration file
+    :param cache_dir:
+    :param filename:
+    :param suffix: Kind of entry, SETTINGS_SUFFIX, INDEX_SUFFIX or STATE_SUFFIX
+    :return: (str) Full path of the cache entry
+    """
+    name = os.path.abspath(filename).replace('%', '%25').replace(os.sep, '%2F')
+    if len(name) + len(suffix) > MAX_ENTRY_NAME:
+        import hashlib
+        name = hashlib.sha1(name.encode('utf-8', 'surrogateescape')).hexdigest()
+    return os.path.join(cache_dir, name + suffix)
+
+
+def load(cache_dir, filename, identity, suffix=SETTINGS_SUFFIX):
+    """
+    Load a cached parse result
+
+    :param cache_dir: Directory holding the cache entries
+    :param filename: Configuration file the entry belongs to
+    :param identity: The current identity of the configuration file
+    :param suffix: Kind of entry, SETTINGS_SUFFIX or STATE_SUFFIX
+    :return: (dict) The cached data or None if there is no valid entry
+    """
+    if not cache_dir or not identity:
+        return None
+    import json
+    try:
+        with open(entry_filename(cache_dir, filename, suffix)) as file_handle:
+            entry = json.load(file_handle)
+    except (IOError, OSError, ValueError):
+        return None
+    if entry.get('identity') != identity or entry.get('version') != FORMAT_VERSION:
+        return None
+    return entry.get('data')
+
+
+def load_entry(cache_dir, filename, suffix=SETTINGS_SUFFIX):
+    """
+    Load a cache entry whatever the identity it was stored with
+    :param cache_dir: Directory holding the cache entries
+    :param filename: Configuration file the entry belongs to
+    :param suffix: Kind of entry, SETTINGS_SUFFIX or STATE_SUFFIX
+    :return: (tuple) the identity the entry was stored with and the data, (None, None) if there is no entry
+    """
+    if not cache_dir:
+        return None, None
+    import json
+    try:
+        with open(entry_filename(cache_dir, filename, suffix)) as file_handle:
+            entry = json.load(file_handle)
+    except (IOError, OSError, ValueError):
+        return None, None
+    if entry.get('version') != FORMAT_VERSION:
+        return None, None
+    return entry.get('identity'), entry.get('data')
+
+
+def store(cache_dir, filename, identity, data, max_bytes=None, suffix=SETTINGS_SUFFIX):
+    """
+    Store a parse result in the cache
+
+    Failures are logged and ignored, the cache is only an optimization.
+
+    :param cache_dir: Directory holding the cache entries
+    :param filename: Configuration file the entry belongs to
+    :param identity: The identity of the configuration file that was parsed
+    :param data: JSON serializable parse result
+    :param max_bytes: Maximum size of the cache directory, defaults to MAX_CACHE_BYTES
+    :param suffix: Kind of entry, SETTINGS_SUFFIX or STATE_SUFFIX
+    """
+    if not cache_dir or not identity:
+        return
+    import json
+    content = json.dumps({'version': FORMAT_VERSION, 'identity': identity, 'data': data}).encode('utf-8')
+    _write_entry(cache_dir, filename, suffix, content, max_bytes)
+
+
+def store_index(cache_dir, filename, identity, spans, width, max_bytes=None):
+    """
+    Store the key index of a configuration file
+
+    The settings are stored as records of the setting name, padded with NUL
+    bytes to the longest name, and the span offsets packed with INDEX_SPAN,
+    sorted by name.  Failures are logged and ignored.
+
+    :param cache_dir: Directory holding the cache entries
+    :param filename: Configuration file the index belongs to
+    :param identity: The identity of the configuration file that was parsed
+    :param spans: (dict) [help_start, line_start, value_start, value_end] keyed by 'file.KEY'
+    :param width: The key column width of the file
+    :param max_bytes: Maximum size of the cache directory, defaults to MAX_CACHE_BYTES
+    """
+    if not cache_dir or not identity:
+        return
+    import json
+    records = sorted((long_key.encode('utf-8', 'surrogateescape'), span) for long_key, span in spans.items())
+    key_size = max([len(key) for key, span in records] or [0])
+    header = {'version': FORMAT_VERSION, 'identity': identity, 'width': width, 'key_size': key_size, 'count': len(records)}
+    chunks = [json.dumps(header).encode('utf-8'), b'\n']
+    pack = INDEX_SPAN.pack
+    for key, span in records:
+        chunks.append(key.ljust(key_size, b'\0'))
+        chunks.append(pack(*span))
+    _write_entry(cache_dir, filename, INDEX_SUFFIX, b''.join(chunks), max_bytes)
+
+
+class _IndexKeys(object):
+    """
+    Sequence of the padded setting names in a key index file, read on demand for bisect
+    """
+
+    def __init__(self, file_handle, offset, key_size, count):
+        self.file_handle = file_handle
+        self.offset = offset
+        self.key_size = key_size
+        self.record_size = key_size + INDEX_SPAN.size
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, position):
+        self.file_handle.seek(self.offset + position * self.record_size)
+        return self.file_handle.read(self.key_size)
+
+    def span(self, position):
+        self.file_handle.seek(self.offset + position * self.record_size + self.key_size)
+        return list(INDEX_SPAN.unpack(self.file_handle.read(INDEX_SPAN.size)))
+
+
+def load_index(cache_dir, filename, identity, long_keys=None):
+    """
+    Look settings up in the key index of a configuration file
+
+    Each setting is found with a binary search, so only a few records of the
+    index are read whatever the size of the file.
+
+    :param cache_dir: Directory holding the cache entries
+    :param filename: Configuration file the index belongs to
+    :param identity: The current identity of the configuration file
+    :param long_keys: 'file.KEY' names of the settings to look up, all of them if None
+    :return: (dict) with the 'spans' of the settings that are in the file and the key column 'width',
+             or None if there is no valid index
+    """
+    if not cache_dir or not identity:
+        return None
+    import json
+    spans = {}
+    try:
+        with open(entry_filename(cache_dir, filename, INDEX_SUFFIX), 'rb') as file_handle:
+            header = json.loads(file_handle.readline().decode('utf-8'))
+            if header.get('identity') != identity or header.get('version') != FORMAT_VERSION:
+                return None
+            keys = _IndexKeys(file_handle, file_handle.tell(), header['key_size'], header['count'])
+            if long_keys is None:
+                for position in range(len(keys)):
+                    spans[keys[position].rstrip(b'\0').decode('utf-8', 'surrogateescape')] = keys.span(position)
+            for long_key in long_keys or ():
+                key = long_key.encode('utf-8', 'surrogateescape')
+                if len(key) > keys.key_size:
+                    continue
+                key = key.ljust(keys.key_size, b'\0')
+                position = bisect.bisect_left(keys, key)
+                if position < len(keys) and keys[position] == key:
+                    spans[long_key] = keys.span(position)
+    except (IOError, OSError, ValueError, KeyError, struct.error):
+        return None
+    return {'spans': spans, 'width': header.get('width')}
+
+
+def _write_entry(cache_dir, filename, suffix, content, max_bytes=None):
+    """
+    Atomically write a cache entry and evict old entries from time to time
+    :param cache_dir: Directory holding the cache entries
+    :param filename: Configuration file the entry belongs to
+    :param suffix: Kind of entry, SETTINGS_SUFFIX, INDEX_SUFFIX or STATE_SUFFIX
+    :param content: (bytes) Contents of the entry
+    :param max_bytes: Maximum size of the cache directory, defaults to MAX_CACHE_BYTES
+    """
+    global _stores_until_evict
+    entry = entry_filename(cache_dir, filename, suffix)
+    temp_entry = '%s.%d.%d.tmp' % (entry, os.getpid(), threading.get_ident())
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, 0o700)
+        # Entries hold the values of every setting, which may be secrets, so only the owner can read them
+        with os.fdopen(os.open(temp_entry, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as file_handle:
+            file_handle.write(content)
+        os.replace(temp_entry, entry)
+    except (IOError, OSError) as exc:
+        logger.debug('Unable to cache settings for %s: %s', filename, exc)
+        return
+    # Scanning the cache directory costs a stat() per entry, so only check the
+    # size on the first store and then every EVICT_INTERVAL stores.
+    if _stores_until_evict <= 0:
+        _stores_until_evict = EVICT_INTERVAL
+        evict(cache_dir, max_bytes=max_bytes)
+    _stores_until_evict -= 1
+
+
+def evict(cache_dir, max_bytes=None):
+    """
+    Remove the oldest cache entries until the cache is smaller than max_bytes
+
+    :param cache_dir: Directory holding the cache entries
+    :param max_bytes: Maximum size of the cache directory, defaults to MAX_CACHE_BYTES
+    """
+    if max_bytes is None:
+        max_bytes = MAX_CACHE_BYTES
+    entries = []
+    total = 0
+    try:
+        iterator = os.scandir(cache_dir)
+        try:
+            for dir_entry in iterator:
+                if not dir_entry.name.endswith(ENTRY_SUFFIXES):
+                    continue
+                stat_result = dir_entry.stat()
+                entries.append((stat_result.st_mtime_ns, stat_result.st_size, dir_entry.path))
+                total += stat_result.st_size
+        finally:
+            # The iterator can only be closed early from Python 3.6, before that it is closed once exhausted
+            if hasattr(iterator, 'close'):
+                iterator.close()
+    except OSError:
+        return
+    if total <= max_bytes:
+        return
+    entries.sort()
+    for mtime, size, path in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        logger.debug('Evicted cache entry %s', path)
+        total -= size
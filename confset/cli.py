@@ -1,15 +1,20 @@
 import sys
+from . import stats
 from .arguments import ConfsetArguments, create_arg_parser
 
 
 def main():
     parser = create_arg_parser()
     (options, args) = parser.parse_args()
-    confset = ConfsetArguments(args, options)
+    result = 0
+    with stats.collect() as collected:
+        confset = ConfsetArguments(args, options)
 
-    try:
-        confset.execute()
-    except FileNotFoundError:
-        print('No writable configuration directories found', file=sys.stderr)
-        return 1
-    return 0
+        try:
+            result = confset.execute() or 0
+        except FileNotFoundError:
+            print('No writable configuration directories found', file=sys.stderr)
+            result = 1
+    if options.stats:
+        print(collected.format(options.stats_format), file=sys.stderr)
+    return result
@@ -0,0 +1,53 @@
+# Copyright (c) 2012-2015, Dwight Hubbard.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Client for the confset daemon started with confset --serve
+
+Requests and responses are single lines of JSON, see confset.server for the
+operations.  request() returns None when there is no daemon listening, so
+callers can fall back to reading the config files directly.
+"""
+import logging
+import os
+from . import confset
+
+
+SOCKET_NAME = 'confset.sock'
+TIMEOUT = 5.0
+logger = logging.getLogger(__name__)
+
+
+def socket_path():
+    """
+    Get the path of the daemon socket
+    :return: (str) The CONFSET_SOCKET environment variable, or confset.sock in METADATA_DIR
+    """
+    return os.environ.get('CONFSET_SOCKET') or os.path.join(confset.METADATA_DIR, SOCKET_NAME)
+
+
+def request(message, path=None, timeout=TIMEOUT):
+    """
+    Send a request to the daemon
+    :param message: (dict) Request with at least an 'op'
+    :param path: Socket path, defaults to socket_path()
+    :param timeout: Seconds to wait for the daemon
+    :return: (dict) The response or None if no daemon answered
+    """
+    if path is None:
+        path = socket_path()
+    if not os.path.exists(path):
+        return None
+    import json
+    import socket
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.settimeout(timeout)
+            connection.connect(path)
+            connection.sendall(json.dumps(message).encode('utf-8') + b'\n')
+            with connection.makefile('rb') as file_handle:
+                line = file_handle.readline()
+        return json.loads(line.decode('utf-8'))
+    except (OSError, ValueError) as exc:
+        logger.debug('No answer from the confset daemon at %s: %s', path, exc)
+        return None
@@ -5,35 +5,273 @@
 """
 Manage package settings
 """
-import copy
+import collections
+import contextlib
+from collections.abc import Mapping
+import io
 import os
+import re
 import sys
-import shutil
+import stat
+import threading
 import time
 import logging
+from . import cache
+from . import shell
+from . import stats
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
 
 
 CONF_PATH = ['/etc/default', '/etc/sysconfig']
 METADATA_DIR = '/etc/confset'
+CACHE_DIR = os.path.join(METADATA_DIR, 'cache')
+LOCK_DIR = os.path.join(METADATA_DIR, 'locks')
+LOCK_SUFFIX = '.lock'
 logger = logging.getLogger(__name__)
+_directory_cache = {}
+_paths_cache = {}
+_layout_cache = {}
+MAX_LAYOUTS = 16
+_help_blocks = {}
+MAX_HELP_BLOCKS = 4096
+# Conf files at least this large are memory mapped instead of read when parsed
+MMAP_THRESHOLD = 1024 * 1024
+# A conf file name, which is the namespace of its settings
+NAMESPACE_RE = re.compile(r'[a-zA-Z0-9\-_]+')
+SettingRecord = collections.namedtuple('SettingRecord', ['namespace', 'key', 'value', 'help'])
+ResolvedSetting = collections.namedtuple('ResolvedSetting', ['setting', 'layer', 'filename'])
 
 
 class ConfsetException(Exception):
     pass
 
 
+class ConfsetConflict(ConfsetException):
+    """
+    A setting was changed by another process since the conf file was read
+    :param filename: The conf file
+    :param keys: The 'file.KEY' names of the conflicting settings
+    """
+
+    def __init__(self, filename, keys):
+        self.filename = filename
+        self.keys = keys
+        ConfsetException.__init__(
+            self, '%s was changed by another process, conflicting settings: %s' % (filename, ', '.join(keys))
+        )
+
+
+class Setting(object):
+    """
+    The value and help text of a single setting
+
+    The help text is stored as a tuple of interned lines, so identical help
+    text is only held in memory once.  For compatibility with older versions
+    a Setting can also be used as a dictionary with the 'value' and 'help'
+    keys, setting['help'] returns a list.  Changing them that way keeps the
+    values the setting had before, so the conf file is still patched in
+    place when it is written.
+    :param value: The value as written in the conf file, including any shell quoting
+    :param help_text: (list) lines of help text or a str with one line per line of text
+    :param unquoted: The value with the shell quoting removed, worked out from value if not given
+    """
+    __slots__ = ('value', 'help', '_unquoted', '_original')
+    __hash__ = None
+
+    def __init__(self, value='', help_text=(), unquoted=None):
+        self.value = value
+        self.help = intern_help(help_text)
+        self._unquoted = unquoted
+        self._original = None
+
+    @property
+    def original(self):
+        """
+        The setting as it was before it was first changed with setting['value'] or setting['help']
+        """
+        if self._original is None:
+            return self
+        return Setting(*self._original)
+
+    @property
+    def unquoted(self):
+        """
+        The value with the shell quoting and escapes removed, see confset.shell.unquote()
+        """
+        if self._unquoted is None:
+            self._unquoted = shell.unquote(self.value)
+        return self._unquoted
+
+    def __getitem__(self, name):
+        if name == 'value':
+            return self.value
+        if name == 'help':
+            return list(self.help)
+        raise KeyError(name)
+
+    def __setitem__(self, name, value):
+        if name not in ('value', 'help'):
+            raise KeyError(name)
+        if self._original is None:
+            self._original = (self.value, self.help)
+        if name == 'value':
+            self.value = value
+            self._unquoted = None
+        else:
+            self.help = intern_help(value)
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return ['help', 'value']
+
+    def as_dict(self):
+        """
+        :return: (dict) with the 'help' and 'value' of the setting
+        """
+        return {'help': list(self.help), 'value': self.value}
+
+    def __eq__(self, other):
+        if isinstance(other, Setting):
+            return self.value == other.value and self.help == other.help
+        if isinstance(other, dict):
+            return self.as_dict() == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __repr__(self):
+        return 'Setting(value=%r, help_text=%r)' % (self.value, list(self.help))
+
+
+def intern_help(help_text):
+    """
+    Get the shared copy of a help text
+    :param help_text: (list) lines of help text or a str with one line per line of text
+    :return: (tuple) of interned lines
+    """
+    if isinstance(help_text, str):
+        help_text = help_text.split(os.linesep)
+    help_text = tuple(sys.intern(line) for line in help_text or ())
+    if not help_text:
+        return ()
+    shared = _help_blocks.get(help_text)
+    if shared is None:
+        if len(_help_blocks) >= MAX_HELP_BLOCKS:
+            _help_blocks.clear()
+        shared = _help_blocks[help_text] = help_text
+    return shared
+
+
 class ConfigSettings(object):
     """
     Configuration settings class
+
+    The conf file is not parsed until the settings are first accessed.
     :param conffile:
+    :param use_cache: Reuse the parsed settings from the on-disk cache in CACHE_DIR when the file is unchanged
+    :param backup: Keep a timestamped backup of the conf file each time it is written
+    :param preserve_format: Only patch the changed settings when writing instead of regenerating the whole file
+    :param confpath: Directories to search for the conf file in order of precedence, defaults to config_paths()
     """
 
-    def __init__(self, conffile=None):
-        self.confpath = config_paths()
+    def __init__(self, conffile=None, use_cache=True, backup=True, preserve_format=True, confpath=None):
+        self.confpath = config_paths() if confpath is None else list(confpath)
         self.conffile = conffile
+        self.use_cache = use_cache
+        self.backup = backup
         self.filename = self.search_for_conf(conffile)
-        self.settings, self.order = self.available_settings()
-        self.__dict__.update(self.settings)
+        self.preserve_format = preserve_format
+        self._settings = None
+        self._order = None
+        self._spans = {}
+        self._baseline = {}
+        self._identity = None
+        self._width = None
+        # Settings passed to set() since the file was read, they are written even if the file changed to another value
+        self._assigned = set()
+        self._batch_depth = 0
+        self._lock = threading.RLock()
+
+    def __getattr__(self, name):
+        # Settings are also available as attributes named 'file.KEY'.  Other names are real attributes,
+        # falling back to the settings for those would recurse if loading raised AttributeError.
+        if '.' not in name:
+            raise AttributeError(name)
+        try:
+            return self.settings[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    @property
+    def settings(self):
+        """
+        The Setting objects in the conf file, keyed by 'file.KEY'
+        """
+        self.load()
+        return self._settings
+
+    @settings.setter
+    def settings(self, value):
+        self._settings = value
+        self._width = None
+
+    @property
+    def order(self):
+        """
+        The 'file.KEY' setting names in the order they appear in the conf file
+        """
+        self.load()
+        return self._order
+
+    @order.setter
+    def order(self, value):
+        self._order = value
+
+    def load(self):
+        """
+        Parse the conf file if it has not been loaded yet
+        """
+        if self._settings is None or self._order is None:
+            self._set_parsed(self.read_settings())
+
+    def _set_parsed(self, parsed):
+        """
+        Make a parse result the current state of the object
+        :param parsed: (dict) parse result from read_settings()
+        """
+        self._settings = parsed['settings']
+        self._order = parsed['order']
+        self._spans = parsed['spans']
+        self._identity = parsed['identity']
+        self._width = parsed.get('width')
+        self._baseline = dict(self._settings)
+        self._assigned = set()
+
+    def _changed_on_disk(self):
+        """
+        Check if the conf file changed since it was read
+        :return: (bool)
+        """
+        return bool(self.filename) and cache.file_identity(self.filename) != self._identity
+
+    def _baseline_setting(self, long_key):
+        """
+        Get a setting as it was read from the conf file
+        :param long_key: 'file.KEY' name of the setting
+        :return: (Setting) or None if the file did not have the setting
+        """
+        setting = self._baseline.get(long_key)
+        return setting if setting is None else setting.original
 
     # noinspection PyMethodMayBeStatic
     def search_for_conf(self, conffile):
@@ -42,14 +280,11 @@ class ConfigSettings(object):
         :param conffile:
         :return:
         """
-        filename = None
-        for d in self.confpath:
-            filename = os.path.join(d, self.conffile)
-            if os.path.isfile(filename) and os.access(filename, os.R_OK):
-                break
-            else:
-                filename = None
-        return filename
+        with stats.timer('discovery'):
+            for filename in config_layout(self.confpath).get(self.conffile, ()):
+                if os.access(filename, os.R_OK):
+                    return filename
+        return None
 
     def empty_conf_file(self):
         """
@@ -68,219 +303,1341 @@ class ConfigSettings(object):
         Return the settings available in a conf file
         :return:
         """
-        comments = []
-        order = []
-        result_settings = {}
-        if self.filename:
-            fh = open(self.filename, 'r')
-            for line in fh.readlines():
-                line = line.strip()
-                if line:
-                    if line.startswith('#'):
-                        temp = line.strip('#').strip()
-                        if temp:
-                            comments.append(temp)
-                    else:
-                        if '=' in line:
-                            setting = '%s.%s' % (
-                                self.conffile, line.split('=')[0])
-                            result_settings[setting] = {
-                                'help': comments,
-                                'value': '='.join(line.split('=')[1:]).strip()
-                            }
-                            comments = []
-                            order.append(setting)
-                else:
-                    comments = []
-        return result_settings, order
+        parsed = self.read_settings()
+        return parsed['settings'], parsed['order']
+
+    def read_settings(self):
+        """
+        Read and parse the conf file
+
+        The parse result is cached in CACHE_DIR keyed by the identity of the file
+        and reused for as long as the file is unchanged.
+        :return: (dict) with the settings, order, spans, key column width and identity of the file
+        """
+        if not self.filename:
+            return {'settings': {}, 'order': [], 'spans': {}, 'width': 1, 'identity': None}
+        with stats.timer('parse'):
+            cache_dir = CACHE_DIR if self.use_cache else None
+            identity = cache.file_identity(self.filename) if cache_dir else None
+            cached = cache.load(cache_dir, self.filename, identity)
+            if cached and 'records' in cached:
+                stats.count('cache_hits')
+                return {
+                    'settings': dict(
+                        (long_key, Setting(value, help_text)) for long_key, (value, help_text) in cached['records'].items()
+                    ),
+                    'order': cached['order'],
+                    'spans': cached['spans'],
+                    'width': cached.get('width'),
+                    'identity': identity
+                }
+            parsed = self.parse_settings()
+            if identity and identity == parsed['identity']:
+                self._store_cache(parsed)
+        return parsed
+
+    def _store_cache(self, parsed):
+        if self.use_cache and parsed['identity']:
+            cache.store(
+                CACHE_DIR, self.filename, parsed['identity'],
+                {
+                    'records': dict(
+                        (long_key, [setting.value, setting.help]) for long_key, setting in parsed['settings'].items()
+                    ),
+                    'order': parsed['order'],
+                    'spans': parsed['spans'],
+                    'width': parsed['width']
+                }
+            )
+            cache.store_index(CACHE_DIR, self.filename, parsed['identity'], parsed['spans'], parsed['width'])
+
+    def read_index(self, long_keys=None):
+        """
+        Get the key index of the conf file
+
+        The index maps each setting to its byte span in the file and is kept
+        in CACHE_DIR alongside the identity of the file, see
+        cache.store_index().  Looking up a few settings only reads their
+        records.  If there is no valid index the file is loaded, which
+        creates it.
+        :param long_keys: 'file.KEY' names of the settings to get the spans of, all of them if None
+        :return: (dict) with the spans of the settings that are in the file, the key column width and the
+                 identity of the file
+        """
+        identity = cache.file_identity(self.filename)
+        index = cache.load_index(CACHE_DIR if self.use_cache else None, self.filename, identity, long_keys)
+        if index is None:
+            self.load()
+            spans = self._spans
+            if long_keys is not None:
+                spans = dict((long_key, spans[long_key]) for long_key in long_keys if long_key in spans)
+            return {'spans': spans, 'width': self.key_max_column_width(), 'identity': self._identity}
+        index['identity'] = identity
+        return index
+
+    def _read_indexed(self, long_keys):
+        """
+        Read individual settings by seeking to them in the conf file using the key index
+
+        Falls back to loading the whole file if the index is out of date.
+        :param long_keys: 'file.KEY' setting names
+        :return: (tuple) dict of the settings that were found and the key column width of the file
+        """
+        index = self.read_index(long_keys)
+        if self._settings is None:
+            found = self._seek_settings(index, long_keys)
+            if found is not None:
+                return found, index['width']
+        return dict((key, self.settings[key]) for key in long_keys if key in self.settings), self.key_max_column_width()
+
+    def _seek_settings(self, index, long_keys):
+        spans = [(long_key, index['spans'][long_key]) for long_key in long_keys if long_key in index['spans']]
+        if any(span[0] < 0 for long_key, span in spans):
+            return None
+        found = {}
+        if not spans:
+            return found
+        with stats.timer('parse'), open(self.filename, 'rb') as file_handle:
+            if cache.file_identity(self.filename, file_handle.fileno()) != index['identity']:
+                return None
+            stats.count('files_parsed')
+            for long_key, span in spans:
+                help_start, line_start, value_start, value_end = span
+                file_handle.seek(help_start)
+                data = file_handle.read(value_end - help_start)
+                stats.count('bytes_read', len(data))
+                parsed = parse_config(data, self.conffile)
+                if long_key in parsed['settings']:
+                    found[long_key] = parsed['settings'][long_key]
+        return found
 
-    def write_settings(self):
+    def get_setting(self, key):
+        """
+        Get a single setting from the conf file
+
+        If the conf file has not been loaded only the setting itself is read
+        from the file, using the key index.
+        :param key: Setting name without the file prefix
+        :return: (Setting) or None if it is not set
+        """
+        long_key = '%s.%s' % (self.conffile, key)
+        if self._settings is None and self.filename:
+            found, width = self._read_indexed([long_key])
+            return found.get(long_key)
+        return self.settings.get(long_key)
+
+    def parse_settings(self, lock=True):
+        """
+        Parse the settings in the conf file
+
+        Files of MMAP_THRESHOLD bytes or more are memory mapped and scanned in
+        place rather than read into memory.
+        :param lock: Hold a shared lock while reading the file, see file_lock()
+        :return: (dict) with the settings, order, spans, key column width and identity of the file
+        """
+        with file_lock(self.filename, exclusive=False) if lock else contextlib.suppress(), \
+                open(self.filename, 'rb') as file_handle:
+            identity = cache.file_identity(self.filename, file_handle.fileno())
+            size = os.fstat(file_handle.fileno()).st_size
+            stats.count('files_parsed')
+            stats.count('bytes_read', size)
+            if not size or size < MMAP_THRESHOLD:
+                parsed = parse_config(file_handle.read(), self.conffile)
+            else:
+                import mmap
+                with mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    parsed = parse_config(data, self.conffile)
+        parsed['identity'] = identity
+        return parsed
+
+    def write_settings(self, backup=None):
         """
         Commit the current self.settings to disk
+
+        The read-modify-write holds an exclusive lock on the conf file, see
+        file_lock().  If another process changed the file since it was read
+        the local changes are applied on top of its current contents, so
+        writers changing different settings don't lose each other's updates.
+        If preserve_format is set only the changed settings are patched,
+        leaving the rest of the file byte for byte identical, see
+        patch_settings().  Otherwise the file is regenerated from the
+        settings.  Either way the file is replaced atomically, see
+        atomic_write().
+        :param backup: Keep a timestamped backup of the existing file, defaults to self.backup
+        :raises ConfsetConflict: if another process changed one of the changed settings to a different value
         :return:
         """
-        if self.filename:
-            if os.path.exists(self.filename):
-                newname = '%s.confset.%s' % (self.filename, time.strftime("%Y%m%d%H%M%S"))
-                logger.debug(
-                    'Backing up existing config file: %s to %s', self.filename, newname
-                )
-                shutil.copy(self.filename, newname)
-        else:
+        if backup is None:
+            backup = self.backup
+        self.load()
+        for long_key, setting in self._settings.items():
+            if isinstance(setting, dict):
+                # Settings assigned as {'value': ..., 'help': [...]} dicts, as older versions stored them
+                self._settings[long_key] = Setting(setting.get('value', ''), setting.get('help', ()))
+        if not self.filename:
             self.filename = self.empty_conf_file()
         logger.debug('Writing to: %s', self.filename)
         if self.filename:
-            with open(self.filename, 'w') as file_handle:
-                for long_key in self.order:
-                    short_key = '.'.join(long_key.split('.')[1:])
-                    value = self.settings[long_key].get('value', '')
-                    help_text = self.settings[long_key].get('help', [])
-                    if isinstance(help_text, str):
-                        help_text = help_text.split(os.linesep)
-                    logger.debug('Writing: %s=%s' % (short_key, value))
-                    if help_text:
-                        file_handle.write('\n')
-                        for line in help_text:
-                            file_handle.write('# %s\n' % line.strip())
-                    file_handle.write('{0}={1}\n\n'.format(short_key, value))
+            with stats.timer('write'), file_lock(self.filename):
+                if not self._rebase():
+                    logger.debug('%s already has the settings, not writing it', self.filename)
+                    return
+                data = self.patch_settings() if self.preserve_format else None
+                if data is None:
+                    data = self.render_settings()
+                atomic_write(self.filename, data, backup=backup)
+                parsed = parse_config(data, self.conffile)
+                parsed['identity'] = cache.file_identity(self.filename)
+                self._set_parsed(parsed)
+                self._store_cache(parsed)
+
+    def _rebase(self):
+        """
+        Apply the local changes on top of the conf file if it changed since it was read
+
+        Changes are detected by comparing the identity (inode, size and
+        modification time) of the file with the one it had when it was read.
+        Settings passed to set() count as changed even if they were set to
+        the value they had when the file was read.
+        :raises ConfsetConflict: if a setting changed here was also changed on disk, to a different value
+        :return: (bool) False if the file already has all the local changes and doesn't need to be written
+        """
+        identity = cache.file_identity(self.filename)
+        if identity is None or identity == self._identity:
+            return True
+        changed = collections.OrderedDict(
+            (long_key, self._settings[long_key]) for long_key in self._order
+            if long_key in self._assigned or self._baseline_setting(long_key) != self._settings[long_key]
+        )
+        removed = [long_key for long_key in self._baseline if long_key not in self._settings]
+        # This process already holds the exclusive lock
+        parsed = self.parse_settings(lock=False)
+        current = parsed['settings']
+        conflicts = sorted(
+            long_key for long_key in list(changed) + removed
+            if current.get(long_key) != self._baseline_setting(long_key) and current.get(long_key) != changed.get(long_key)
+        )
+        if conflicts:
+            raise ConfsetConflict(self.filename, conflicts)
+        assigned = self._assigned
+        self._set_parsed(parsed)
+        if all(current.get(long_key) == setting for long_key, setting in changed.items()) and not any(
+            long_key in current for long_key in removed
+        ):
+            return False
+        logger.debug('%s changed since it was read, applying %d changes to it', self.filename, len(changed) + len(removed))
+        stats.count('rebases')
+        settings = dict(current)
+        order = list(parsed['order'])
+        for long_key in removed:
+            if settings.pop(long_key, None) is not None:
+                order.remove(long_key)
+        for long_key, setting in changed.items():
+            if long_key not in settings:
+                order.append(long_key)
+            settings[long_key] = setting
+        self._settings = settings
+        self._order = order
+        self._assigned = assigned
+        self._width = None
+        return True
+
+    def render_settings(self):
+        """
+        Generate the contents of the conf file from the settings
+        :return: (bytes)
+        """
+        lines = []
+        for long_key in self.order:
+            short_key = '.'.join(long_key.split('.')[1:])
+            lines.append(_render_setting(short_key, self.settings[long_key]))
+            lines.append('\n')
+        return ''.join(lines).encode('utf-8', 'surrogateescape')
+
+    def patch_settings(self):
+        """
+        Generate the contents of the conf file by patching only the changed settings
+
+        Removed settings are cut out of the file along with their help text.
+        A help text that can't be replaced as a whole, because the comment
+        block is interrupted by other lines, is written as a new block just
+        before the setting, separated from the old one by an empty line.
+        :return: (bytes) or None if the file can't be patched because it changed on disk since it was read
+        """
+        if not self._identity or self._identity != cache.file_identity(self.filename):
+            return None
+        with open(self.filename, 'rb') as file_handle:
+            data = file_handle.read()
+        edits = []
+        appended = []
+        for long_key, (help_start, line_start, value_start, value_end) in self._spans.items():
+            if long_key not in self.settings:
+                match = shell.LINE_BREAK_RE.search(data, value_end)
+                edits.append((line_start if help_start < 0 else help_start, match.end() if match else len(data), ''))
+        for long_key in self.order:
+            setting = self.settings[long_key]
+            if long_key not in self._spans:
+                appended.append('\n' + _render_setting('.'.join(long_key.split('.')[1:]), setting))
+                continue
+            help_start, line_start, value_start, value_end = self._spans[long_key]
+            baseline = self._baseline_setting(long_key)
+            if setting.help != baseline.help:
+                help_text = ''.join('# %s\n' % line.strip() for line in setting.help)
+                if help_start < 0:
+                    edits.append((line_start, line_start, '\n' + help_text))
+                else:
+                    edits.append((help_start, line_start, help_text))
+            if setting.value != baseline.value:
+                edits.append((value_start, value_end, setting.value))
+        if not edits and not appended:
+            return data
+        chunks = []
+        position = 0
+        for start, end, replacement in sorted(edits):
+            chunks.append(data[position:start])
+            chunks.append(replacement.encode('utf-8', 'surrogateescape'))
+            position = end
+        chunks.append(data[position:])
+        if appended:
+            if data and not data.endswith(b'\n'):
+                chunks.append(b'\n')
+            chunks.append(''.join(appended).encode('utf-8', 'surrogateescape'))
+        return b''.join(chunks)
 
     def key_max_column_width(self):
         """
-        Determine the max length of the key names
-        :return:
+        Determine the width of the widest 'file.KEY=value' column
+
+        The width is computed while parsing and kept up to date by set(), so
+        this only scans the settings if they were replaced wholesale.
+        :return: (int)
         """
-        max_len = 1
-        for setting in self.settings.keys():
-            if len(setting) + len(self.settings[setting]['value']) + 1 > max_len:
-                max_len = len(setting) + len(
-                    self.settings[setting]['value']) + 1
-        return max_len
+        self.load()
+        if self._width is None:
+            self._width = _column_width(self._settings)
+        return self._width
 
     def print_settings(
             self, setting_filter=None, sort=False, key_column_width=None,
-            info=None
+            info=None, stream=None
     ):
         """
         Print the current settings
+
+        The output is rendered by format_settings() and written with a single
+        write() call.
         :param info:
         :param key_column_width:
-        :param setting_filter:
+        :param setting_filter: Only print the 'file.KEY' settings matching this glob or SettingFilter
         :param sort:
+        :param stream: File object to write to, defaults to sys.stdout
         """
-        if sort:
-            temp = self.settings.keys()
-            temp.sort()
+        with stats.timer('render'):
+            output = self.format_settings(
+                setting_filter=setting_filter, sort=sort, key_column_width=key_column_width, info=info
+            )
+            if output:
+                (stream or sys.stdout).write(output)
+
+    def format_settings(self, setting_filter=None, sort=False, key_column_width=None, info=None):
+        """
+        Render the current settings as print_settings() shows them
+        :param setting_filter: Only render the 'file.KEY' settings matching this glob or SettingFilter
+        :param sort: Render the settings sorted by name instead of in file order
+        :param key_column_width: Column to align the help text at, 0 for no alignment, defaults to the widest setting
+        :param info: Include the help text of the settings
+        :return: (str)
+        """
+        setting_filter = _setting_filter(setting_filter)
+        exact = setting_filter.exact if setting_filter else None
+        if exact and self._settings is None and self.filename:
+            # Point lookup, only read the requested setting from the file
+            current_settings, max_len = self._read_indexed([exact])
+            temp = list(current_settings)
         else:
-            temp = self.order
+            current_settings = self.settings
+            if exact:
+                temp = [exact] if exact in current_settings else []
+            else:
+                temp = sorted(current_settings.keys()) if sort else self.order
+                if setting_filter:
+                    temp = [setting for setting in temp if setting_filter.match(setting)]
+            max_len = None
 
-        if key_column_width:
+        if key_column_width is not None:
             max_len = key_column_width
-        else:
+        elif max_len is None:
             max_len = self.key_max_column_width()
 
+        padding = ' ' * max_len
+        lines = []
+        append = lines.append
         for setting in temp:
-            if not setting_filter or setting == setting_filter.strip():
-                setting_and_value = '%s=%s' % (
-                    setting,
-                    self.settings[setting]['value']
-                )
-                if info and self.settings[setting]['help']:
-                    print(
-                        '%s - %s' % (
-                            setting_and_value.ljust(max_len, ' '),
-                            self.settings[setting]['help'][0] if self.settings[setting]['help'] else ''
-                        )
-                    )
-                    for line in self.settings[setting]['help'][1:]:
-                        print('%s   %s' % ((' ' * max_len), line))
-                else:
-                    if self.settings[setting]['value']:
-                        print(setting_and_value)
+            current = current_settings[setting]
+            if info and current.help:
+                append('%s - %s\n' % (('%s=%s' % (setting, current.value)).ljust(max_len), current.help[0]))
+                for line in current.help[1:]:
+                    append('%s   %s\n' % (padding, line))
+            elif current.value:
+                append('%s=%s\n' % (setting, current.value))
+        return ''.join(lines)
 
     def set(self, key, value, help_text=None):
         """
         Set a setting in a conf file
+
+        Setting a value that is already set, with the same help text, does
+        not write the file, unless the file changed since it was read.
         :type help_text: list
         :param key:
         :param value
+        :raises ConfsetException: If the conf file name, setting name or value is not valid, see check_setting_name()
+                 and check_setting_value()
         """
+        check_setting_name(self.conffile, key)
+        check_setting_value(value)
         logger.debug('Setting variable, before: %s', self.settings)
         long_key = '%s.%s' % (self.conffile, key)
-        if not help_text:
-            if long_key in self.settings.keys():
-                help_text = self.settings[long_key].get('help', [])
-        if isinstance(help_text, str):
-            help_text = help_text.split(os.linesep)
-        self.settings.update(
-            {
-                long_key: {
-                    'help': help_text,
-                    'value': value
-                }
-            }
-        )
+        previous = self.settings.get(long_key)
+        self._assigned.add(long_key)
+        if previous is not None and previous.value == value and (not help_text or previous.help == intern_help(help_text)):
+            if self._batch_depth or not self._changed_on_disk():
+                logger.debug('%s is already set to %s', long_key, value)
+                return
+            # The file may have another value now, write_settings() checks it under the lock
+            self.write_settings()
+            return
+        if not help_text and previous is not None:
+            help_text = previous.help
+        self.settings[long_key] = Setting(value, help_text)
+        if self._width is not None:
+            width = len(long_key) + len(value) + 1
+            if width >= self._width:
+                self._width = width
+            elif previous is not None and len(long_key) + len(previous.value) + 1 == self._width:
+                # The widest setting may have become narrower, recompute on the next use
+                self._width = None
         logger.debug('Setting variable, after: %s', self.settings)
         if long_key not in self.order:
             self.order.append(long_key)
-        self.write_settings()
+        if not self._batch_depth:
+            self.write_settings()
+
+    async def aset(self, key, value, help_text=None):
+        """
+        Set a setting in a conf file without blocking the asyncio event loop
+        :param key:
+        :param value:
+        :param help_text:
+        """
+        from .aio import run_blocking
+        await run_blocking(self._locked, self.set, key, value, help_text=help_text)
+
+    async def aset_many(self, mapping):
+        """
+        Set several settings in a conf file with a single write without blocking the asyncio event loop
+        :param mapping: (dict) Setting values keyed by setting name
+        """
+        from .aio import run_blocking
+        await run_blocking(self._locked, self.set_many, mapping)
+
+    def _locked(self, func, *args, **kwargs):
+        with self._lock:
+            return func(*args, **kwargs)
+
+    def diff(self, desired):
+        """
+        Compare desired values with the current settings
+        :param desired: (dict) Setting values keyed by setting name
+        :return: (OrderedDict) of (current value or None if it is not set, desired value) tuples keyed by
+                 setting name, only for the settings that differ
+        """
+        changes = collections.OrderedDict()
+        for key, value in desired.items():
+            current = self.settings.get('%s.%s' % (self.conffile, key))
+            if current is None or current.value != value:
+                changes[key] = (None if current is None else current.value, value)
+        return changes
+
+    def converge(self, desired, check=False):
+        """
+        Bring the settings to the desired values, writing the file only if something differs
+        :param desired: (dict) Setting values keyed by setting name
+        :param check: Only report the differences, don't change the file
+        :return: (OrderedDict) the differences that were, or with check would be, applied, see diff()
+        """
+        changes = self.diff(desired)
+        if changes and not check:
+            self.set_many(collections.OrderedDict((key, value) for key, (current, value) in changes.items()))
+        return changes
+
+    def set_many(self, mapping):
+        """
+        Set several settings in a conf file with a single write
+        :param mapping: (dict) Setting values keyed by setting name
+        """
+        with self.batch():
+            for key, value in dict(mapping).items():
+                self.set(key, value)
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Context manager that holds back the writes of set() calls made inside it
+
+        The conf file is written, and backed up, once when the outermost batch
+        exits.  If an exception is raised inside the batch the in-memory
+        settings are restored to what they were when the batch started,
+        including settings changed in place with setting['value'].
+        """
+        self.load()
+        saved = dict(self._settings)
+        snapshot = self._snapshot()
+        assigned = set(self._assigned)
+        self._batch_depth += 1
+        try:
+            yield self
+        except BaseException:
+            values, order = snapshot
+            for long_key, setting in saved.items():
+                if setting['value'] != values[long_key][0] or tuple(setting.get('help') or ()) != values[long_key][1]:
+                    setting['value'], setting['help'] = values[long_key]
+            self._settings, self._order = saved, order
+            self._assigned = assigned
+            self._width = None
+            raise
+        finally:
+            self._batch_depth -= 1
+        if not self._batch_depth and (self._snapshot() != snapshot or (self._assigned and self._changed_on_disk())):
+            self.write_settings()
+
+    def _snapshot(self):
+        """
+        Get the values of the settings
+
+        Settings can be changed in place with setting['value'], so comparing
+        the Setting objects would not show those changes.
+        :return: (tuple) dict of (value, help) tuples keyed by 'file.KEY' and the list of setting names in order
+        """
+        return dict(
+            (long_key, (setting['value'], tuple(setting.get('help') or ()))) for long_key, setting in self._settings.items()
+        ), list(self._order)
+
+
+def check_setting_name(namespace, key):
+    """
+    Check that a setting can be written to, and read back from, a conf file
+    :param namespace: (str) Name of the conf file
+    :param key: (str) Name of the setting, this is a shell variable name
+    :raises ConfsetException: If either name is not valid
+    """
+    if not namespace or not NAMESPACE_RE.fullmatch(namespace):
+        raise ConfsetException(
+            'Invalid conf file name %r, only letters, digits, "-" and "_" are allowed' % (namespace,)
+        )
+    if not key or not shell.NAME_RE.fullmatch(key):
+        raise ConfsetException(
+            'Invalid setting name %r, setting names are shell variable names made of letters, digits and "_" '
+            'that do not start with a digit' % (key,)
+        )
+
+
+def check_setting_value(value):
+    """
+    Check that a value is read back as a whole when it is written to a conf file
+
+    The value is written as is, so it is parsed like the shell would: an
+    unquoted ';', '&', '|' or newline, or a '#' after a blank, would end it
+    and the rest would run as a command when the file is sourced.  Quotes
+    that are never closed would swallow the lines after them.
+    :param value: (str) Value as it is written to the conf file, including any shell quoting
+    :raises ConfsetException: If the value would not be read back as a whole
+    """
+    data = value.encode('utf-8', 'surrogateescape')
+    # The value may follow a blank and be followed by other lines with quotes
+    if shell.Tokenizer(b' ' + data + b'\n\'"\'"').scan_value(1)[0] != len(data) + 1:
+        raise ConfsetException(
+            'Invalid value %r, it would not be read back as a whole, quote values with shell special characters, '
+            'trailing blanks or unbalanced quotes' % (value,)
+        )
+
+
+def backup_filename(filename):
+    """
+    Get an unused timestamped backup filename for a conf file
+    :param filename:
+    :return: (str)
+    """
+    newname = '%s.confset.%s' % (filename, time.strftime("%Y%m%d%H%M%S"))
+    candidate = newname
+    count = 0
+    while os.path.exists(candidate):
+        count += 1
+        candidate = '%s.%d' % (newname, count)
+    return candidate
+
+
+def _decode(data):
+    return data.decode('utf-8', 'surrogateescape')
+
+
+def _column_width(current_settings):
+    """
+    Determine the width of the widest 'file.KEY=value' column
+    :param current_settings: (dict) Setting objects keyed by 'file.KEY'
+    :return: (int)
+    """
+    max_len = 1
+    for setting, values in current_settings.items():
+        if len(setting) + len(values.value) + 1 > max_len:
+            max_len = len(setting) + len(values.value) + 1
+    return max_len
+
+
+def _render_setting(short_key, setting):
+    """
+    Render a single setting and its help text as conf file lines
+    :param short_key: Setting name without the file prefix
+    :param setting: (Setting)
+    :return: (str)
+    """
+    value = setting.value
+    logger.debug('Writing: %s=%s' % (short_key, value))
+    lines = []
+    if setting.help:
+        lines.append('\n')
+        for line in setting.help:
+            lines.append('# %s\n' % line.strip())
+    lines.append('{0}={1}\n'.format(short_key, value))
+    return ''.join(lines)
+
+
+def parse_config(data, namespace):
+    """
+    Parse the contents of a conf file
+
+    The file is read as shell variable assignments in a single pass, see
+    confset.shell.  Besides the settings this records the byte span of every
+    setting in the file as [help_start, line_start, value_start, value_end],
+    which is what allows changing a setting without regenerating the rest of
+    the file.  help_start is -1 when the help comment block is interrupted by
+    lines that are not comments and so can't be replaced as a whole.
+    :param data: (bytes or mmap) Contents of the conf file
+    :param namespace: Name of the conf file, used as the setting name prefix
+    :return: (dict) with the settings, order, spans and key column width
+    """
+    tokenizer = shell.Tokenizer(data)
+    assignment = tokenizer.assignment
+    line_end_after = tokenizer.line_end
+    size = len(data)
+    comments = []
+    help_start = None
+    width = 1
+    order = []
+    result_settings = {}
+    spans = {}
+    line_count = 0
+    line_start = 0
+    while line_start < size:
+        line_count += 1
+        token = assignment(line_start)
+        if token is None:
+            line_end = line_end_after(line_start)
+            line = data[line_start:line_end].strip()
+            if not line:
+                comments = []
+                help_start = None
+            elif line.startswith(b'#'):
+                if help_start is None:
+                    help_start = line_start
+                temp = line.strip(b'#').strip()
+                if temp:
+                    comments.append(_decode(temp))
+            elif help_start is not None:
+                help_start = -1
+        else:
+            key, value_start, value_end, stop, unquoted = token
+            setting = '%s.%s' % (namespace, key.decode('utf-8', 'surrogateescape'))
+            raw = data[value_start:value_end]
+            value = raw.decode('utf-8', 'surrogateescape')
+            if setting not in result_settings:
+                order.append(setting)
+            result_settings[setting] = Setting(value, comments, value if unquoted == raw else _decode(unquoted))
+            if len(setting) + len(value) + 1 > width:
+                width = len(setting) + len(value) + 1
+            spans[setting] = [line_start if help_start is None else help_start, line_start, value_start, value_end]
+            comments = []
+            help_start = None
+            # Skip the lines the value continued on and anything after the value
+            line_end = line_end_after(stop)
+        line_start = line_end
+    stats.count('lines_parsed', line_count)
+    return {'settings': result_settings, 'order': order, 'spans': spans, 'width': width}
+
+
+def backup_file(filename, backup_name):
+    """
+    Make a backup of a file without copying its data where possible
+
+    The backup is a hard link to the file, which is safe because the file is
+    always replaced rather than modified in place.  If the filesystem does not
+    support hard links the data is cloned with copy_file_range(), which lets
+    the kernel reflink or copy it, before falling back to a regular copy.
+    :param filename:
+    :param backup_name:
+    """
+    import shutil
+    try:
+        os.link(filename, backup_name)
+        return
+    except OSError as exc:
+        logger.debug('Unable to hard link %s to %s: %s', filename, backup_name, exc)
+    if hasattr(os, 'copy_file_range'):
+        try:
+            with open(filename, 'rb') as source, open(backup_name, 'wb') as destination:
+                remaining = os.fstat(source.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(source.fileno(), destination.fileno(), remaining)
+                    if not copied:
+                        break
+                    remaining -= copied
+            if remaining <= 0:
+                shutil.copystat(filename, backup_name)
+                return
+        except OSError as exc:
+            logger.debug('Unable to clone %s to %s: %s', filename, backup_name, exc)
+    shutil.copy2(filename, backup_name)
+
+
+def lock_filename(filename, create=False):
+    """
+    Get the name of the lock file of a conf file
+
+    Lock files are kept in LOCK_DIR, named after the full path of the conf
+    file like the cache entries, so the conf directories are left alone.  If
+    LOCK_DIR does not exist and can't be created the lock file is a hidden
+    '.name.confset.lock' file next to the conf file, which is never taken
+    for a conf file.
+    :param filename:
+    :param create: Create LOCK_DIR if it does not exist yet
+    :return: (str) Full path of the lock file
+    """
+    filename = os.path.realpath(filename)
+    if not os.path.isdir(LOCK_DIR) and create:
+        try:
+            # Readers open the lock files too, they only ever hold the lock
+            os.makedirs(LOCK_DIR, 0o755)
+        except OSError as exc:
+            logger.debug('Unable to create %s: %s', LOCK_DIR, exc)
+    if os.path.isdir(LOCK_DIR):
+        return cache.entry_filename(LOCK_DIR, filename, LOCK_SUFFIX)
+    directory, name = os.path.split(filename)
+    return os.path.join(directory, '.%s.confset.lock' % name)
+
+
+@contextlib.contextmanager
+def file_lock(filename, exclusive=True):
+    """
+    Context manager that holds an fcntl lock on the lock file of a conf file
+
+    Writers take an exclusive lock for their whole read-modify-write, readers
+    a shared lock, so readers never block each other and only wait for a
+    write of the same file in progress.  Each conf file has its own lock
+    file, see lock_filename(), so writes of different files never wait for
+    each other.  Readers don't create the lock file, if it does not exist
+    nothing was ever written with a lock.  Locking is skipped where fcntl is not available or the lock
+    file can't be opened.
+    :param filename: The conf file
+    :param exclusive: Take an exclusive lock instead of a shared one
+    """
+    descriptor = None
+    if fcntl is not None:
+        try:
+            if exclusive:
+                descriptor = os.open(lock_filename(filename, create=True), os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+            else:
+                descriptor = os.open(lock_filename(filename), os.O_RDONLY | os.O_CLOEXEC)
+        except OSError as exc:
+            if exclusive:
+                logger.debug('Unable to lock %s: %s', filename, exc)
+    try:
+        if descriptor is not None:
+            with stats.timer('lock'):
+                fcntl.flock(descriptor, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+    finally:
+        if descriptor is not None:
+            os.close(descriptor)
+
+
+def atomic_write(filename, data, backup=True):
+    """
+    Replace the contents of a file
+
+    The data is written to a temporary file in the same directory, synced to
+    disk and renamed over the original so a crash never leaves a partially
+    written file behind.  If filename is a symlink the file it points to is
+    replaced, and backed up, so the link is kept.
+    :param filename:
+    :param data: (bytes) New file contents
+    :param backup: Keep a timestamped backup of the existing file
+    :return: (str) The backup filename or None if no backup was made
+    """
+    import tempfile
+    filename = os.path.realpath(filename)
+    directory = os.path.dirname(os.path.abspath(filename))
+    try:
+        stat_result = os.stat(filename)
+    except OSError:
+        stat_result = None
+    file_descriptor, temp_name = tempfile.mkstemp(
+        prefix='%s.confset.' % os.path.basename(filename), suffix='.tmp', dir=directory
+    )
+    backup_name = None
+    try:
+        with os.fdopen(file_descriptor, 'wb') as file_handle:
+            file_handle.write(data)
+            file_handle.flush()
+            os.fsync(file_handle.fileno())
+        stats.count('bytes_written', len(data))
+        stats.count('fsyncs')
+        if stat_result:
+            os.chmod(temp_name, stat.S_IMODE(stat_result.st_mode))
+            if hasattr(os, 'chown') and (stat_result.st_uid, stat_result.st_gid) != (os.getuid(), os.getgid()):
+                try:
+                    os.chown(temp_name, stat_result.st_uid, stat_result.st_gid)
+                except OSError as exc:
+                    logger.debug('Unable to preserve the ownership of %s: %s', filename, exc)
+            if backup:
+                backup_name = backup_filename(filename)
+                logger.debug('Backing up existing config file: %s to %s', filename, backup_name)
+                backup_file(filename, backup_name)
+                stats.count('backups_created')
+        else:
+            os.chmod(temp_name, 0o644)
+        os.replace(temp_name, filename)
+    except BaseException:
+        for name in (temp_name, backup_name):
+            if name and os.path.exists(name):
+                os.remove(name)
+        raise
+    try:
+        directory_descriptor = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return backup_name
+    try:
+        os.fsync(directory_descriptor)
+        stats.count('fsyncs')
+    except OSError:
+        pass
+    finally:
+        os.close(directory_descriptor)
+    return backup_name
+
 
 def config_paths():
     """
     Get a list of configuration paths
 
+    The conf directory of the active virtualenv, if it exists, comes first.
+    The result is memoized for as long as CONF_PATH and VIRTUAL_ENV don't
+    change.
+
     Returns
     list
         A list of strings containing full paths to the directories containing
         configuration files.
     """
-    global CONF_PATH
-    confpath = copy.copy(CONF_PATH)
-    if 'VIRTUAL_ENV' in os.environ.keys():
-        venv_path = os.path.join(os.environ['VIRTUAL_ENV'], 'conf')
+    key = (tuple(CONF_PATH), os.environ.get('VIRTUAL_ENV'))
+    try:
+        return list(_paths_cache[key])
+    except KeyError:
+        pass
+    confpath = list(CONF_PATH)
+    if key[1]:
+        venv_path = os.path.join(key[1], 'conf')
         if os.path.exists(venv_path):
-            if confpath[0] != venv_path:
+            if not confpath or confpath[0] != venv_path:
                 confpath.insert(0, venv_path)
+    _paths_cache.clear()
+    _paths_cache[key] = tuple(confpath)
     return confpath
 
 
+def scan_directory(directory):
+    """
+    Get the names of the config files in a directory
+
+    The directory is read with os.scandir() and the result is memoized until
+    the modification time of the directory changes.  Directories modified
+    within the last second are not memoized, since a change in the same
+    timestamp tick would go unnoticed.
+    :param directory:
+    :return: (frozenset) of file names, without confset backups and temporary files
+    """
+    with stats.timer('discovery'):
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+        except OSError:
+            _directory_cache.pop(directory, None)
+            return frozenset()
+        cached = _directory_cache.get(directory)
+        if cached and cached[0] == mtime_ns:
+            return cached[1]
+        names = []
+        scanned = 0
+        try:
+            iterator = os.scandir(directory)
+            try:
+                for entry in iterator:
+                    scanned += 1
+                    if '.confset.' in entry.name:
+                        continue
+                    try:
+                        if entry.is_file():
+                            names.append(entry.name)
+                    except OSError:
+                        continue
+            finally:
+                # The iterator can only be closed early from Python 3.6, before that it is closed once exhausted
+                if hasattr(iterator, 'close'):
+                    iterator.close()
+        except OSError:
+            return frozenset()
+        stats.count('files_scanned', scanned)
+        names = frozenset(names)
+        if time.time() - mtime_ns / 1e9 > 1:
+            _directory_cache[directory] = (mtime_ns, names)
+        return names
+
+
+def config_layout(paths=None):
+    """
+    Find the config files of every namespace in every directory
+
+    The layout is memoized per list of directories and only worked out again
+    when the contents of one of the directories change, see scan_directory().
+    :param paths: Directories in order of precedence, highest first, defaults to config_paths()
+    :return: (OrderedDict) tuples of the full paths of the config files, highest precedence first,
+             keyed by namespace.  The result is shared, don't modify it.
+    """
+    paths = tuple(config_paths() if paths is None else paths)
+    names = tuple(scan_directory(directory) for directory in paths)
+    cached = _layout_cache.get(paths)
+    if cached and cached[0] == names:
+        return cached[1]
+    found = collections.OrderedDict()
+    for directory, directory_names in zip(paths, names):
+        for name in sorted(directory_names):
+            found[name] = found.get(name, ()) + (os.path.join(directory, name),)
+    if len(_layout_cache) >= MAX_LAYOUTS:
+        _layout_cache.clear()
+    _layout_cache[paths] = (names, found)
+    return found
+
+
+def discover_config_files():
+    """
+    Find the config file for every namespace
+
+    When a namespace has a file in more than one directory the one in the
+    directory that comes first in config_paths() is used.
+    :return: (OrderedDict) full path of the config file keyed by namespace
+    """
+    return collections.OrderedDict((name, filenames[0]) for name, filenames in config_layout().items())
+
+
 def config_files():
     """
     Find all config files
-    :return:
+    :return: (list) of config file names, one per namespace
     """
-    files = []
-    for directory in config_paths():
-        if os.path.isdir(directory):
-            for f in os.listdir(directory):
-                if '.confset.' not in f:
-                    files.append(f)
-    return files
+    return list(discover_config_files())
 
 
-def settings():
+class SettingFilter(object):
     """
-    Return all settings as a dictionary
-    :return:
+    Match 'file.KEY' setting names against a glob or a regular expression
+
+    The pattern is split at its first '.', or for a regular expression at
+    its first top level '\\.', into a file name part and a setting name
+    part.  The file name part is checked by match_namespace() so files that
+    can't contain a match are skipped without being opened.  A glob without
+    a '.' matches every setting of the files it matches.
+    :param pattern: Glob such as 'ntp*.NTP*', or a regular expression if regex is set
+    :param regex: Match pattern as a regular expression against the whole 'file.KEY' name
     """
-    all_settings = {}
-    for f in config_files():
+
+    def __init__(self, pattern, regex=False):
+        self.pattern = pattern.strip()
+        self.regex = regex
+        self.exact = None
+        if regex:
+            namespace = _regex_namespace(self.pattern)
+            setting = self.pattern
+        else:
+            import fnmatch
+            namespace, separator, key = self.pattern.partition('.')
+            setting = self.pattern if separator else self.pattern + '.*'
+            if separator and not any(character in self.pattern for character in '*?['):
+                self.exact = self.pattern
+            namespace = fnmatch.translate(namespace)
+            setting = fnmatch.translate(setting)
+        self._namespace = None if namespace is None else re.compile(namespace)
+        self._setting = re.compile(setting)
+
+    def match_namespace(self, namespace):
+        """
+        Check if a config file can contain settings matching the pattern
+        :param namespace: Name of the config file
+        :return: (bool)
+        """
+        if self._namespace is None or '.' in namespace:
+            return True
+        return self._namespace.fullmatch(namespace) is not None
+
+    def match(self, long_key):
+        """
+        Check if a setting matches the pattern
+        :param long_key: 'file.KEY' setting name
+        :return: (bool)
+        """
+        if self.exact is not None:
+            return long_key == self.exact
+        return self._setting.fullmatch(long_key) is not None
+
+
+def _regex_namespace(pattern):
+    """
+    Get the file name part of a regular expression
+
+    This is the part before the first '\\.' that is outside of any group
+    or character set and isn't followed by a quantifier.
+    :param pattern: Regular expression matched against 'file.KEY' names
+    :return: (str) or None if the pattern can't be split, for example because of a top level '|'
+    """
+    depth = 0
+    in_set = False
+    split = None
+    position = 0
+    while position < len(pattern):
+        character = pattern[position]
+        if character == '\\':
+            if (
+                split is None and not depth and not in_set and pattern[position + 1:position + 2] == '.' and
+                pattern[position + 2:position + 3] not in ('?', '*', '+', '{')
+            ):
+                split = position
+            position += 2
+            continue
+        if in_set:
+            if character == ']':
+                in_set = False
+        elif character == '[':
+            in_set = True
+            if pattern[position + 1:position + 2] == '^':
+                position += 1
+            if pattern[position + 1:position + 2] == ']':
+                position += 1
+        elif character == '(':
+            depth += 1
+        elif character == ')':
+            depth -= 1
+        elif character == '|' and not depth:
+            return None
+        position += 1
+    if split is None:
+        return None
+    return pattern[:split]
+
+
+def _setting_filter(setting_filter, regex=False):
+    """
+    Get a SettingFilter for a filter argument
+    :param setting_filter: (str) pattern, SettingFilter or None
+    :param regex: Treat a str pattern as a regular expression
+    :return: (SettingFilter) or None if there is no filter
+    """
+    if not setting_filter or isinstance(setting_filter, SettingFilter):
+        return setting_filter or None
+    return SettingFilter(setting_filter, regex=regex)
+
+
+class SettingsView(Mapping):
+    """
+    Read only mapping of all system settings keyed by 'namespace.KEY'
+
+    A config file is only parsed when a key in its namespace is looked up, or
+    when iteration reaches it, and is then kept for the life of the view.
+    """
+
+    def __init__(self):
+        self._configs = {}
+
+    def config(self, namespace):
+        """
+        Get the ConfigSettings for a namespace, loading it on first use
+        :param namespace:
+        :return: (ConfigSettings) or None if the config file can't be read
+        """
+        try:
+            return self._configs[namespace]
+        except KeyError:
+            pass
+        conf = ConfigSettings(namespace)
         try:
-            conf = ConfigSettings(os.path.basename(f))
+            conf.load()
         except IOError as exc:
-            logger.debug(
-                'Got %s while getting config settings for %s',
-                exc,
-                os.path.basename(f)
-            )
+            logger.debug('Got %s while getting config settings for %s', exc, namespace)
+            conf = None
+        self._configs[namespace] = conf
+        return conf
+
+    def __getitem__(self, key):
+        namespace, _, attribute = key.partition('.')
+        if not namespace or not attribute:
+            raise KeyError(key)
+        conf = self.config(namespace)
+        if conf is None:
+            raise KeyError(key)
+        return conf.settings[key]
+
+    def __iter__(self):
+        for namespace in config_files():
+            conf = self.config(namespace)
+            if conf is not None:
+                for long_key in conf.order:
+                    yield long_key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class Overlay(Mapping):
+    """
+    Read only merged view of the settings in every configuration directory keyed by 'namespace.KEY'
+
+    Every setting records the directory, or layer, it was read from, see
+    resolve() and layer().  By default a namespace is read from the file in
+    the directory with the highest precedence, the file ConfigSettings
+    reads and writes.  With layered set the files of a namespace in all of
+    the directories are merged key by key, so a file in a directory with a
+    higher precedence only has to hold the settings it overrides.
+
+    Like SettingsView a namespace is only parsed when it is first used.
+    :param paths: Directories in order of precedence, highest first, defaults to config_paths()
+    :param layered: Merge the settings of each namespace from every directory that has a file for it
+    """
+
+    def __init__(self, paths=None, layered=False):
+        self.paths = tuple(config_paths() if paths is None else paths)
+        self.layered = layered
+        self._resolved = {}
+
+    def layers(self, namespace):
+        """
+        Get the config files of a namespace
+        :param namespace:
+        :return: (tuple) full paths of the config files, highest precedence first
+        """
+        return config_layout(self.paths).get(namespace, ())
+
+    def resolve(self, namespace):
+        """
+        Get the settings of a namespace along with the layer each one comes from
+        :param namespace:
+        :return: (OrderedDict) of ResolvedSetting(setting, layer, filename) keyed by 'namespace.KEY', the
+                 settings of the highest precedence file first in file order followed by the settings
+                 only found in lower layers
+        """
+        try:
+            return self._resolved[namespace]
+        except KeyError:
+            pass
+        resolved = collections.OrderedDict()
+        for filename in self.layers(namespace):
+            layer = os.path.dirname(filename)
+            try:
+                conf = ConfigSettings(namespace, confpath=[layer])
+                conf.load()
+            except IOError as exc:
+                logger.debug('Got %s while getting config settings for %s', exc, filename)
+                continue
+            if conf.filename is None:
+                continue
+            for long_key in conf.order:
+                if long_key not in resolved:
+                    resolved[long_key] = ResolvedSetting(conf.settings[long_key], layer, conf.filename)
+            if not self.layered:
+                break
+        self._resolved[namespace] = resolved
+        return resolved
+
+    def layer(self, key):
+        """
+        Get the directory a setting was read from
+        :param key: 'namespace.KEY'
+        :return: (str)
+        :raises KeyError: if the setting is not set in any layer
+        """
+        namespace, _, attribute = key.partition('.')
+        if not namespace or not attribute:
+            raise KeyError(key)
+        return self.resolve(namespace)[key].layer
+
+    def __getitem__(self, key):
+        namespace, _, attribute = key.partition('.')
+        if not namespace or not attribute:
+            raise KeyError(key)
+        return self.resolve(namespace)[key].setting
+
+    def __iter__(self):
+        for namespace in config_layout(self.paths):
+            for long_key in self.resolve(namespace):
+                yield long_key
+
+    def __len__(self):
+        return sum(len(self.resolve(namespace)) for namespace in config_layout(self.paths))
+
+
+def load_config(namespace):
+    """
+    Load the config file for a namespace
+    :param namespace:
+    :return: (ConfigSettings) or None if the config file can't be read
+    """
+    try:
+        conf = ConfigSettings(namespace)
+        conf.load()
+    except IOError as exc:
+        logger.debug('Got %s while getting config settings for %s', exc, namespace)
+        return None
+    return conf
+
+
+def _iter_configs(jobs=None, setting_filter=None):
+    """
+    Load the config files, skipping the ones that can't be read
+
+    Files whose name can't match setting_filter are not opened.  With jobs > 1 the files are read and parsed by a pool of that many
+    threads, with at most 2 * jobs files loaded ahead of the consumer.  The
+    configs are always yielded in config_files() order.
+    :param jobs: Number of files to load concurrently
+    :param setting_filter: (SettingFilter) Only load the files that can contain matching settings
+    :return: generator of ConfigSettings objects
+    """
+    namespaces = config_files()
+    if setting_filter is not None:
+        matching = [namespace for namespace in namespaces if setting_filter.match_namespace(namespace)]
+        stats.count('files_skipped', len(namespaces) - len(matching))
+        namespaces = matching
+    if not jobs or jobs < 2:
+        for namespace in namespaces:
+            conf = load_config(namespace)
+            if conf is not None:
+                yield conf
+        return
+    import concurrent.futures
+    pending = collections.deque()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        for namespace in namespaces:
+            pending.append(executor.submit(load_config, namespace))
+            if len(pending) >= 2 * jobs:
+                conf = pending.popleft().result()
+                if conf is not None:
+                    yield conf
+        while pending:
+            conf = pending.popleft().result()
+            if conf is not None:
+                yield conf
+
+
+def iter_settings(jobs=None, setting_filter=None, regex=False):
+    """
+    Iterate over all settings, loading one config file at a time
+    :param jobs: Number of config files to load concurrently
+    :param setting_filter: Only include the settings matching this glob, see SettingFilter
+    :param regex: Treat setting_filter as a regular expression
+    :return: generator of SettingRecord(namespace, key, value, help) tuples
+    """
+    setting_filter = _setting_filter(setting_filter, regex=regex)
+    for conf in _iter_configs(jobs=jobs, setting_filter=setting_filter):
+        for record in config_records(conf, setting_filter=setting_filter):
+            yield record
+
+
+def config_records(conf, setting_filter=None):
+    """
+    Iterate over the settings of a loaded config
+    :param conf: (ConfigSettings)
+    :param setting_filter: (SettingFilter) Only include the matching settings
+    :return: generator of SettingRecord(namespace, key, value, help) tuples
+    """
+    prefix_len = len(conf.conffile) + 1
+    for long_key in conf.order:
+        if setting_filter is not None and not setting_filter.match(long_key):
             continue
-        s, o = conf.available_settings()
-        all_settings.update(s)
+        setting = conf.settings[long_key]
+        yield SettingRecord(conf.conffile, long_key[prefix_len:], setting.value, list(setting.help))
+
+
+def settings(jobs=None, setting_filter=None, regex=False):
+    """
+    Return all settings as a dictionary
+    :param jobs: Number of config files to load concurrently
+    :param setting_filter: Only include the settings matching this glob, see SettingFilter
+    :param regex: Treat setting_filter as a regular expression
+    :return:
+    """
+    all_settings = {}
+    for namespace, key, value, help_text in iter_settings(jobs=jobs, setting_filter=setting_filter, regex=regex):
+        all_settings['%s.%s' % (namespace, key)] = {'help': help_text, 'value': value}
     return all_settings
 
 
-def print_settings(setting_filter=None, info=False):
+def print_settings(setting_filter=None, info=False, jobs=None, stream=None, align=True, regex=False):
     """
     Print settings found
+
+    setting_filter is a glob such as 'ntp*.NTP*' or '*.OPTIONS', see
+    SettingFilter, and only the config files it can match are loaded.  By default all config files are loaded first so the help text of every
+    file can be aligned to the widest setting, and the output is written in
+    one piece.  With align=False the settings of each file are written as
+    soon as the file is loaded.
     :param setting_filter:
     :param info:
+    :param jobs: Number of config files to load concurrently
+    :param stream: File object to write to, defaults to sys.stdout
+    :param align: Align the help text of all files to the same column
+    :param regex: Treat setting_filter as a regular expression
     """
-    configs = []
+    setting_filter = _setting_filter(setting_filter, regex=regex)
+    if stream is None:
+        stream = sys.stdout
+    if not align:
+        for conf in _iter_configs(jobs=jobs, setting_filter=setting_filter):
+            conf.print_settings(setting_filter=setting_filter, key_column_width=0, info=info, stream=stream)
+            stream.flush()
+        return
+    stream.write(render_configs(_iter_configs(jobs=jobs, setting_filter=setting_filter), setting_filter, info=info))
+
+
+def render_configs(configs, setting_filter=None, info=False):
+    """
+    Render the settings of several config files with the help text aligned to the widest setting
+    :param configs: (iterable) of ConfigSettings
+    :param setting_filter: Only include the settings matching this glob or SettingFilter
+    :param info: Include the help text of the settings
+    :return: (str)
+    """
+    setting_filter = _setting_filter(setting_filter)
+    configs = list(configs)
     max_width = 1
-    for f in config_files():
-        try:
-            conf = ConfigSettings(os.path.basename(f))
-        except IOError as exc:
-            logger.debug(
-                'Got %s while getting config settings for %s',
-                exc, os.path.basename(f)
-            )
-            continue
-        if conf.key_max_column_width() > max_width:
-            max_width = conf.key_max_column_width()
-        configs.append(conf)
     for conf in configs:
-        conf.print_settings(
-            setting_filter=setting_filter,
-            key_column_width=max_width,
-            info=info
-        )
+        width = conf.key_max_column_width()
+        if width > max_width:
+            max_width = width
+    output = io.StringIO()
+    for conf in configs:
+        conf.print_settings(setting_filter=setting_filter, key_column_width=max_width, info=info, stream=output)
+    return output.getvalue()
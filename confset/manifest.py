@@ -0,0 +1,277 @@
+# Copyright (c) 2012-2015, Dwight Hubbard.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Apply many settings at once from a manifest
+
+A manifest lists 'file.KEY' settings and their values in one of these forms:
+
+key=value lines::
+
+    rsyslog.RSYSLOGD_OPTIONS=-c5
+    ntpdate.NTPSERVERS=ntp.ubuntu.com
+
+JSON or YAML, either flat, nested by file or as the records written by
+confset.write_json()::
+
+    {"rsyslog.RSYSLOGD_OPTIONS": "-c5"}
+    {"rsyslog": {"RSYSLOGD_OPTIONS": "-c5"}}
+    [{"namespace": "rsyslog", "key": "RSYSLOGD_OPTIONS", "value": "-c5"}]
+
+YAML manifests need the PyYAML package.
+
+The changes are grouped by file so each file is loaded once and written,
+and backed up, once.  Up to DEFAULT_JOBS different files are written in
+parallel.  Files that already have the desired values are not written, and
+files that are unchanged since they were last converged to the same values
+are not even parsed.
+"""
+import collections
+import logging
+import sys
+from . import cache, confset
+from .confset import ConfigSettings, ConfsetException, check_setting_name, check_setting_value
+
+
+FORMATS = ['keyvalue', 'json', 'yaml']
+DEFAULT_JOBS = 8
+ManifestResult = collections.namedtuple('ManifestResult', ['namespace', 'filename', 'changed', 'error', 'changes'])
+logger = logging.getLogger(__name__)
+
+
+def _manifest_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float, str)):
+        return str(value)
+    raise ConfsetException('Unsupported manifest value %r' % (value,))
+
+
+def _add_change(changes, long_key, value):
+    namespace, separator, key = str(long_key).strip().partition('.')
+    if not namespace or not separator or not key:
+        raise ConfsetException('Manifest setting %r is not in the file.KEY form' % (long_key,))
+    check_setting_name(namespace, key)
+    value = _manifest_value(value)
+    check_setting_value(value)
+    changes.setdefault(namespace, collections.OrderedDict())[key] = value
+
+
+def _data_changes(data):
+    """
+    Get the changes from a decoded JSON or YAML manifest
+    :param data: list of records or a dict keyed by 'file.KEY' or by file name
+    :return: (OrderedDict) of OrderedDicts of values keyed by file name and setting name
+    """
+    changes = collections.OrderedDict()
+    if isinstance(data, list):
+        for record in data:
+            if not isinstance(record, dict) or not {'namespace', 'key', 'value'} <= set(record):
+                raise ConfsetException('Manifest records need a namespace, key and value')
+            _add_change(changes, '%s.%s' % (record['namespace'], record['key']), record['value'])
+    elif isinstance(data, dict):
+        for name, value in data.items():
+            if isinstance(value, dict):
+                for key, nested_value in value.items():
+                    _add_change(changes, '%s.%s' % (name, key), nested_value)
+            else:
+                _add_change(changes, name, value)
+    elif data is not None:
+        raise ConfsetException('A manifest must be a list of records or a mapping of settings')
+    return changes
+
+
+def parse_manifest(text, manifest_format=None):
+    """
+    Parse a manifest
+
+    :param text: (str) Contents of the manifest
+    :param manifest_format: One of FORMATS, by default JSON is recognized by a leading '{' or '['
+        and anything else is read as key=value lines
+    :return: (OrderedDict) of OrderedDicts of values keyed by file name and setting name
+    """
+    if manifest_format is None:
+        manifest_format = 'json' if text.lstrip()[:1] in ('{', '[') else 'keyvalue'
+    if manifest_format == 'json':
+        import json
+        try:
+            return _data_changes(json.loads(text, object_pairs_hook=collections.OrderedDict))
+        except ValueError as exc:
+            raise ConfsetException('Invalid JSON manifest: %s' % exc)
+    if manifest_format == 'yaml':
+        try:
+            import yaml
+        except ImportError:
+            raise ConfsetException('YAML manifests require the PyYAML package')
+        try:
+            return _data_changes(yaml.safe_load(text))
+        except yaml.YAMLError as exc:
+            raise ConfsetException('Invalid YAML manifest: %s' % exc)
+    if manifest_format != 'keyvalue':
+        raise ConfsetException('Unknown manifest format %r' % (manifest_format,))
+    changes = collections.OrderedDict()
+    for line_number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        long_key, separator, value = line.partition('=')
+        if not separator:
+            raise ConfsetException('Manifest line %d is not a file.KEY=value setting' % line_number)
+        _add_change(changes, long_key, value.strip())
+    return changes
+
+
+def read_manifest(filename, manifest_format=None):
+    """
+    Read and parse a manifest file
+    :param filename: Manifest filename, '-' reads the manifest from stdin
+    :param manifest_format: One of FORMATS, defaults to the format matching the file extension
+    :return: (OrderedDict) of OrderedDicts of values keyed by file name and setting name
+    """
+    if filename == '-':
+        text = sys.stdin.read()
+    else:
+        with open(filename) as file_handle:
+            text = file_handle.read()
+        if manifest_format is None:
+            extension = filename.rpartition('.')[2].lower()
+            if extension in ('yaml', 'yml'):
+                manifest_format = 'yaml'
+            elif extension == 'json':
+                manifest_format = 'json'
+    return parse_manifest(text, manifest_format=manifest_format)
+
+
+def _desired_hash(values):
+    import hashlib
+    import json
+    return hashlib.sha256(json.dumps(sorted(values.items())).encode('utf-8', 'surrogateescape')).hexdigest()
+
+
+def _file_state(filename):
+    """
+    Get the identity and the hash of the contents of a config file
+    :param filename:
+    :return: (tuple) identity and sha256 hex digest, (None, None) if the file can't be read
+    """
+    import hashlib
+    try:
+        with open(filename, 'rb') as file_handle:
+            identity = cache.file_identity(filename, file_handle.fileno())
+            content = hashlib.sha256(file_handle.read()).hexdigest()
+    except (IOError, OSError):
+        return None, None
+    return identity, content
+
+
+def is_converged(filename, values):
+    """
+    Check if a config file is unchanged since it was last converged to the same values
+
+    The identity of the file is compared first.  If the file was touched or
+    replaced the hash of its contents is compared instead, so the file is
+    only parsed if its contents really changed.
+    :param filename: Full path of the config file
+    :param values: (dict) Desired values keyed by setting name
+    :return: (bool)
+    """
+    state_identity, state = cache.load_entry(confset.CACHE_DIR, filename, suffix=cache.STATE_SUFFIX)
+    if not state or state.get('desired') != _desired_hash(values):
+        return False
+    if state_identity and state_identity == cache.file_identity(filename):
+        return True
+    identity, content = _file_state(filename)
+    if content is None or content != state.get('content'):
+        return False
+    cache.store(confset.CACHE_DIR, filename, identity, state, suffix=cache.STATE_SUFFIX)
+    return True
+
+
+def record_converged(filename, values):
+    """
+    Remember that a config file has the desired values, see is_converged()
+    :param filename: Full path of the config file
+    :param values: (dict) Desired values keyed by setting name
+    """
+    identity, content = _file_state(filename)
+    if content is not None:
+        cache.store(
+            confset.CACHE_DIR, filename, identity, {'desired': _desired_hash(values), 'content': content},
+            suffix=cache.STATE_SUFFIX
+        )
+
+
+def apply_file(namespace, values, backup=True, check=False):
+    """
+    Converge one config file to the desired values with at most a single write
+
+    A file that is unchanged since it was last converged to the same values
+    is not parsed at all, and a file that already has the values is not
+    written.
+    :param namespace: Name of the config file
+    :param values: (dict) New values keyed by setting name
+    :param backup: Keep a backup of the config file if it is changed
+    :param check: Only report the settings that would change, don't change the file
+    :return: (ManifestResult)
+    """
+    conf = None
+    try:
+        conf = ConfigSettings(namespace, backup=backup)
+        if conf.filename and is_converged(conf.filename, values):
+            return ManifestResult(namespace, conf.filename, 0, None, collections.OrderedDict())
+        changes = conf.converge(values, check=check)
+        if conf.filename and not (check and changes):
+            record_converged(conf.filename, values)
+    except (ConfsetException, IOError, OSError) as exc:
+        logger.debug('Unable to apply the manifest to %s: %s', namespace, exc)
+        return ManifestResult(namespace, conf.filename if conf else None, 0, str(exc), collections.OrderedDict())
+    return ManifestResult(namespace, conf.filename, len(changes), None, changes)
+
+
+def apply_manifest(changes, jobs=DEFAULT_JOBS, backup=True, check=False):
+    """
+    Apply the changes from a manifest
+
+    Each config file is loaded and written once, and up to jobs files are
+    updated at the same time.
+    :param changes: (dict) of dicts of values keyed by file name and setting name, see parse_manifest()
+    :param jobs: Number of config files to update concurrently
+    :param backup: Keep a backup of each config file that is changed
+    :param check: Only report the settings that would change, don't change any file
+    :return: (list) of ManifestResult(namespace, filename, changed, error, changes) in the order of changes
+    """
+    if not jobs or jobs < 2 or len(changes) < 2:
+        return [apply_file(namespace, values, backup=backup, check=check) for namespace, values in changes.items()]
+    import concurrent.futures
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [
+            executor.submit(apply_file, namespace, values, backup=backup, check=check)
+            for namespace, values in changes.items()
+        ]
+        return [future.result() for future in futures]
+
+
+def format_results(results, show_changes=False, check=False):
+    """
+    Summarize the results of apply_manifest()
+    :param results: (list) of ManifestResult
+    :param show_changes: Add a line for every setting that changed
+    :param check: The results are from a check, the settings were not changed
+    :return: (str) One line per config file
+    """
+    lines = []
+    for result in results:
+        if result.error:
+            lines.append('%s: failed: %s' % (result.namespace, result.error))
+            continue
+        lines.append('%s: %d %s (%s)' % (
+            result.namespace, result.changed, 'to change' if check else 'changed', result.filename
+        ))
+        if show_changes:
+            for key, (current, value) in result.changes.items():
+                lines.append('    %s.%s: %s -> %s' % (
+                    result.namespace, key, '(not set)' if current is None else current, value
+                ))
+    return '\n'.join(lines)
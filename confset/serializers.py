@@ -0,0 +1,77 @@
+# Copyright (c) 2012-2015, Dwight Hubbard.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Machine readable output of the system settings
+
+Every setting is serialized as an object with the namespace, key, value,
+help lines and source path of the setting::
+
+    {"namespace": "rsyslog", "key": "RSYSLOGD_OPTIONS", "value": "-c5",
+     "help": ["Options for rsyslogd"], "path": "/etc/default/rsyslog"}
+
+Both writers load and write one config file at a time, so the memory used
+does not grow with the number of config files.
+"""
+import sys
+from .confset import _iter_configs, _setting_filter, config_records
+
+
+def setting_dicts(jobs=None, setting_filter=None, regex=False):
+    """
+    Iterate over all settings as dictionaries, loading one config file at a time
+    :param jobs: Number of config files to load concurrently
+    :param setting_filter: Only include the settings matching this glob, see SettingFilter
+    :param regex: Treat setting_filter as a regular expression
+    :return: generator of lists of dicts, one list per config file
+    """
+    setting_filter = _setting_filter(setting_filter, regex=regex)
+    for conf in _iter_configs(jobs=jobs, setting_filter=setting_filter):
+        yield [
+            {
+                'namespace': record.namespace, 'key': record.key, 'value': record.value, 'help': record.help,
+                'path': conf.filename
+            }
+            for record in config_records(conf, setting_filter=setting_filter)
+        ]
+
+
+def write_ndjson(stream=None, jobs=None, setting_filter=None, regex=False):
+    """
+    Write all settings as newline delimited JSON, one setting per line
+
+    The settings of each config file are written, and the stream flushed, as
+    soon as the file is loaded.
+    :param stream: File object to write to, defaults to sys.stdout
+    :param jobs: Number of config files to load concurrently
+    :param setting_filter: Only include the settings matching this glob, see SettingFilter
+    :param regex: Treat setting_filter as a regular expression
+    """
+    import json
+    if stream is None:
+        stream = sys.stdout
+    for records in setting_dicts(jobs=jobs, setting_filter=setting_filter, regex=regex):
+        if records:
+            stream.write(''.join(json.dumps(record) + '\n' for record in records))
+            stream.flush()
+
+
+def write_json(stream=None, jobs=None, setting_filter=None, regex=False):
+    """
+    Write all settings as a JSON array
+
+    The array is written incrementally as each config file is loaded.
+    :param stream: File object to write to, defaults to sys.stdout
+    :param jobs: Number of config files to load concurrently
+    :param setting_filter: Only include the settings matching this glob, see SettingFilter
+    :param regex: Treat setting_filter as a regular expression
+    """
+    import json
+    if stream is None:
+        stream = sys.stdout
+    separator = '[\n'
+    for records in setting_dicts(jobs=jobs, setting_filter=setting_filter, regex=regex):
+        for record in records:
+            stream.write(separator + json.dumps(record))
+            separator = ',\n'
+    stream.write('[]\n' if separator == '[\n' else '\n]\n')
@@ -0,0 +1,189 @@
+# Copyright (c) 2012-2015, Dwight Hubbard.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Daemon answering settings queries over a unix socket
+
+The daemon started with confset --serve keeps every config file loaded in a
+Watcher, which re-parses only the files that change, and answers requests
+sent as single lines of JSON.  Each response is a single line of JSON with
+'ok' set to true, or to false with an 'error' message.
+
+get
+    {"op": "get", "key": "rsyslog.RSYSLOGD_OPTIONS"} returns the setting as
+    {"ok": true, "setting": {"value": ..., "help": [...]}}, or null if it
+    is not set.
+list
+    {"op": "list", "filter": "ntp*.NTP*", "regex": false} returns the
+    matching settings as {"ok": true, "settings": [...]} with the same
+    records as confset.write_json().
+set
+    {"op": "set", "namespace": "rsyslog", "key": "RSYSLOGD_OPTIONS",
+    "value": "-c5", "backup": true} changes a setting.
+print
+    {"op": "print", "namespace": null, "filter": "", "info": false,
+    "regex": false} returns the text confset would print as
+    {"ok": true, "output": "..."}.
+
+Any request can include the configuration directories the client searches
+as "paths", see confset.config_paths().  The daemon refuses requests with
+paths that differ from its own, for example from a client running in a
+virtualenv, so they are answered from the same files the client would
+read itself.
+
+The socket is only accessible by the user running the daemon.
+"""
+import logging
+import os
+import socketserver
+import threading
+from . import client
+from .confset import ConfigSettings, ConfsetException, _setting_filter, check_setting_name, config_files, config_paths, \
+    render_configs
+from .watch import Watcher
+
+
+logger = logging.getLogger(__name__)
+
+
+class SettingsHandler(socketserver.StreamRequestHandler):
+    """
+    Answer the JSON requests sent over one connection
+    """
+
+    def handle(self):
+        import json
+        for line in self.rfile:
+            try:
+                message = json.loads(line.decode('utf-8'))
+                response = self.server.dispatch(message)
+            except (ConfsetException, IOError, OSError, KeyError, TypeError, ValueError) as exc:
+                response = {'ok': False, 'error': str(exc)}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class SettingsServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Unix socket server answering settings requests from a Watcher index
+    :param path: Path of the unix socket
+    :param use_inotify: Use inotify to detect changed config files when it is available
+    """
+    daemon_threads = True
+
+    def __init__(self, path=None, use_inotify=True):
+        self.path = path or client.socket_path()
+        self.watcher = Watcher(use_inotify=use_inotify)
+        self._lock = threading.Lock()
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        if os.path.exists(self.path):
+            if client.request({'op': 'get', 'key': ''}, path=self.path) is not None:
+                raise ConfsetException('A confset daemon is already listening on %s' % self.path)
+            os.remove(self.path)
+        umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.__init__(self, self.path, SettingsHandler)
+        finally:
+            os.umask(umask)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+        self.watcher.stop()
+
+    def dispatch(self, message):
+        """
+        Answer a request
+        :param message: (dict) The decoded request
+        :return: (dict) The response
+        """
+        operation = message.get('op')
+        paths = message.get('paths')
+        if paths is not None and list(paths) != config_paths():
+            raise ConfsetException('The daemon searches different configuration directories than the client')
+        with self._lock:
+            # Pick up changes made since the last request before answering
+            self.watcher.wait(timeout=0)
+            if operation == 'get':
+                setting = self.watcher.settings.get(message['key'])
+                return {'ok': True, 'setting': setting.as_dict() if setting is not None else None}
+            if operation == 'list':
+                return {'ok': True, 'settings': self.list_settings(message.get('filter'), message.get('regex', False))}
+            if operation == 'print':
+                return {'ok': True, 'output': self.render(message)}
+            if operation == 'set':
+                check_setting_name(message['namespace'], message['key'])
+                conf = ConfigSettings(message['namespace'], backup=message.get('backup', True))
+                conf.set(message['key'], message['value'])
+                self.watcher.refresh([message['namespace']])
+                return {'ok': True}
+        raise ConfsetException('Unknown operation %r' % (operation,))
+
+    def _configs(self, setting_filter=None):
+        configs = self.watcher.configs
+        return [
+            configs[namespace] for namespace in config_files()
+            if namespace in configs and (setting_filter is None or setting_filter.match_namespace(namespace))
+        ]
+
+    def list_settings(self, setting_filter=None, regex=False):
+        """
+        Get the settings matching a filter
+        :param setting_filter: Glob or regular expression, see SettingFilter
+        :param regex: Treat setting_filter as a regular expression
+        :return: (list) of dicts with the namespace, key, value, help and path of each setting
+        """
+        setting_filter = _setting_filter(setting_filter, regex=regex)
+        records = []
+        for conf in self._configs(setting_filter):
+            prefix_len = len(conf.conffile) + 1
+            for long_key in conf.order:
+                if setting_filter is None or setting_filter.match(long_key):
+                    setting = conf.settings[long_key]
+                    records.append({
+                        'namespace': conf.conffile, 'key': long_key[prefix_len:], 'value': setting.value,
+                        'help': list(setting.help), 'path': conf.filename
+                    })
+        return records
+
+    def render(self, message):
+        """
+        Render the settings the way the confset command prints them
+        :param message: (dict) print request
+        :return: (str)
+        """
+        info = message.get('info', False)
+        namespace = message.get('namespace')
+        if namespace:
+            conf = self.watcher.configs.get(namespace) or ConfigSettings(namespace)
+            return conf.format_settings(setting_filter=message.get('filter'), info=info)
+        setting_filter = _setting_filter(message.get('filter'), regex=message.get('regex', False))
+        return render_configs(self._configs(setting_filter), setting_filter, info=info)
+
+
+def _terminate(signum, frame):
+    raise KeyboardInterrupt()
+
+
+def serve(path=None, use_inotify=True):
+    """
+    Run the daemon until it is interrupted or terminated
+    :param path: Path of the unix socket, defaults to client.socket_path()
+    :param use_inotify: Use inotify to detect changed config files when it is available
+    """
+    server = SettingsServer(path, use_inotify=use_inotify)
+    logger.info('Serving confset requests on %s', server.path)
+    if threading.current_thread() is threading.main_thread():
+        import signal
+        signal.signal(signal.SIGTERM, _terminate)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,187 @@
+# Copyright (c) 2012-2015, Dwight Hubbard.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+r"""
+Tokenizer for the shell variable assignments in sysconfig and default files
+
+These files are sourced by shell scripts, so values follow the shell
+quoting rules::
+
+    export OPTIONS="-c5 -x"  # inline comment
+    MESSAGE='single '"and double"\ quoted
+    PATHS="/usr/lib \
+    /usr/local/lib"
+
+Each value is scanned once, left to right, and both the raw text of the
+value, which is what is written back to the file, and the value with the
+quotes and escapes removed are returned.  Quoted values and backslash
+continuations can span lines.
+
+A few forms the shell would not accept are read the way the tools that
+parse these files without a shell read them: blanks around the '=' are
+ignored and unquoted blanks inside a value are kept, so KEY = some value
+sets KEY to 'some value'.  A quote that is never closed is taken literally
+rather than swallowing the rest of the file.
+"""
+import re
+
+
+# The names the shell accepts for a variable, and so the only setting names that can be read back
+NAME_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+ASSIGNMENT_RE = re.compile(rb'[ \t]*(?:export[ \t]+)?([A-Za-z_][A-Za-z0-9_]*)[ \t]*=[ \t]*')
+# A whole line with a single word or quoted value that has no escapes, which is most of them
+SIMPLE_ASSIGNMENT_RE = re.compile(
+    rb'[ \t]*(?:export[ \t]+)?([A-Za-z_][A-Za-z0-9_]*)[ \t]*=[ \t]*'
+    rb'(([^ \t\r\n\'"\\#;&|][^ \t\r\n\'"\\;&|]*)|"([^"\\\r\n]*)"|\'([^\'\r\n]*)\'|)'
+    rb'(?:[ \t]|\r(?=\n))*(?:(?<=[ \t])#[^\r\n]*)?(?:\r?\n|\r|\Z)'
+)
+UNQUOTED_RUN_RE = re.compile(rb'[^ \t\r\n\'"\\#;&|]*')
+DOUBLE_QUOTED_RUN_RE = re.compile(rb'[^"\\]*')
+# Blanks, including the carriage return of a CRLF line break
+BLANKS_RE = re.compile(rb'(?:[ \t]|\r(?=\n))*')
+# A carriage return not followed by a newline, which ends a line like a newline does
+BARE_CR_RE = re.compile(rb'\r(?!\n)')
+LINE_BREAK_RE = re.compile(rb'\n|\r(?!\n)')
+BLANKS = (b' ', b'\t', b'\r')
+DOUBLE_QUOTED_ESCAPES = (b'$', b'`', b'"', b'\\')
+
+
+class Tokenizer(object):
+    """
+    Scan the values of shell variable assignments in the contents of a file
+    :param data: (bytes or mmap) Contents of the file
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.size = len(data)
+        self.bare_cr = data.find(b'\r') >= 0 and BARE_CR_RE.search(data) is not None
+        # A quote after the last one in the file is never closed
+        self._last_quote = {b"'": data.rfind(b"'"), b'"': data.rfind(b'"')}
+
+    def line_end(self, position):
+        """
+        Find the end of a line
+        :param position: Offset in the line
+        :return: (int) offset just past the line break, or the size of the data on the last line
+        """
+        if not self.bare_cr:
+            return self.data.find(b'\n', position) + 1 or self.size
+        match = LINE_BREAK_RE.search(self.data, position)
+        return match.end() if match else self.size
+
+    def assignment(self, position):
+        """
+        Tokenize the assignment on a line
+        :param position: Offset of the start of the line
+        :return: (tuple) of the name, the offsets of the start and the end of the raw value, the offset
+                 where the value ends on the last line of the assignment and the unquoted value,
+                 all as bytes and offsets into data, or None if the line is not an assignment
+        """
+        match = SIMPLE_ASSIGNMENT_RE.match(self.data, position)
+        if match:
+            unquoted = match.group(3)
+            if unquoted is None:
+                unquoted = match.group(4)
+                if unquoted is None:
+                    unquoted = match.group(5) or b''
+            return match.group(1), match.start(2), match.end(2), match.end(2), unquoted
+        match = ASSIGNMENT_RE.match(self.data, position)
+        if match is None:
+            return None
+        value_end, stop, unquoted = self.scan_value(match.end())
+        return match.group(1), match.end(), value_end, stop, unquoted
+
+    def scan_value(self, position):
+        """
+        Scan the value of an assignment
+
+        The value ends at an unquoted newline, an unquoted ';', '&' or '|',
+        or a '#' after an unquoted blank, which starts a comment.  Trailing
+        unquoted blanks are not part of the value.
+        :param position: Offset of the first byte of the value
+        :return: (tuple) offset just past the raw value, offset where the scan stopped and the
+                 unquoted value as bytes
+        """
+        data = self.data
+        size = self.size
+        chunks = []
+        end = position
+        kept = 0
+        while position < size:
+            run_end = UNQUOTED_RUN_RE.match(data, position).end()
+            if run_end > position:
+                chunks.append(data[position:run_end])
+                position = end = run_end
+                kept = len(chunks)
+                if position >= size:
+                    break
+            run_end = BLANKS_RE.match(data, position).end()
+            if run_end > position:
+                chunks.append(data[position:run_end])
+                position = run_end
+                continue
+            char = data[position:position + 1]
+            if char == b'#':
+                if data[position - 1:position] in BLANKS:
+                    break
+                chunks.append(char)
+                position += 1
+            elif char in (b"'", b'"'):
+                if position >= self._last_quote[char]:
+                    chunks.append(char)
+                    position += 1
+                elif char == b"'":
+                    run_end = data.find(b"'", position + 1)
+                    chunks.append(data[position + 1:run_end])
+                    position = run_end + 1
+                else:
+                    position = self._scan_double_quoted(position + 1, chunks)
+            elif char == b'\\':
+                escaped = data[position + 1:position + 2]
+                if escaped == b'\n':
+                    position += 2
+                    continue
+                if escaped == b'\r' and data[position + 2:position + 3] == b'\n':
+                    position += 3
+                    continue
+                chunks.append(escaped)
+                position += 1 + len(escaped)
+            else:
+                break
+            end = position
+            kept = len(chunks)
+        return end, position, b''.join(chunks[:kept])
+
+    def _scan_double_quoted(self, position, chunks):
+        data = self.data
+        size = self.size
+        while position < size:
+            run_end = DOUBLE_QUOTED_RUN_RE.match(data, position).end()
+            chunks.append(data[position:run_end])
+            position = run_end
+            if position >= size:
+                return size
+            if data[position:position + 1] == b'"':
+                return position + 1
+            escaped = data[position + 1:position + 2]
+            if escaped == b'\n':
+                pass
+            elif escaped in DOUBLE_QUOTED_ESCAPES:
+                chunks.append(escaped)
+            else:
+                chunks.append(data[position:position + 2])
+            position += 2
+        return min(position, size)
+
+
+def unquote(value):
+    """
+    Remove the shell quoting from a value
+    :param value: (str) Raw value as written in a conf file, for example '"-c5 -x"'
+    :return: (str) The value the shell would see, for example '-c5 -x'
+    """
+    data = value.encode('utf-8', 'surrogateescape')
+    if not UNQUOTED_RUN_RE.fullmatch(data):
+        data = Tokenizer(data).scan_value(0)[2]
+    return data.decode('utf-8', 'surrogateescape')
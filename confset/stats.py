@@ -0,0 +1,166 @@
+# Copyright (c) 2012-2015, Dwight Hubbard.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Phase timers and counters for confset operations
+
+Statistics are only gathered inside a collect() context, outside of one the
+instrumentation calls do nothing.  Callbacks registered with subscribe() are
+called with the Stats object each time a collect() context exits::
+
+    import confset.stats
+
+    def report(stats):
+        send_to_telemetry(stats.as_dict())
+
+    confset.stats.subscribe(report)
+    with confset.stats.collect():
+        confset.print_settings()
+
+Phase times are exclusive, time spent in a nested phase is not counted
+against the phase around it.  Time spent in worker threads is added up, so
+with parallel loading the phase times can exceed the wall clock time.
+"""
+import contextlib
+import threading
+import time
+
+
+PHASES = ['discovery', 'parse', 'render', 'write', 'lock']
+COUNTERS = [
+    'files_scanned', 'files_skipped', 'files_parsed', 'cache_hits', 'bytes_read', 'lines_parsed', 'bytes_written',
+    'fsyncs', 'backups_created', 'rebases'
+]
+_current = None
+_subscribers = []
+
+
+class Stats(object):
+    """
+    Timers and counters gathered for one collect() context
+    """
+
+    def __init__(self):
+        self.timings = dict.fromkeys(PHASES, 0.0)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def add(self, counter, amount=1):
+        """
+        Increment a counter
+        :param counter: Name of the counter
+        :param amount:
+        """
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def add_time(self, phase, seconds):
+        """
+        Add time to a phase
+        :param phase: Name of the phase
+        :param seconds:
+        """
+        with self._lock:
+            self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def as_dict(self):
+        """
+        Get the statistics as a dictionary
+        :return: (dict) with the 'timings' in seconds and the 'counters'
+        """
+        with self._lock:
+            return {'timings': dict(self.timings), 'counters': dict(self.counters)}
+
+    def format(self, output_format='text'):
+        """
+        Format the statistics for display
+        :param output_format: 'text' or 'json'
+        :return: (str)
+        """
+        data = self.as_dict()
+        if output_format == 'json':
+            import json
+            return json.dumps(data, sort_keys=True)
+        lines = ['confset statistics:']
+        for phase in PHASES:
+            lines.append('    %-16s %10.6fs' % (phase, data['timings'][phase]))
+        for counter in COUNTERS:
+            lines.append('    %-16s %10d' % (counter, data['counters'][counter]))
+        return '\n'.join(lines)
+
+
+def subscribe(callback):
+    """
+    Register a callback that is called with the Stats object when a collect() context exits
+    :param callback:
+    :return: The callback, so this can be used as a decorator
+    """
+    _subscribers.append(callback)
+    return callback
+
+
+def unsubscribe(callback):
+    """
+    Remove a callback registered with subscribe()
+    :param callback:
+    """
+    if callback in _subscribers:
+        _subscribers.remove(callback)
+
+
+@contextlib.contextmanager
+def collect():
+    """
+    Gather statistics for the confset operations run inside the context
+    :return: (Stats)
+    """
+    global _current
+    previous = _current
+    current = _current = Stats()
+    try:
+        yield current
+    finally:
+        _current = previous
+        for callback in list(_subscribers):
+            callback(current)
+
+
+def count(counter, amount=1):
+    """
+    Increment a counter of the active collect() context
+    :param counter: Name of the counter
+    :param amount:
+    """
+    if _current is not None:
+        _current.add(counter, amount)
+
+
+@contextlib.contextmanager
+def timer(phase):
+    """
+    Time the code run inside the context as part of a phase
+    :param phase: Name of the phase
+    """
+    current = _current
+    if current is None:
+        yield
+        return
+    stack = current._stack()
+    now = time.perf_counter()
+    if stack:
+        current.add_time(stack[-1][0], now - stack[-1][1])
+    stack.append([phase, now])
+    try:
+        yield
+    finally:
+        now = time.perf_counter()
+        current.add_time(phase, now - stack.pop()[1])
+        if stack:
+            stack[-1][1] = now
@@ -0,0 +1,278 @@
+# Copyright (c) 2012-2015, Dwight Hubbard.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Keep an in-memory index of all settings up to date as config files change
+
+A Watcher loads every config file in config_paths() once and then only
+parses the files that changed.  Callbacks are called with the settings that
+were added, changed or removed::
+
+    import confset.watch
+
+    def report(diff):
+        for long_key, (old, new) in diff.changed.items():
+            print('%s changed from %s to %s' % (long_key, old.value, new.value))
+
+    watcher = confset.watch.Watcher(report)
+    watcher.start()
+    print(watcher.settings['rsyslog.RSYSLOGD_OPTIONS'].value)
+    watcher.stop()
+
+On Linux changes are detected with inotify.  Where inotify isn't available
+the config files are stat'ed every interval seconds instead.  Directories
+that don't exist when the Watcher is created are only picked up by polling.
+"""
+import collections
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+from . import cache
+from .confset import config_paths, discover_config_files, load_config
+
+
+SettingsDiff = collections.namedtuple('SettingsDiff', ['added', 'changed', 'removed'])
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | \
+    IN_MOVE_SELF
+EVENT_HEADER = struct.Struct('iIII')
+logger = logging.getLogger(__name__)
+
+
+class Inotify(object):
+    """
+    Minimal inotify binding using ctypes
+    :param directories: Directories to watch, the ones that don't exist are skipped
+    :raises OSError: if inotify is not available
+    """
+
+    def __init__(self, directories):
+        if not sys.platform.startswith('linux'):
+            raise OSError('inotify is only available on Linux')
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self.directories = {}
+        for directory in directories:
+            watch_descriptor = libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+            if watch_descriptor >= 0:
+                self.directories[watch_descriptor] = directory
+
+    def read(self, timeout=None):
+        """
+        Wait for events
+        :param timeout: Seconds to wait, None waits until there is an event
+        :return: (set) names of the files that changed, or None if every file has to be checked again
+        """
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return set()
+        names = set()
+        rescan = False
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset + EVENT_HEADER.size <= len(data):
+                watch_descriptor, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & (IN_Q_OVERFLOW | IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                    rescan = True
+                elif name:
+                    names.add(os.fsdecode(name))
+        return None if rescan else names
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class Watcher(object):
+    """
+    In-memory index of all settings that follows changes to the config files
+
+    self.settings holds the Setting objects of all config files keyed by
+    'file.KEY' and self.configs the loaded ConfigSettings keyed by file name.
+    Both are updated in place by refresh(), use snapshot() to get a copy of
+    the settings that is safe to iterate over while the watcher thread is
+    running.
+    :param callback: Called with a SettingsDiff each time settings are added, changed or removed
+    :param interval: Seconds between checks when polling
+    :param use_inotify: Use inotify to detect changes when it is available
+    """
+
+    def __init__(self, callback=None, interval=1.0, use_inotify=True):
+        self.interval = interval
+        self.settings = {}
+        self.configs = {}
+        self._callbacks = []
+        self._files = {}
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._inotify = None
+        if callback:
+            self.subscribe(callback)
+        if use_inotify:
+            try:
+                self._inotify = Inotify([directory for directory in config_paths() if os.path.isdir(directory)])
+            except (OSError, AttributeError) as exc:
+                logger.debug('inotify is not available, polling for changes: %s', exc)
+        self._update(None)
+
+    @property
+    def using_inotify(self):
+        """
+        True if changes are detected with inotify instead of polling
+        """
+        return self._inotify is not None
+
+    def subscribe(self, callback):
+        """
+        Call callback with a SettingsDiff each time settings change
+        :param callback:
+        """
+        self._callbacks.append(callback)
+
+    def unsubscribe(self, callback):
+        """
+        Stop calling a callback registered with subscribe()
+        :param callback:
+        """
+        self._callbacks.remove(callback)
+
+    def snapshot(self):
+        """
+        Get a copy of the current settings
+        :return: (dict) Setting objects keyed by 'file.KEY'
+        """
+        with self._lock:
+            return dict(self.settings)
+
+    def _update(self, names):
+        """
+        Parse the config files that changed and update self.settings
+        :param names: Names of the config files to check, None checks every config file
+        :return: (SettingsDiff)
+        """
+        added = {}
+        changed = {}
+        removed = {}
+        with self._lock:
+            discovered = discover_config_files()
+            candidates = set(discovered) | set(self._files)
+            if names is not None:
+                candidates &= set(names)
+            for namespace in sorted(candidates):
+                filename = discovered.get(namespace)
+                identity = cache.file_identity(filename) if filename else None
+                known_identity, known_keys = self._files.get(namespace, (None, frozenset()))
+                if identity == known_identity:
+                    continue
+                conf = load_config(namespace) if identity else None
+                current = conf.settings if conf is not None else {}
+                for long_key in known_keys:
+                    if long_key not in current:
+                        removed[long_key] = self.settings.pop(long_key)
+                for long_key, setting in current.items():
+                    previous = self.settings.get(long_key)
+                    if previous is None:
+                        added[long_key] = setting
+                    elif previous != setting:
+                        changed[long_key] = (previous, setting)
+                    self.settings[long_key] = setting
+                if conf is None:
+                    self._files.pop(namespace, None)
+                    self.configs.pop(namespace, None)
+                else:
+                    self._files[namespace] = (identity, frozenset(current))
+                    self.configs[namespace] = conf
+        return SettingsDiff(added, changed, removed)
+
+    def refresh(self, names=None):
+        """
+        Check the config files for changes now
+
+        Only the files whose identity (path, inode, size and modification
+        time) changed are parsed.  The callbacks are called if any setting
+        changed.
+        :param names: Names of the config files to check, defaults to every config file
+        :return: (SettingsDiff)
+        """
+        diff = self._update(names)
+        if diff.added or diff.changed or diff.removed:
+            for callback in list(self._callbacks):
+                try:
+                    callback(diff)
+                except Exception:
+                    logger.exception('Settings change callback %r failed', callback)
+        return diff
+
+    def wait(self, timeout=None):
+        """
+        Wait for changes and refresh the files that changed
+        :param timeout: Seconds to wait, defaults to self.interval
+        :return: (SettingsDiff)
+        """
+        if timeout is None:
+            timeout = self.interval
+        if self._inotify is not None:
+            names = self._inotify.read(timeout)
+            if names is not None and not names:
+                return SettingsDiff({}, {}, {})
+            return self.refresh(names)
+        self._stop.wait(timeout)
+        return self.refresh()
+
+    def start(self):
+        """
+        Watch for changes in a background thread
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='confset-watcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.wait()
+
+    def stop(self):
+        """
+        Stop the background thread and release the inotify watches
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
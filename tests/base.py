@@ -0,0 +1,37 @@
+# Copyright (c) 2015, Dwight Hubbard
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Shared fixture for the confset tests.
+"""
+import confset
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class ConfsetTestCase(unittest.TestCase):
+    """
+    Test case that points confset at temporary conf, cache and lock directories
+
+    CONF_PATH is replaced rather than extended, so the tests never read or
+    write the system conf directories.
+    """
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.lock_dir = os.path.join(self.cache_dir, 'locks')
+        self.saved_cache_dir = confset.confset.CACHE_DIR
+        self.saved_lock_dir = confset.confset.LOCK_DIR
+        self.saved_conf_path = list(confset.confset.CONF_PATH)
+        confset.confset.CACHE_DIR = self.cache_dir
+        confset.confset.LOCK_DIR = self.lock_dir
+        confset.confset.CONF_PATH[:] = [self.tempdir]
+
+    def tearDown(self):
+        confset.confset.CONF_PATH[:] = self.saved_conf_path
+        confset.confset.CACHE_DIR = self.saved_cache_dir
+        confset.confset.LOCK_DIR = self.saved_lock_dir
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
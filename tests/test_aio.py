@@ -0,0 +1,63 @@
+# Copyright (c) 2015, Dwight Hubbard
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Tests for the `confset.aio` module.
+"""
+import asyncio
+import confset
+import logging
+import os
+import unittest
+from base import ConfsetTestCase
+
+
+# noinspection PyPep8Naming
+class TestAio(ConfsetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.config_file = 'testaio'
+        self.config_file_full = os.path.join(self.tempdir, self.config_file)
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        super().tearDown()
+
+    def test_aload_aset(self):
+        async def run():
+            config = await confset.aload(self.config_file)
+            await config.aset('test', 'value', help_text='Helpful comment')
+            await config.aset_many({'test': 'valuenew', 'test2': 'value2'})
+            return await confset.aload(self.config_file)
+
+        config = self.loop.run_until_complete(run())
+        self.assertEqual(config.settings['testaio.test'], {'help': ['Helpful comment'], 'value': 'valuenew'})
+        self.assertEqual(config.settings['testaio.test2']['value'], 'value2')
+
+    def test_aload_many(self):
+        for index in range(3):
+            with open(os.path.join(self.tempdir, 'testaio%d' % index), 'w') as file_handle:
+                file_handle.write('test=%d\n' % index)
+
+        configs = self.loop.run_until_complete(confset.aload_many(['testaio%d' % index for index in range(3)]))
+        self.assertEqual([config.settings['testaio%d.test' % index]['value'] for index, config in enumerate(configs)],
+                         ['0', '1', '2'])
+
+    def test_aiter_settings(self):
+        for index in range(5):
+            with open(os.path.join(self.tempdir, 'testaio%d' % index), 'w') as file_handle:
+                file_handle.write('# Help\ntest=%d\n' % index)
+
+        async def run():
+            records = []
+            async for record in confset.aiter_settings(jobs=2):
+                records.append(record)
+            return records
+
+        self.assertEqual(self.loop.run_until_complete(run()), list(confset.iter_settings()))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.DEBUG)
+    unittest.main()
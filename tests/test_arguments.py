@@ -1,9 +1,8 @@
 import logging
 import os
 import confset
-import shutil
-import tempfile
 import unittest
+from base import ConfsetTestCase
 from confset.arguments import ConfsetArguments, create_arg_parser
 try:
     from unittest import mock
@@ -12,23 +11,18 @@ except:
 
 
 # noinspection PyPep8Naming
-class TestConfsetArguments(unittest.TestCase):
+class TestConfsetArguments(ConfsetTestCase):
 
     def setUp(self):
+        super().setUp()
         self.parser = create_arg_parser()
-        self.tempdir = tempfile.mkdtemp()
         self.config_file = 'testarg'
         self.config_file_full = os.path.join(self.tempdir, self.config_file)
-        confset.CONF_PATH.append(self.tempdir)
-
-    def tearDown(self):
-        if os.path.exists(self.tempdir):
-            shutil.rmtree(self.tempdir)
-        confset.CONF_PATH.remove(self.tempdir)
-        self.tempdir = None
 
     @mock.patch('confset.confset.ConfigSettings.print_settings')
     def test_get_conf_without_arguments(self, mock_print):
+        with open(self.config_file_full, 'w') as file_handle:
+            file_handle.write('test=value\n')
         cmd = ''
         (options, args) = self.parser.parse_args(cmd.split(' '))
         test_instance = ConfsetArguments(args, options)
@@ -231,6 +225,69 @@ class TestConfsetArguments(unittest.TestCase):
         mock_set.assert_called_with('test_attr', '"special characters %#$&%#!%"')
         mock_print.assert_called_with(setting_filter='test_name.test_attr', info=False)
 
+    def test_no_backup_option(self):
+        cmd = 'test_name.test_attr=test_value'
+        (options, args) = self.parser.parse_args(cmd.split(' '))
+        self.assertTrue(ConfsetArguments(args, options).confset.backup)
+
+        cmd = '--no-backup test_name.test_attr=test_value'
+        (options, args) = self.parser.parse_args(cmd.split(' '))
+        self.assertFalse(ConfsetArguments(args, options).confset.backup)
+
+    @mock.patch('confset.print_settings')
+    def test_jobs_option(self, mock_print):
+        cmd = '--jobs 4'
+        (options, args) = self.parser.parse_args(cmd.split(' '))
+        test_instance = ConfsetArguments(args, options)
+        test_instance.execute()
+        mock_print.assert_called_with(setting_filter='', info=False, jobs=4)
+
+    @mock.patch('confset.print_settings')
+    def test_stream_option(self, mock_print):
+        cmd = '--stream'
+        (options, args) = self.parser.parse_args(cmd.split(' '))
+        test_instance = ConfsetArguments(args, options)
+        test_instance.execute()
+        mock_print.assert_called_with(setting_filter='', info=False, align=False)
+
+    @mock.patch('confset.print_settings')
+    def test_glob_arguments(self, mock_print):
+        cmd = 'ntp*.NTP*'
+        (options, args) = self.parser.parse_args(cmd.split(' '))
+        test_instance = ConfsetArguments(args, options)
+        self.assertIsNone(test_instance.name)
+        self.assertEqual(test_instance.get_filters(), 'ntp*.NTP*')
+        test_instance.execute()
+        mock_print.assert_called_with(setting_filter='ntp*.NTP*', info=False)
+
+        cmd = '--regex ntp.*\\.NTP.*'
+        (options, args) = self.parser.parse_args(cmd.split(' '))
+        test_instance = ConfsetArguments(args, options)
+        test_instance.execute()
+        mock_print.assert_called_with(setting_filter='ntp.*\\.NTP.*', info=False, regex=True)
+
+    @mock.patch('confset.confset.ConfigSettings.print_settings')
+    def test_glob_attribute(self, mock_print):
+        cmd = 'test_name.TEST*'
+        (options, args) = self.parser.parse_args(cmd.split(' '))
+        test_instance = ConfsetArguments(args, options)
+        self.assertEqual(test_instance.name, 'test_name')
+        test_instance.execute()
+        mock_print.assert_called_with(setting_filter='test_name.TEST*', info=False)
+
+    @mock.patch('confset.write_ndjson')
+    @mock.patch('confset.write_json')
+    def test_format_option(self, mock_json, mock_ndjson):
+        cmd = '--format json'
+        (options, args) = self.parser.parse_args(cmd.split(' '))
+        ConfsetArguments(args, options).execute()
+        mock_json.assert_called_with(jobs=None, setting_filter=None, regex=False)
+
+        cmd = '--format ndjson test_name'
+        (options, args) = self.parser.parse_args(cmd.split(' '))
+        ConfsetArguments(args, options).execute()
+        mock_ndjson.assert_called_with(jobs=None, setting_filter='test_name', regex=False)
+
     def test_invalid_arguments(self):
         """
         Test all invalid commands. Any command from here should all raise sys.exit(1)
@@ -295,6 +352,20 @@ class TestConfsetArguments(unittest.TestCase):
 
         self.assertEqual(cm.exception.code, 1)
 
+        cmd = 'test_name*.test_attr=test_value'
+        with self.assertRaises(SystemExit) as cm:
+            (options, args) = self.parser.parse_args(cmd.split(' '))
+            ConfsetArguments(args, options)
+
+        self.assertEqual(cm.exception.code, 1)
+
+        for cmd in ('test_name.my-attr=test_value', 'test_name.1attr=test_value', 'test_name.test_attr=a;b'):
+            with self.assertRaises(SystemExit) as cm:
+                (options, args) = self.parser.parse_args(cmd.split(' '))
+                ConfsetArguments(args, options)
+
+            self.assertEqual(cm.exception.code, 1)
+
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
@@ -0,0 +1,123 @@
+# Copyright (c) 2015, Dwight Hubbard
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Tests for the `confset.cache` module.
+"""
+import confset
+import confset.cache
+import json
+import logging
+import os
+import unittest
+from base import ConfsetTestCase
+
+
+# noinspection PyPep8Naming
+class TestCache(ConfsetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.config_file = 'testcache'
+        self.config_file_full = os.path.join(self.tempdir, self.config_file)
+        with open(self.config_file_full, 'w') as file_handle:
+            file_handle.write('# Helpful comment\ntest=value\n')
+
+    def test_cache_entry_created(self):
+        confset.ConfigSettings(self.config_file).load()
+        entry = confset.cache.entry_filename(self.cache_dir, self.config_file_full)
+        self.assertTrue(os.path.exists(entry))
+
+    def test_cache_entries_private(self):
+        os.chmod(self.config_file_full, 0o600)
+        cache_dir = os.path.join(self.cache_dir, 'private')
+        confset.confset.CACHE_DIR = cache_dir
+        confset.ConfigSettings(self.config_file).load()
+        self.assertEqual(os.stat(cache_dir).st_mode & 0o777, 0o700)
+        for name in os.listdir(cache_dir):
+            self.assertEqual(os.stat(os.path.join(cache_dir, name)).st_mode & 0o777, 0o600)
+
+    def test_cache_reused_when_unchanged(self):
+        confset.ConfigSettings(self.config_file)
+        identity = confset.cache.file_identity(self.config_file_full)
+        confset.cache.store(
+            self.cache_dir, self.config_file_full, identity,
+            {
+                'records': {'testcache.test': ['cached', []]},
+                'order': ['testcache.test'],
+                'spans': {'testcache.test': [0, 18, 23, 28]}
+            }
+        )
+        config = confset.ConfigSettings(self.config_file)
+        self.assertEqual(config.settings['testcache.test']['value'], 'cached')
+
+    def test_cache_ignores_other_versions(self):
+        identity = confset.cache.file_identity(self.config_file_full)
+        with open(confset.cache.entry_filename(self.cache_dir, self.config_file_full), 'w') as file_handle:
+            json.dump({'identity': identity, 'data': {'records': {'testcache.test': ['cached', []]}}}, file_handle)
+        self.assertIsNone(confset.cache.load(self.cache_dir, self.config_file_full, identity))
+        config = confset.ConfigSettings(self.config_file)
+        self.assertEqual(config.settings['testcache.test']['value'], 'value')
+
+    def test_cache_invalidated_on_change(self):
+        confset.ConfigSettings(self.config_file).load()
+        config = confset.ConfigSettings(self.config_file)
+        config.set('test', 'newvalue')
+        config = confset.ConfigSettings(self.config_file)
+        self.assertEqual(config.settings['testcache.test']['value'], 'newvalue')
+        self.assertEqual(config.settings['testcache.test']['help'], ['Helpful comment'])
+
+    def test_load_entry(self):
+        identity = confset.cache.file_identity(self.config_file_full)
+        self.assertEqual(
+            confset.cache.load_entry(self.cache_dir, self.config_file_full, suffix=confset.cache.STATE_SUFFIX),
+            (None, None)
+        )
+        confset.cache.store(
+            self.cache_dir, self.config_file_full, identity, {'content': 'hash'}, suffix=confset.cache.STATE_SUFFIX
+        )
+        self.assertEqual(
+            confset.cache.load_entry(self.cache_dir, self.config_file_full, suffix=confset.cache.STATE_SUFFIX),
+            (identity, {'content': 'hash'})
+        )
+        self.assertIsNone(
+            confset.cache.load(
+                self.cache_dir, self.config_file_full, identity[:3] + [0], suffix=confset.cache.STATE_SUFFIX
+            )
+        )
+
+    def test_key_index(self):
+        identity = confset.cache.file_identity(self.config_file_full)
+        spans = dict(('testcache.key%d' % index, [-1, index, index + 4, index + 9]) for index in range(100))
+        confset.cache.store_index(self.cache_dir, self.config_file_full, identity, spans, 42)
+        index = confset.cache.load_index(
+            self.cache_dir, self.config_file_full, identity, ['testcache.key7', 'testcache.key99', 'testcache.missing']
+        )
+        self.assertEqual(index, {'spans': {'testcache.key7': [-1, 7, 11, 16], 'testcache.key99': [-1, 99, 103, 108]}, 'width': 42})
+        self.assertEqual(confset.cache.load_index(self.cache_dir, self.config_file_full, identity)['spans'], spans)
+        self.assertEqual(
+            confset.cache.load_index(self.cache_dir, self.config_file_full, identity, ['testcache.much_longer_key']),
+            {'spans': {}, 'width': 42}
+        )
+        self.assertIsNone(confset.cache.load_index(self.cache_dir, self.config_file_full, identity[:3] + [0]))
+
+    def test_cache_disabled(self):
+        confset.ConfigSettings(self.config_file, use_cache=False).load()
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_cache_eviction(self):
+        for index in range(10):
+            filename = os.path.join(self.tempdir, 'file%d' % index)
+            confset.cache.store(
+                self.cache_dir, filename, [filename, index, 0, 0], {'settings': {}, 'order': ['x' * 100]}
+            )
+        confset.cache.evict(self.cache_dir, max_bytes=500)
+        total = sum(
+            os.path.getsize(os.path.join(self.cache_dir, name)) for name in os.listdir(self.cache_dir)
+        )
+        self.assertLessEqual(total, 500)
+        self.assertTrue(os.listdir(self.cache_dir))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.DEBUG)
+    unittest.main()
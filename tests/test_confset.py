@@ -7,27 +7,28 @@
 Tests for `redislite` module.
 """
 from __future__ import print_function
+import collections
 import confset
+import contextlib
+import io
 import logging
 import os
 import shutil
 import tempfile
 import unittest
+from base import ConfsetTestCase
+try:
+    from unittest import mock
+except ImportError:
+    import mock
 
 
 # noinspection PyPep8Naming
-class TestConfset(unittest.TestCase):
+class TestConfset(ConfsetTestCase):
     def setUp(self):
-        self.tempdir = tempfile.mkdtemp()
+        super().setUp()
         self.config_file = 'testconf'
         self.config_file_full = os.path.join(self.tempdir, self.config_file)
-        confset.CONF_PATH.append(self.tempdir)
-
-    def tearDown(self):
-        if os.path.exists(self.tempdir):
-            shutil.rmtree(self.tempdir)
-        confset.CONF_PATH.remove(self.tempdir)
-        self.tempdir = None
 
     def test_config_create(self):
         self.assertFalse(os.path.exists(self.config_file_full))
@@ -95,11 +96,644 @@ class TestConfset(unittest.TestCase):
             )
             self.assertIn('test2=test2', result, "Second setting missing")
 
+    def test_iter_settings(self):
+        config = confset.ConfigSettings(self.config_file)
+        config.set('test', 'value', help_text='Helpful comment')
+        config.set('test2', 'value2')
+        records = [record for record in confset.iter_settings() if record.namespace == self.config_file]
+        self.assertEqual(
+            records,
+            [
+                (self.config_file, 'test', 'value', ['Helpful comment']),
+                (self.config_file, 'test2', 'value2', [])
+            ]
+        )
+
+    def test_settings_parses_each_file_once(self):
+        config = confset.ConfigSettings(self.config_file)
+        config.set('test', 'value', help_text='Helpful comment')
+        shutil.rmtree(self.cache_dir)
+        with mock.patch.object(
+            confset.ConfigSettings, 'parse_settings', autospec=True, side_effect=confset.ConfigSettings.parse_settings
+        ) as mock_parse:
+            all_settings = confset.settings()
+        parsed = [call[0][0].conffile for call in mock_parse.call_args_list]
+        self.assertEqual(parsed.count(self.config_file), 1)
+        self.assertEqual(
+            all_settings['testconf.test'], {'help': ['Helpful comment'], 'value': 'value'}
+        )
+
+    def test_config_not_parsed_until_used(self):
+        config = confset.ConfigSettings(self.config_file)
+        config.set('test', 'value', help_text='Helpful comment')
+        with mock.patch.object(confset.ConfigSettings, 'available_settings') as mock_available:
+            confset.ConfigSettings(self.config_file)
+            self.assertFalse(mock_available.called)
+        config = confset.ConfigSettings(self.config_file)
+        self.assertEqual(getattr(config, 'testconf.test')['value'], 'value')
+        self.assertFalse(hasattr(config, 'testconf.missing'))
+
+    def test_load_error_not_recursive(self):
+        config = confset.ConfigSettings(self.config_file)
+        with mock.patch.object(confset.ConfigSettings, 'read_settings', side_effect=AttributeError('broken')):
+            with self.assertRaises(AttributeError):
+                config.settings
+            with self.assertRaises(AttributeError):
+                config.order
+
+    def test_settings_view(self):
+        config = confset.ConfigSettings(self.config_file)
+        config.set('test', 'value', help_text='Helpful comment')
+        view = confset.SettingsView()
+        with mock.patch.object(confset.confset, 'config_files') as mock_files:
+            self.assertEqual(view['testconf.test'], {'help': ['Helpful comment'], 'value': 'value'})
+            self.assertIn('testconf.test', view)
+            self.assertNotIn('testconf.missing', view)
+            self.assertNotIn('missing', view)
+            self.assertFalse(mock_files.called)
+        self.assertIn('testconf.test', list(view))
+        with self.assertRaises(TypeError):
+            view['testconf.test'] = 'readonly'
+
+    def test_set_many(self):
+        config = confset.ConfigSettings(self.config_file)
+        config.set('test', 'value', help_text='Helpful comment')
+        with mock.patch.object(confset.ConfigSettings, 'write_settings', autospec=True) as mock_write:
+            config.set_many({'test': 'valuenew', 'test2': 'value2'})
+            self.assertEqual(mock_write.call_count, 1)
+        config.write_settings()
+        config = confset.ConfigSettings(self.config_file)
+        self.assertEqual(config.settings['testconf.test']['value'], 'valuenew')
+        self.assertEqual(config.settings['testconf.test']['help'], ['Helpful comment'])
+        self.assertEqual(config.settings['testconf.test2']['value'], 'value2')
+
+    def test_batch_single_backup(self):
+        config = confset.ConfigSettings(self.config_file)
+        config.set('test', 'value')
+        with config.batch():
+            config.set('test', 'value1')
+            config.set('test2', 'value2')
+        config.set('test', 'value3')
+        backups = [name for name in os.listdir(self.tempdir) if '.confset.' in name and not name.startswith('.')]
+        self.assertEqual(len(backups), 2)
+
+    def test_batch_discarded_on_exception(self):
+        config = confset.ConfigSettings(self.config_file)
+        config.set('test', 'value')
+        with self.assertRaises(ValueError):
+            with config.batch():
+                config.set('test', 'changed')
+                raise ValueError('abort')
+        self.assertEqual(config.settings['testconf.test']['value'], 'value')
+        config = confset.ConfigSettings(self.config_file)
+        self.assertEqual(config.settings['testconf.test']['value'], 'value')
+
+    def test_write_is_atomic_with_linked_backup(self):
+        config = confset.ConfigSettings(self.config_file)
+        config.set('test', 'value')
+        original_inode = os.stat(self.config_file_full).st_ino
+        config.set('test', 'valuenew')
+        backups = [name for name in os.listdir(self.tempdir) if '.confset.' in name and not name.startswith('.')]
+        self.assertEqual(len(backups), 1)
+        backup = os.path.join(self.tempdir, backups[0])
+        self.assertEqual(os.stat(backup).st_ino, original_inode)
+        self.assertNotEqual(os.stat(self.config_file_full).st_ino, original_inode)
+        with open(backup) as file_handle:
+            self.assertIn('test=value\n', file_handle.read())
+
+    def test_write_without_backup(self):
+        config = confset.ConfigSettings(self.config_file, backup=False)
+        config.set('test', 'value')
+        config.set('test', 'valuenew')
+        self.assertEqual([name for name in os.listdir(self.tempdir) if not name.startswith('.')], [self.config_file])
+
+    def test_write_failure_keeps_original(self):
+        config = confset.ConfigSettings(self.config_file)
+        config.set('test', 'value')
+        with mock.patch.object(confset.confset.os, 'replace', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                config.set('test', 'valuenew', help_text='New help')
+        with open(self.config_file_full) as file_handle:
+            self.assertIn('test=value\n', file_handle.read())
+        self.assertFalse([name for name in os.listdir(self.tempdir) if name.endswith('.tmp')])
+
+    def test_set_preserves_format(self):
+        original = (
+            '# Vendor header\n\n#  Helpful comment\nTEST="value"   # trailing\n'
+            'if [ -f /etc/other ]; then . /etc/other; fi\n\n#OTHER=commented\nOTHER = 1\n'
+        )
+        with open(self.config_file_full, 'w') as file_handle:
+            file_handle.write(original)
+        config = confset.ConfigSettings(self.config_file)
+        self.assertEqual(config.settings['testconf.TEST'].value, '"value"')
+        self.assertEqual(config.settings['testconf.TEST'].unquoted, 'value')
+        config.set('OTHER', '2')
+        with open(self.config_file_full) as file_handle:
+            self.assertEqual(file_handle.read(), original.replace('OTHER = 1', 'OTHER = 2'))
+
+        config.set('TEST', '"new"', help_text=['New help'])
+        config.set('NEW', 'added')
+        with open(self.config_file_full) as file_handle:
+            result = file_handle.read()
+        self.assertTrue(result.startswith('# Vendor header\n\n# New help\nTEST="new"   # trailing\nif [ -f /etc/other ]'))
+        self.assertTrue(result.endswith('OTHER = 2\n\nNEW=added\n'))
+
+    def test_write_keeps_unpatched_content(self):
+        original = (
+            '#!/bin/sh\n# Vendor header\n\n# Interrupted help\n[ -f /etc/other ] && . /etc/other\nTEST=1\n'
+            '\n# Removed help\nREMOVED=1\nLAST=1\n'
+        )
+        with open(self.config_file_full, 'w') as file_handle:
+            file_handle.write(original)
+        config = confset.ConfigSettings(self.config_file, backup=False)
+        config.write_settings()
+        with open(self.config_file_full) as file_handle:
+            self.assertEqual(file_handle.read(), original)
+
+        config.set('TEST', '2', help_text=['New help'])
+        with open(self.config_file_full) as file_handle:
+            self.assertEqual(
+                file_handle.read(), original.replace('TEST=1', '\n# New help\nTEST=2')
+            )
+        self.assertEqual(config.settings['testconf.TEST'].help, ('New help',))
+
+        del config.settings['testconf.REMOVED']
+        config.order.remove('testconf.REMOVED')
+        config.write_settings()
+        with open(self.config_file_full) as file_handle:
+            self.assertTrue(file_handle.read().endswith('TEST=2\n\nLAST=1\n'))
+        config = confset.ConfigSettings(self.config_file, use_cache=False)
+        self.assertEqual(config.order, ['testconf.TEST', 'testconf.LAST'])
+
+    def test_set_through_symlink(self):
+        target_dir = tempfile.mkdtemp()
+        try:
+            target = os.path.join(target_dir, 'real')
+            with open(target, 'w') as file_handle:
+                file_handle.write('A=1\n')
+            os.symlink(target, self.config_file_full)
+            confset.ConfigSettings(self.config_file).set('A', '2')
+            self.assertTrue(os.path.islink(self.config_file_full))
+            with open(target) as file_handle:
+                self.assertEqual(file_handle.read(), 'A=2\n')
+            backups = [name for name in os.listdir(target_dir) if name.startswith('real.confset.')]
+            self.assertEqual(len(backups), 1)
+            with open(os.path.join(target_dir, backups[0])) as file_handle:
+                self.assertEqual(file_handle.read(), 'A=1\n')
+        finally:
+            shutil.rmtree(target_dir)
+
+    def test_set_rewrites_when_file_changed(self):
+        config = confset.ConfigSettings(self.config_file)
+        config.set('test', 'value')
+        config = confset.ConfigSettings(self.config_file)
+        config.load()
+        with open(self.config_file_full, 'a') as file_handle:
+            file_handle.write('external=1\n')
+        config.set('test', 'valuenew')
+        with open(self.config_file_full) as file_handle:
+            result = file_handle.read()
+        self.assertIn('test=valuenew', result)
+        self.assertNotIn('test=value\n', result)
+        self.assertIn('external=1\n', result)
+
+    def test_concurrent_writers_distinct_keys(self):
+        confset.ConfigSettings(self.config_file).set('test', 'value')
+        first = confset.ConfigSettings(self.config_file)
+        second = confset.ConfigSettings(self.config_file)
+        first.load()
+        second.load()
+        first.set('first', '1')
+        second.set('second', '2')
+        second.set('test', 'valuenew')
+        config = confset.ConfigSettings(self.config_file, use_cache=False)
+        self.assertEqual(
+            dict((key, setting.value) for key, setting in config.settings.items()),
+            {'testconf.test': 'valuenew', 'testconf.first': '1', 'testconf.second': '2'}
+        )
+        self.assertEqual(second.settings['testconf.first'].value, '1')
+
+    def test_concurrent_writers_conflict(self):
+        confset.ConfigSettings(self.config_file).set('test', 'value')
+        first = confset.ConfigSettings(self.config_file)
+        second = confset.ConfigSettings(self.config_file)
+        first.load()
+        second.load()
+        first.set('test', 'first')
+        with self.assertRaises(confset.ConfsetConflict) as context:
+            second.set('test', 'second')
+        self.assertEqual(context.exception.keys, ['testconf.test'])
+        config = confset.ConfigSettings(self.config_file, use_cache=False)
+        self.assertEqual(config.settings['testconf.test'].value, 'first')
+        second = confset.ConfigSettings(self.config_file)
+        second.load()
+        first.set('test', 'again')
+        second.set('test', 'again')
+        self.assertEqual(second.settings['testconf.test'].value, 'again')
+
+    def test_stale_set_of_unchanged_value(self):
+        confset.ConfigSettings(self.config_file, backup=False).set('test', 'value')
+        first = confset.ConfigSettings(self.config_file, backup=False)
+        first.load()
+        confset.ConfigSettings(self.config_file, backup=False).set('test', 'other')
+        with self.assertRaises(confset.ConfsetConflict):
+            first.set('test', 'value')
+        with self.assertRaises(confset.ConfsetConflict):
+            with first.batch():
+                first.set('test', 'value')
+
+        first = confset.ConfigSettings(self.config_file, backup=False)
+        first.load()
+        confset.ConfigSettings(self.config_file, backup=False).set('other', '1')
+        identity = confset.cache.file_identity(self.config_file_full)
+        first.set('test', 'other')
+        self.assertEqual(confset.cache.file_identity(self.config_file_full), identity)
+        self.assertEqual(first.settings['testconf.other'].value, '1')
+
+    def test_set_invalid_names(self):
+        config = confset.ConfigSettings(self.config_file, backup=False)
+        config.set('test', 'value')
+        with open(self.config_file_full) as file_handle:
+            expected = file_handle.read()
+        for key in ('my-key', '1abc', 'MY KEY', ''):
+            with self.assertRaises(confset.ConfsetException):
+                config.set(key, 'value')
+        for value in ('a;b', 'foo # bar', 'a|b', 'a&', "it's", 'value ', 'a\nb'):
+            with self.assertRaises(confset.ConfsetException):
+                config.set('test', value)
+        with self.assertRaises(confset.ConfsetException):
+            confset.ConfigSettings(os.path.join(self.tempdir, 'victim')).set('KEY', 'value')
+        with open(self.config_file_full) as file_handle:
+            self.assertEqual(file_handle.read(), expected)
+        self.assertFalse(os.path.exists(os.path.join(self.tempdir, 'victim')))
+
+    def test_parallel_writers_threads(self):
+        import concurrent.futures
+        confset.ConfigSettings(self.config_file, backup=False).set('test', 'value')
+
+        def writer(number):
+            confset.ConfigSettings(self.config_file, backup=False).set('key%d' % number, str(number))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(writer, range(32)))
+        config = confset.ConfigSettings(self.config_file, use_cache=False)
+        for number in range(32):
+            self.assertEqual(config.settings['testconf.key%d' % number].value, str(number))
+
+    def test_lock_file_not_a_config_file(self):
+        confset.ConfigSettings(self.config_file).set('test', 'value')
+        self.assertTrue(os.path.exists(confset.confset.lock_filename(self.config_file_full)))
+        self.assertEqual(os.path.dirname(confset.confset.lock_filename(self.config_file_full)), self.lock_dir)
+        self.assertEqual(os.listdir(self.tempdir), [self.config_file])
+
+    def test_lock_file_without_lock_dir(self):
+        with open(self.config_file_full, 'w') as file_handle:
+            file_handle.write('test=value\n')
+        confset.confset.LOCK_DIR = os.path.join(self.config_file_full, 'locks')
+        confset.ConfigSettings(self.config_file).set('test', 'newvalue')
+        self.assertEqual(
+            confset.confset.lock_filename(self.config_file_full), os.path.join(self.tempdir, '.testconf.confset.lock')
+        )
+        self.assertTrue(os.path.exists(confset.confset.lock_filename(self.config_file_full)))
+        self.assertEqual(
+            [name for name in confset.confset.scan_directory(self.tempdir) if name.startswith('.')], []
+        )
+
+    def test_parse_memory_mapped(self):
+        config = confset.ConfigSettings(self.config_file)
+        config.set_many({'test': 'value', 'test2': 'value2'})
+        config.set('test', 'value', help_text=['Helpful comment'])
+        expected = confset.ConfigSettings(self.config_file, use_cache=False).parse_settings()
+        with mock.patch.object(confset.confset, 'MMAP_THRESHOLD', 1):
+            parsed = confset.ConfigSettings(self.config_file, use_cache=False).parse_settings()
+        self.assertEqual(parsed, expected)
+        self.assertEqual(parsed['settings']['testconf.test'], {'help': ['Helpful comment'], 'value': 'value'})
+
+    def test_parse_memory_mapped_line_endings(self):
+        for data in (b'# help\r\nkey="value"\r\nother=2 # comment\r\n', b'# help\rkey="value"\rother=2 # comment\r'):
+            with open(self.config_file_full, 'wb') as file_handle:
+                file_handle.write(data)
+            expected = confset.ConfigSettings(self.config_file, use_cache=False).parse_settings()
+            with mock.patch.object(confset.confset, 'MMAP_THRESHOLD', 1):
+                parsed = confset.ConfigSettings(self.config_file, use_cache=False).parse_settings()
+            self.assertEqual(parsed, expected)
+            self.assertEqual(parsed['order'], ['testconf.key', 'testconf.other'])
+            self.assertEqual(parsed['settings']['testconf.key'], {'help': ['help'], 'value': '"value"'})
+            self.assertEqual(parsed['settings']['testconf.other'].value, '2')
+
+    def test_parse_line_endings(self):
+        for data in (b'# help\r\nkey=value\r\nother=2', b'# help\rkey=value\rother=2\r'):
+            parsed = confset.confset.parse_config(data, 'testconf')
+            self.assertEqual(parsed['order'], ['testconf.key', 'testconf.other'])
+            self.assertEqual(parsed['settings']['testconf.key'], {'help': ['help'], 'value': 'value'})
+            self.assertEqual(parsed['settings']['testconf.other'].value, '2')
+
+    def test_point_lookup_uses_index(self):
+        config = confset.ConfigSettings(self.config_file)
+        config.set_many({'test': 'value', 'longer_test': 'longer value'})
+        config.set('test', 'value', help_text=['Helpful comment', 'second line'])
+
+        expected = io.StringIO()
+        with contextlib.redirect_stdout(expected):
+            confset.ConfigSettings(self.config_file, use_cache=False).print_settings(
+                setting_filter='testconf.test', info=True
+            )
+
+        config = confset.ConfigSettings(self.config_file)
+        result = io.StringIO()
+        with mock.patch.object(confset.ConfigSettings, 'parse_settings') as mock_parse:
+            with contextlib.redirect_stdout(result):
+                config.print_settings(setting_filter='testconf.test', info=True)
+            self.assertEqual(
+                config.get_setting('test'), {'help': ['Helpful comment', 'second line'], 'value': 'value'}
+            )
+            self.assertIsNone(config.get_setting('missing'))
+            self.assertFalse(mock_parse.called)
+        self.assertEqual(result.getvalue(), expected.getvalue())
+        self.assertIsNone(config._settings)
+
+    def test_point_lookup_after_change(self):
+        config = confset.ConfigSettings(self.config_file)
+        config.set('test', 'value')
+        config = confset.ConfigSettings(self.config_file)
+        with open(self.config_file_full, 'w') as file_handle:
+            file_handle.write('# changed\ntest=other value\n')
+        self.assertEqual(config.get_setting('test'), {'help': ['changed'], 'value': 'other value'})
+
+    def test_config_files_precedence(self):
+        second_dir = tempfile.mkdtemp()
+        confset.CONF_PATH.append(second_dir)
+        try:
+            for directory in (self.tempdir, second_dir):
+                with open(os.path.join(directory, self.config_file), 'w') as file_handle:
+                    file_handle.write('test=%s\n' % directory)
+            with open(os.path.join(second_dir, 'testconf.confset.20150101000000'), 'w') as file_handle:
+                file_handle.write('test=backup\n')
+            self.assertEqual(confset.config_files().count(self.config_file), 1)
+            self.assertNotIn('testconf.confset.20150101000000', confset.config_files())
+            self.assertEqual(
+                confset.discover_config_files()[self.config_file], os.path.join(self.tempdir, self.config_file)
+            )
+            self.assertEqual(confset.ConfigSettings(self.config_file).settings['testconf.test']['value'], self.tempdir)
+        finally:
+            confset.CONF_PATH.remove(second_dir)
+            shutil.rmtree(second_dir)
+
+    def test_scan_directory_memoized(self):
+        with open(self.config_file_full, 'w') as file_handle:
+            file_handle.write('test=value\n')
+        os.utime(self.tempdir, (0, 0))
+        self.assertEqual(confset.confset.scan_directory(self.tempdir), frozenset([self.config_file]))
+        with mock.patch.object(confset.confset.os, 'scandir') as mock_scandir:
+            self.assertEqual(confset.confset.scan_directory(self.tempdir), frozenset([self.config_file]))
+            self.assertFalse(mock_scandir.called)
+        with open(os.path.join(self.tempdir, 'other'), 'w') as file_handle:
+            file_handle.write('test=value\n')
+        self.assertEqual(confset.confset.scan_directory(self.tempdir), frozenset([self.config_file, 'other']))
+
+    def test_parallel_loading(self):
+        for index in range(10):
+            with open(os.path.join(self.tempdir, 'testconf%d' % index), 'w') as file_handle:
+                file_handle.write('# Help %d\ntest=%d\n' % (index, index))
+        self.assertEqual(list(confset.iter_settings(jobs=4)), list(confset.iter_settings()))
+        self.assertEqual(confset.settings(jobs=4), confset.settings())
+
+        sequential = io.StringIO()
+        with contextlib.redirect_stdout(sequential):
+            confset.print_settings(info=True)
+        parallel = io.StringIO()
+        with contextlib.redirect_stdout(parallel):
+            confset.print_settings(info=True, jobs=4)
+        self.assertEqual(parallel.getvalue(), sequential.getvalue())
+
+    def test_column_width_tracked(self):
+        with open(self.config_file_full, 'w') as file_handle:
+            file_handle.write('short=1\nlonger_setting=value\n')
+        config = confset.ConfigSettings(self.config_file)
+        expected = len('%s.longer_setting=value' % self.config_file)
+        self.assertEqual(config.key_max_column_width(), expected)
+        with mock.patch.object(confset.confset, '_column_width') as mock_width:
+            config.set('short', 'a_much_longer_value')
+            self.assertEqual(config.key_max_column_width(), len('%s.short=a_much_longer_value' % self.config_file))
+            self.assertFalse(mock_width.called)
+        config.set('short', '1')
+        self.assertEqual(config.key_max_column_width(), expected)
+
+    def test_print_settings_stream(self):
+        for index in range(3):
+            with open(os.path.join(self.tempdir, 'testconf%d' % index), 'w') as file_handle:
+                file_handle.write('# Help %d\n# More help\ntest%s=%d\n' % (index, 'x' * index, index))
+        aligned = io.StringIO()
+        streamed = io.StringIO()
+        with mock.patch.object(confset.confset, 'config_files', return_value=['testconf0', 'testconf1', 'testconf2']):
+            confset.print_settings(info=True, stream=aligned)
+            confset.print_settings(info=True, stream=streamed, align=False)
+        self.assertEqual(
+            aligned.getvalue(),
+            'testconf0.test=0   - Help 0\n                     More help\n'
+            'testconf1.testx=1  - Help 1\n                     More help\n'
+            'testconf2.testxx=2 - Help 2\n                     More help\n'
+        )
+        self.assertEqual(
+            streamed.getvalue(),
+            'testconf0.test=0 - Help 0\n   More help\n'
+            'testconf1.testx=1 - Help 1\n   More help\n'
+            'testconf2.testxx=2 - Help 2\n   More help\n'
+        )
+
+    def test_setting_filter(self):
+        setting_filter = confset.SettingFilter('ntp*.NTP*')
+        self.assertTrue(setting_filter.match_namespace('ntpdate'))
+        self.assertFalse(setting_filter.match_namespace('rsyslog'))
+        self.assertTrue(setting_filter.match('ntpdate.NTPSERVERS'))
+        self.assertFalse(setting_filter.match('ntpdate.UPDATE_HWCLOCK'))
+        self.assertTrue(confset.SettingFilter('ntp').match('ntp.NTPSERVERS'))
+        self.assertEqual(confset.SettingFilter('ntp.NTPSERVERS').exact, 'ntp.NTPSERVERS')
+        self.assertIsNone(confset.SettingFilter('*.OPTIONS').exact)
+
+        setting_filter = confset.SettingFilter(r'ntp.*\.NTP.*', regex=True)
+        self.assertTrue(setting_filter.match_namespace('ntpdate'))
+        self.assertFalse(setting_filter.match_namespace('rsyslog'))
+        self.assertTrue(setting_filter.match('ntpdate.NTPSERVERS'))
+        self.assertFalse(setting_filter.match('ntpdate.UPDATE_HWCLOCK'))
+        for pattern in [r'ntp\.A|rsyslog\.B', r'(ntp\.A)', r'ntp\.?A', r'[\.]A', r'.*OPTIONS']:
+            self.assertTrue(confset.SettingFilter(pattern, regex=True).match_namespace('rsyslog'), pattern)
+
+    def test_filter_prunes_files(self):
+        for name in ['ntp', 'ntpdate', 'rsyslog']:
+            with open(os.path.join(self.tempdir, name), 'w') as file_handle:
+                file_handle.write('NTPSERVERS=%s\nOPTIONS=-x\n' % name)
+        parse_settings = confset.ConfigSettings.parse_settings
+        with mock.patch.object(confset.confset, 'config_files', return_value=['ntp', 'ntpdate', 'rsyslog']):
+            with mock.patch.object(
+                confset.ConfigSettings, 'parse_settings', autospec=True, side_effect=parse_settings
+            ) as mock_parse:
+                output = io.StringIO()
+                confset.print_settings('ntp*.NTP*', stream=output)
+                self.assertEqual(output.getvalue(), 'ntp.NTPSERVERS=ntp\nntpdate.NTPSERVERS=ntpdate\n')
+                self.assertEqual(sorted(call[0][0].conffile for call in mock_parse.call_args_list), ['ntp', 'ntpdate'])
+            self.assertEqual(
+                list(confset.iter_settings(setting_filter='*.OPTIONS')),
+                [
+                    confset.SettingRecord('ntp', 'OPTIONS', '-x', []),
+                    confset.SettingRecord('ntpdate', 'OPTIONS', '-x', []),
+                    confset.SettingRecord('rsyslog', 'OPTIONS', '-x', [])
+                ]
+            )
+            self.assertEqual(list(confset.settings(setting_filter=r'rsys.*\.OPT.*', regex=True)), ['rsyslog.OPTIONS'])
+
+    def test_set_same_value_does_not_write(self):
+        config = confset.ConfigSettings(self.config_file)
+        config.set('test', 'value', help_text='Helpful comment')
+        with mock.patch.object(confset.confset, 'atomic_write') as mock_write:
+            config.set('test', 'value')
+            config.set('test', 'value', help_text='Helpful comment')
+            self.assertFalse(mock_write.called)
+            config.set('test', 'value', help_text='Other comment')
+            self.assertTrue(mock_write.called)
+
+    def test_diff_converge(self):
+        with open(self.config_file_full, 'w') as file_handle:
+            file_handle.write('first=1\nsecond=2\n')
+        config = confset.ConfigSettings(self.config_file, backup=False)
+        desired = {'first': '1', 'second': '20', 'third': '3'}
+        self.assertEqual(config.diff(desired), {'second': ('2', '20'), 'third': (None, '3')})
+        self.assertEqual(config.converge(desired, check=True), {'second': ('2', '20'), 'third': (None, '3')})
+        self.assertEqual(confset.ConfigSettings(self.config_file).settings['%s.second' % self.config_file].value, '2')
+        self.assertEqual(config.converge(desired), {'second': ('2', '20'), 'third': (None, '3')})
+        with mock.patch.object(confset.confset, 'atomic_write') as mock_write:
+            self.assertEqual(config.converge(desired), {})
+            self.assertFalse(mock_write.called)
+
+    def test_parallel_loading_skips_unreadable(self):
+        for index in range(3):
+            with open(os.path.join(self.tempdir, 'testconf%d' % index), 'w') as file_handle:
+                file_handle.write('test=%d\n' % index)
+        parse_settings = confset.ConfigSettings.parse_settings
+
+        def failing_parse(config):
+            if config.conffile == 'testconf1':
+                raise IOError('Permission denied')
+            return parse_settings(config)
+
+        with mock.patch.object(confset.ConfigSettings, 'parse_settings', autospec=True, side_effect=failing_parse):
+            result = confset.settings(jobs=2)
+        self.assertIn('testconf0.test', result)
+        self.assertNotIn('testconf1.test', result)
+        self.assertIn('testconf2.test', result)
+
+    def test_setting_records(self):
+        for name in ('testconf', 'testconf2'):
+            with open(os.path.join(self.tempdir, name), 'w') as file_handle:
+                file_handle.write('# Shared help\n# second line\ntest=value\n')
+        first = confset.ConfigSettings('testconf', use_cache=False).settings['testconf.test']
+        second = confset.ConfigSettings('testconf2', use_cache=False).settings['testconf2.test']
+        self.assertIsInstance(first, confset.Setting)
+        self.assertFalse(hasattr(first, '__dict__'))
+        self.assertIs(first.help, second.help)
+        self.assertEqual(first['value'], 'value')
+        self.assertEqual(first.get('help'), ['Shared help', 'second line'])
+        self.assertEqual(dict(first), {'help': ['Shared help', 'second line'], 'value': 'value'})
+        self.assertEqual(first, second)
+        config = confset.ConfigSettings('testconf')
+        self.assertNotIn('testconf.test', vars(config))
+
+    def test_setting_changed_as_dict(self):
+        with open(self.config_file_full, 'w') as file_handle:
+            file_handle.write('#!/bin/sh\n\n# Help\ntest=value\nother=1\n')
+        config = confset.ConfigSettings(self.config_file, backup=False)
+        config.settings['testconf.test']['value'] = 'valuenew'
+        config.settings['testconf.test']['help'] = ['New help']
+        config.settings['testconf.added'] = {'value': 'added', 'help': ['Added help']}
+        config.order.append('testconf.added')
+        config.write_settings()
+        with open(self.config_file_full) as file_handle:
+            self.assertEqual(
+                file_handle.read(), '#!/bin/sh\n\n# New help\ntest=valuenew\nother=1\n\n\n# Added help\nadded=added\n'
+            )
+        config = confset.ConfigSettings(self.config_file, use_cache=False)
+        self.assertEqual(config.settings['testconf.test'].unquoted, 'valuenew')
+        self.assertEqual(config.settings['testconf.added'], {'value': 'added', 'help': ['Added help']})
+        with self.assertRaises(KeyError):
+            config.settings['testconf.test']['missing'] = 'value'
+
+    def test_setting_changed_as_dict_in_batch(self):
+        config = confset.ConfigSettings(self.config_file, backup=False)
+        config.set('test', 'value', help_text='Helpful comment')
+        with self.assertRaises(ValueError):
+            with config.batch():
+                config.settings['testconf.test']['value'] = 'changed'
+                config.settings['testconf.test']['help'] = ['Changed help']
+                raise ValueError()
+        self.assertEqual(config.settings['testconf.test'], {'value': 'value', 'help': ['Helpful comment']})
+        with config.batch():
+            config.settings['testconf.test']['value'] = 'valuenew'
+        config = confset.ConfigSettings(self.config_file, use_cache=False)
+        self.assertEqual(config.settings['testconf.test'], {'value': 'valuenew', 'help': ['Helpful comment']})
+
     def test_confset_config_paths_no_growth(self):
         inital_paths = confset.confset.config_paths()
         second_paths = confset.confset.config_paths()
         self.assertEqual(len(inital_paths), len(second_paths))
 
+    def test_config_paths_virtualenv(self):
+        venv = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(venv, 'conf'))
+            with mock.patch.dict(os.environ, {'VIRTUAL_ENV': venv}):
+                paths = confset.config_paths()
+                self.assertEqual(paths[0], os.path.join(venv, 'conf'))
+                paths.append('/modified')
+                with mock.patch.object(confset.confset.os.path, 'exists') as mock_exists:
+                    self.assertEqual(confset.config_paths(), paths[:-1])
+                    self.assertFalse(mock_exists.called)
+            self.assertNotIn(os.path.join(venv, 'conf'), confset.config_paths())
+        finally:
+            shutil.rmtree(venv)
+
+    def test_overlay(self):
+        upper = tempfile.mkdtemp()
+        confset.CONF_PATH.insert(0, upper)
+        try:
+            confset.ConfigSettings(self.config_file, confpath=[self.tempdir]).set_many(
+                collections.OrderedDict([('shared', 'lower'), ('only_lower', '1')])
+            )
+            confset.ConfigSettings(self.config_file, confpath=[upper]).set_many(
+                collections.OrderedDict([('only_upper', '2'), ('shared', 'upper')])
+            )
+            self.assertEqual(confset.config_files().count(self.config_file), 1)
+            self.assertEqual(
+                confset.config_layout()[self.config_file],
+                (os.path.join(upper, self.config_file), self.config_file_full)
+            )
+            self.assertIs(confset.config_layout(), confset.config_layout())
+            self.assertEqual(confset.ConfigSettings(self.config_file).filename, os.path.join(upper, self.config_file))
+
+            overlay = confset.Overlay()
+            self.assertEqual(list(overlay.resolve(self.config_file)), ['testconf.only_upper', 'testconf.shared'])
+            self.assertEqual(overlay['testconf.shared'].value, 'upper')
+            self.assertNotIn('testconf.only_lower', overlay)
+
+            overlay = confset.Overlay(layered=True)
+            self.assertEqual(
+                [(long_key, resolved.setting.value, resolved.layer) for long_key, resolved in overlay.resolve(self.config_file).items()],
+                [
+                    ('testconf.only_upper', '2', upper), ('testconf.shared', 'upper', upper),
+                    ('testconf.only_lower', '1', self.tempdir)
+                ]
+            )
+            self.assertEqual(overlay.layer('testconf.only_lower'), self.tempdir)
+            self.assertIn('testconf.only_lower', list(overlay))
+
+            overlay = confset.Overlay(paths=[self.tempdir, upper], layered=True)
+            self.assertEqual(overlay['testconf.shared'].value, 'lower')
+            self.assertEqual(overlay.layer('testconf.only_upper'), upper)
+            with self.assertRaises(KeyError):
+                overlay.layer('testconf.missing')
+        finally:
+            confset.CONF_PATH.remove(upper)
+            shutil.rmtree(upper)
+
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
@@ -0,0 +1,159 @@
+# Copyright (c) 2015, Dwight Hubbard
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Tests for the `confset.manifest` module.
+"""
+import confset
+import confset.manifest
+import contextlib
+import io
+import os
+from base import ConfsetTestCase
+from confset.arguments import ConfsetArguments, create_arg_parser
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+# noinspection PyPep8Naming
+class TestManifest(ConfsetTestCase):
+    def setUp(self):
+        super().setUp()
+        for name in ['testmanifest0', 'testmanifest1']:
+            with open(os.path.join(self.tempdir, name), 'w') as file_handle:
+                file_handle.write('# Help\nfirst=1\nsecond=2\n')
+
+    def read(self, name):
+        with open(os.path.join(self.tempdir, name)) as file_handle:
+            return file_handle.read()
+
+    def test_parse_manifest(self):
+        expected = {'testmanifest0': {'first': 'a=b', 'third': '3'}, 'testmanifest1': {'second': 'true'}}
+        self.assertEqual(
+            confset.manifest.parse_manifest(
+                '# Comment\ntestmanifest0.first = a=b\n\ntestmanifest0.third=3\ntestmanifest1.second=true\n'
+            ),
+            expected
+        )
+        self.assertEqual(
+            confset.manifest.parse_manifest(
+                '{"testmanifest0.first": "a=b", "testmanifest0": {"third": 3}, "testmanifest1.second": true}'
+            ),
+            expected
+        )
+        self.assertEqual(
+            confset.manifest.parse_manifest(
+                '[{"namespace": "testmanifest0", "key": "first", "value": "a=b", "help": []},'
+                ' {"namespace": "testmanifest0", "key": "third", "value": "3"},'
+                ' {"namespace": "testmanifest1", "key": "second", "value": "true"}]'
+            ),
+            expected
+        )
+        for text in [
+            'testmanifest0', 'first=1', '{"testmanifest0.first": [1]}', '[1]', '/tmp/x/victim.KEY=1',
+            'testmanifest0.MY KEY=2', 'testmanifest*.first=1', '{"testmanifest0": {"my-key": 1}}',
+            'testmanifest0.first=a;b', '{"testmanifest0.first": "foo # bar"}'
+        ]:
+            with self.assertRaises(confset.ConfsetException):
+                confset.manifest.parse_manifest(text)
+
+    def test_parse_manifest_yaml(self):
+        try:
+            import yaml  # noqa
+        except ImportError:
+            with self.assertRaises(confset.ConfsetException):
+                confset.manifest.parse_manifest('testmanifest0.first: 1', manifest_format='yaml')
+            return
+        self.assertEqual(
+            confset.manifest.parse_manifest('testmanifest0:\n  first: 1\n', manifest_format='yaml'),
+            {'testmanifest0': {'first': '1'}}
+        )
+
+    def test_apply_manifest(self):
+        changes = confset.manifest.parse_manifest(
+            'testmanifest0.first=10\ntestmanifest0.third=30\ntestmanifest1.first=1\n'
+        )
+        with mock.patch.object(confset.confset, 'atomic_write', side_effect=confset.confset.atomic_write) as write:
+            results = confset.manifest.apply_manifest(changes, jobs=2, backup=False)
+        self.assertEqual(write.call_count, 1)
+        self.assertEqual(
+            results,
+            [
+                confset.manifest.ManifestResult(
+                    'testmanifest0', os.path.join(self.tempdir, 'testmanifest0'), 2, None,
+                    {'first': ('1', '10'), 'third': (None, '30')}
+                ),
+                confset.manifest.ManifestResult(
+                    'testmanifest1', os.path.join(self.tempdir, 'testmanifest1'), 0, None, {}
+                )
+            ]
+        )
+        self.assertEqual(self.read('testmanifest0'), '# Help\nfirst=10\nsecond=2\n\nthird=30\n')
+        self.assertEqual(self.read('testmanifest1'), '# Help\nfirst=1\nsecond=2\n')
+
+    def test_converged_files_are_skipped(self):
+        changes = {'testmanifest0': {'first': '10'}, 'testmanifest1': {'first': '1'}}
+        results = confset.manifest.apply_manifest(changes, backup=False, check=True)
+        self.assertEqual([result.changes for result in results], [{'first': ('1', '10')}, {}])
+        self.assertEqual(self.read('testmanifest0'), '# Help\nfirst=1\nsecond=2\n')
+
+        confset.manifest.apply_manifest(changes, backup=False)
+        with mock.patch.object(confset.ConfigSettings, 'parse_settings') as mock_parse:
+            with mock.patch.object(confset.confset, 'atomic_write') as mock_write:
+                results = confset.manifest.apply_manifest(changes, backup=False)
+        self.assertFalse(mock_parse.called)
+        self.assertFalse(mock_write.called)
+        self.assertEqual([result.changed for result in results], [0, 0])
+
+        # Touching the file changes its identity but not its contents
+        os.utime(os.path.join(self.tempdir, 'testmanifest0'), (0, 0))
+        with mock.patch.object(confset.ConfigSettings, 'parse_settings') as mock_parse:
+            confset.manifest.apply_manifest(changes, backup=False)
+        self.assertFalse(mock_parse.called)
+
+        with open(os.path.join(self.tempdir, 'testmanifest0'), 'w') as file_handle:
+            file_handle.write('first=drifted\n')
+        results = confset.manifest.apply_manifest(changes, backup=False, check=True)
+        self.assertEqual(results[0].changes, {'first': ('drifted', '10')})
+
+    def test_check_option(self):
+        (options, args) = create_arg_parser().parse_args(['--check', 'testmanifest0.first=10'])
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.assertEqual(ConfsetArguments(args, options).execute(), 1)
+        self.assertEqual(
+            output.getvalue(),
+            'testmanifest0: 1 to change (%s)\n    testmanifest0.first: 1 -> 10\n' % (
+                os.path.join(self.tempdir, 'testmanifest0')
+            )
+        )
+        (options, args) = create_arg_parser().parse_args(['--converge', '--no-backup', 'testmanifest0.first=10'])
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(ConfsetArguments(args, options).execute(), 0)
+        (options, args) = create_arg_parser().parse_args(['--check', 'testmanifest0.first=10'])
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(ConfsetArguments(args, options).execute(), 0)
+        self.assertEqual(sorted(name for name in os.listdir(self.tempdir) if not name.startswith('.')), ['testmanifest0', 'testmanifest1'])
+
+    def test_apply_option(self):
+        manifest = os.path.join(self.cache_dir, 'manifest.json')
+        with open(manifest, 'w') as file_handle:
+            file_handle.write('{"testmanifest0": {"first": "10"}, "testmanifest1": {"second": "20"}}')
+        (options, args) = create_arg_parser().parse_args(['--no-backup', '--apply', manifest])
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.assertEqual(ConfsetArguments(args, options).execute(), 0)
+        self.assertEqual(
+            output.getvalue(),
+            'testmanifest0: 1 changed (%s)\ntestmanifest1: 1 changed (%s)\n' % (
+                os.path.join(self.tempdir, 'testmanifest0'), os.path.join(self.tempdir, 'testmanifest1')
+            )
+        )
+        self.assertEqual(sorted(name for name in os.listdir(self.tempdir) if not name.startswith('.')), ['testmanifest0', 'testmanifest1'])
+
+        with open(manifest, 'w') as file_handle:
+            file_handle.write('not a manifest')
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertEqual(ConfsetArguments(args, options).execute(), 1)
@@ -0,0 +1,70 @@
+# Copyright (c) 2015, Dwight Hubbard
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Tests for the `confset.serializers` module.
+"""
+import confset
+import io
+import json
+import os
+from base import ConfsetTestCase
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+# noinspection PyPep8Naming
+class TestSerializers(ConfsetTestCase):
+    def setUp(self):
+        super().setUp()
+        for index in range(3):
+            with open(os.path.join(self.tempdir, 'testjson%d' % index), 'w') as file_handle:
+                file_handle.write('# Help %d\n# More help\ntest=a=%d\nempty=\n' % (index, index))
+        self.config_files = mock.patch.object(
+            confset.confset, 'config_files', return_value=['testjson0', 'testjson1', 'testjson2']
+        )
+        self.config_files.start()
+
+    def tearDown(self):
+        self.config_files.stop()
+        super().tearDown()
+
+    def expected(self, index):
+        return [
+            {
+                'namespace': 'testjson%d' % index, 'key': 'test', 'value': 'a=%d' % index,
+                'help': ['Help %d' % index, 'More help'], 'path': os.path.join(self.tempdir, 'testjson%d' % index)
+            },
+            {
+                'namespace': 'testjson%d' % index, 'key': 'empty', 'value': '', 'help': [],
+                'path': os.path.join(self.tempdir, 'testjson%d' % index)
+            }
+        ]
+
+    def test_write_ndjson(self):
+        output = io.StringIO()
+        confset.write_ndjson(stream=output)
+        lines = output.getvalue().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], self.expected(0) + self.expected(1) + self.expected(2))
+
+    def test_write_json(self):
+        output = io.StringIO()
+        confset.write_json(stream=output, jobs=2)
+        self.assertEqual(json.loads(output.getvalue()), self.expected(0) + self.expected(1) + self.expected(2))
+
+        output = io.StringIO()
+        confset.write_json(stream=output, setting_filter='nothing.*')
+        self.assertEqual(json.loads(output.getvalue()), [])
+
+    def test_filter(self):
+        output = io.StringIO()
+        confset.write_ndjson(stream=output, setting_filter='testjson1')
+        self.assertEqual([json.loads(line) for line in output.getvalue().splitlines()], self.expected(1))
+
+    def test_ndjson_streams_each_file(self):
+        output = mock.Mock()
+        confset.write_ndjson(stream=output)
+        self.assertEqual(output.write.call_count, 3)
+        self.assertEqual(output.flush.call_count, 3)
@@ -0,0 +1,123 @@
+# Copyright (c) 2015, Dwight Hubbard
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Tests for the `confset.server` and `confset.client` modules.
+"""
+import confset
+import confset.client
+import confset.server
+import contextlib
+import io
+import os
+import threading
+from base import ConfsetTestCase
+from confset.arguments import ConfsetArguments, create_arg_parser
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+# noinspection PyPep8Naming
+class TestServer(ConfsetTestCase):
+    def setUp(self):
+        super().setUp()
+        for index in range(2):
+            with open(os.path.join(self.tempdir, 'testserver%d' % index), 'w') as file_handle:
+                file_handle.write('# Help %d\nfirst=%d\nsecond=a=%d\n' % (index, index, index))
+        self.socket_path = os.path.join(self.cache_dir, 'confset.sock')
+        self.environ = mock.patch.dict(os.environ, {'CONFSET_SOCKET': self.socket_path})
+        self.environ.start()
+        self.server = confset.server.SettingsServer(use_inotify=False)
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.01})
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        self.environ.stop()
+        super().tearDown()
+
+    def test_socket_permissions(self):
+        self.assertEqual(os.stat(self.socket_path).st_mode & 0o777, 0o600)
+        with self.assertRaises(confset.ConfsetException):
+            confset.server.SettingsServer(use_inotify=False)
+
+    def test_requests(self):
+        self.assertEqual(
+            confset.client.request({'op': 'get', 'key': 'testserver1.second'}),
+            {'ok': True, 'setting': {'value': 'a=1', 'help': []}}
+        )
+        self.assertEqual(confset.client.request({'op': 'get', 'key': 'testserver1.missing'}), {'ok': True, 'setting': None})
+        self.assertEqual(
+            confset.client.request({'op': 'list', 'filter': 'testserver*.first'})['settings'],
+            [
+                {
+                    'namespace': 'testserver%d' % index, 'key': 'first', 'value': str(index),
+                    'help': ['Help %d' % index], 'path': os.path.join(self.tempdir, 'testserver%d' % index)
+                }
+                for index in range(2)
+            ]
+        )
+        self.assertEqual(
+            confset.client.request({'op': 'set', 'namespace': 'testserver0', 'key': 'first', 'value': '10', 'backup': False}),
+            {'ok': True}
+        )
+        self.assertEqual(confset.ConfigSettings('testserver0').settings['testserver0.first'].value, '10')
+        self.assertEqual(
+            confset.client.request({'op': 'get', 'key': 'testserver0.first'})['setting']['value'], '10'
+        )
+        self.assertFalse(confset.client.request({'op': 'unknown'})['ok'])
+
+    def test_requests_validated(self):
+        paths = confset.config_paths()
+        self.assertTrue(confset.client.request({'op': 'get', 'key': 'testserver1.first', 'paths': paths})['ok'])
+        self.assertFalse(confset.client.request({'op': 'get', 'key': 'testserver1.first', 'paths': paths[1:]})['ok'])
+        victim = os.path.join(self.tempdir, 'victim')
+        for namespace, key in [(victim, 'first'), ('testserver0', 'MY KEY'), ('testserver0', 'my-key')]:
+            self.assertFalse(
+                confset.client.request({'op': 'set', 'namespace': namespace, 'key': key, 'value': '1', 'backup': False})['ok']
+            )
+        self.assertFalse(os.path.exists(victim))
+        with open(os.path.join(self.tempdir, 'testserver0')) as file_handle:
+            self.assertEqual(file_handle.read(), '# Help 0\nfirst=0\nsecond=a=0\n')
+
+    def test_cli_not_forwarded_with_other_paths(self):
+        (options, args) = create_arg_parser().parse_args(['testserver1.first'])
+        with mock.patch.object(confset, 'config_paths', return_value=[self.tempdir, self.cache_dir]):
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertFalse(ConfsetArguments(args, options).forward())
+
+    def test_changes_are_seen(self):
+        with open(os.path.join(self.tempdir, 'testserver1'), 'w') as file_handle:
+            file_handle.write('first=changed\n')
+        self.assertEqual(confset.client.request({'op': 'get', 'key': 'testserver1.first'})['setting']['value'], 'changed')
+        self.assertIsNone(confset.client.request({'op': 'get', 'key': 'testserver1.second'})['setting'])
+
+    def test_cli_forwarding(self):
+        for command in [['testserver0', '--info'], ['testserver*.second'], ['testserver1.first']]:
+            (options, args) = create_arg_parser().parse_args(command)
+            with mock.patch.object(confset.client, 'request', side_effect=lambda message: None):
+                direct = io.StringIO()
+                with contextlib.redirect_stdout(direct):
+                    with mock.patch.object(confset.confset, 'config_files', return_value=['testserver0', 'testserver1']):
+                        ConfsetArguments(args, options).execute()
+            forwarded = io.StringIO()
+            with contextlib.redirect_stdout(forwarded):
+                with mock.patch.object(confset.ConfigSettings, 'parse_settings') as mock_parse:
+                    with mock.patch.object(confset.confset, 'config_files', return_value=['testserver0', 'testserver1']):
+                        ConfsetArguments(args, options).execute()
+            self.assertFalse(mock_parse.called)
+            self.assertEqual(forwarded.getvalue(), direct.getvalue())
+            self.assertTrue(direct.getvalue())
+
+        (options, args) = create_arg_parser().parse_args(['--no-backup', 'testserver1.first=5'])
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            ConfsetArguments(args, options).execute()
+        self.assertEqual(output.getvalue(), 'testserver1.first=5\n')
+        self.assertEqual(sorted(name for name in os.listdir(self.tempdir) if not name.startswith('.')), ['testserver0', 'testserver1'])
+
+    def test_no_daemon(self):
+        self.assertIsNone(confset.client.request({'op': 'get', 'key': 'x'}, path=os.path.join(self.tempdir, 'missing')))
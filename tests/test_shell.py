@@ -0,0 +1,91 @@
+# Copyright (c) 2015, Dwight Hubbard
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Tests for the `confset.shell` module.
+"""
+import confset
+import confset.shell
+import os
+import unittest
+from base import ConfsetTestCase
+
+
+SAMPLE = b'''# Options for the daemon
+export OPTIONS="-c5 -x"  # inline comment
+MESSAGE='single '"and double"\\ quoted
+PATHS="/usr/lib \\
+/usr/local/lib"
+COUNT=1; export COUNT
+SPACED = some value
+[ -f /etc/other ] && IGNORED=1
+LITERAL=#hash
+EMPTY= # only a comment
+ESCAPED="a \\"b\\" \\$HOME \\n"
+JOINED=first\\
+second
+UNCLOSED=it's
+LAST=end'''
+
+
+# noinspection PyPep8Naming
+class TestShell(ConfsetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.config_file = 'testshell'
+        self.config_file_full = os.path.join(self.tempdir, self.config_file)
+
+    def test_parse_assignments(self):
+        parsed = confset.confset.parse_config(SAMPLE, 'testshell')
+        values = [
+            (long_key, parsed['settings'][long_key].value, parsed['settings'][long_key].unquoted)
+            for long_key in parsed['order']
+        ]
+        self.assertEqual(values, [
+            ('testshell.OPTIONS', '"-c5 -x"', '-c5 -x'),
+            ('testshell.MESSAGE', '\'single \'"and double"\\ quoted', 'single and double quoted'),
+            ('testshell.PATHS', '"/usr/lib \\\n/usr/local/lib"', '/usr/lib /usr/local/lib'),
+            ('testshell.COUNT', '1', '1'),
+            ('testshell.SPACED', 'some value', 'some value'),
+            ('testshell.LITERAL', '#hash', '#hash'),
+            ('testshell.EMPTY', '', ''),
+            ('testshell.ESCAPED', '"a \\"b\\" \\$HOME \\n"', 'a "b" $HOME \\n'),
+            ('testshell.JOINED', 'first\\\nsecond', 'firstsecond'),
+            ('testshell.UNCLOSED', "it's", "it's"),
+            ('testshell.LAST', 'end', 'end'),
+        ])
+        self.assertEqual(parsed['settings']['testshell.OPTIONS'].help, ('Options for the daemon',))
+        for long_key, (help_start, line_start, value_start, value_end) in parsed['spans'].items():
+            self.assertEqual(SAMPLE[value_start:value_end].decode('utf-8'), parsed['settings'][long_key].value)
+
+    def test_simple_and_scanned_values_agree(self):
+        for line in (b'KEY=value', b'KEY="value" # comment', b"KEY='value'\n", b'KEY= # comment', b'KEY=a#b  '):
+            tokenizer = confset.shell.Tokenizer(line)
+            match = confset.shell.ASSIGNMENT_RE.match(line)
+            value_end, stop, unquoted = tokenizer.scan_value(match.end())
+            self.assertEqual(tokenizer.assignment(0)[1:3], (match.end(), value_end))
+            self.assertEqual(tokenizer.assignment(0)[4], unquoted)
+
+    def test_unquote(self):
+        self.assertEqual(confset.shell.unquote('plain'), 'plain')
+        self.assertEqual(confset.shell.unquote('"-c5 -x"'), '-c5 -x')
+        self.assertEqual(confset.shell.unquote("'a'\\ b"), 'a b')
+        self.assertEqual(confset.Setting('"quoted"').unquoted, 'quoted')
+
+    def test_set_keeps_inline_comment(self):
+        with open(self.config_file_full, 'wb') as file_handle:
+            file_handle.write(SAMPLE)
+        config = confset.ConfigSettings(self.config_file, backup=False)
+        config.set('OPTIONS', '"-c6"')
+        config.set('PATHS', '/opt/lib')
+        with open(self.config_file_full, 'rb') as file_handle:
+            data = file_handle.read()
+        self.assertIn(b'export OPTIONS="-c6"  # inline comment\n', data)
+        self.assertIn(b'PATHS=/opt/lib\nCOUNT=1; export COUNT\n', data)
+        config = confset.ConfigSettings(self.config_file, use_cache=False)
+        self.assertEqual(config.settings['testshell.OPTIONS'].unquoted, '-c6')
+        self.assertEqual(config.settings['testshell.LAST'].value, 'end')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+# Copyright (c) 2015, Dwight Hubbard
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Tests for the import cost of the `confset` command line tool.
+"""
+import os
+import subprocess
+import sys
+import unittest
+
+
+# Cumulative import time of confset.cli in milliseconds, the default is loose
+# enough for slow CI machines and can be tightened with CONFSET_IMPORT_BUDGET_MS
+IMPORT_BUDGET_MS = int(os.environ.get('CONFSET_IMPORT_BUDGET_MS', '150'))
+DEFERRED_MODULES = ['asyncio', 'json', 'concurrent.futures', 'tempfile', 'hashlib']
+
+
+def run_python(code, *options):
+    command = [sys.executable] + list(options) + ['-c', code]
+    return subprocess.run(
+        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+
+
+# noinspection PyPep8Naming
+class TestStartup(unittest.TestCase):
+    def test_cli_import_defers_modules(self):
+        result = run_python(
+            'import sys, confset.cli\n'
+            'print(",".join(name for name in %r if name in sys.modules))' % DEFERRED_MODULES
+        )
+        self.assertEqual(result.stdout.strip(), '')
+
+    def test_lazy_attributes(self):
+        result = run_python(
+            'import confset\n'
+            'print(confset.__version__ == str(confset._metadata().get("version", "0.0.0")))\n'
+            'print(confset.aload.__module__)'
+        )
+        self.assertEqual(result.stdout.split(), ['True', 'confset.aio'])
+
+    @unittest.skipIf(sys.version_info < (3, 7), '-X importtime needs Python 3.7')
+    def test_cli_import_budget(self):
+        result = run_python('import confset.cli', '-X', 'importtime')
+        cumulative = None
+        for line in result.stderr.splitlines():
+            fields = line.split('|')
+            if len(fields) == 3 and fields[2].strip() == 'confset.cli':
+                cumulative = int(fields[1]) / 1000.0
+        self.assertIsNotNone(cumulative)
+        self.assertLess(cumulative, IMPORT_BUDGET_MS)
@@ -0,0 +1,93 @@
+# Copyright (c) 2015, Dwight Hubbard
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Tests for the `confset.stats` module.
+"""
+import confset
+import confset.cli
+import confset.stats
+import contextlib
+import io
+import json
+import logging
+import os
+import unittest
+from base import ConfsetTestCase
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+# noinspection PyPep8Naming
+class TestStats(ConfsetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.config_file = 'teststats'
+        self.config_file_full = os.path.join(self.tempdir, self.config_file)
+        with open(self.config_file_full, 'w') as file_handle:
+            file_handle.write('# Helpful comment\ntest=value\n')
+
+    def test_collect_counters(self):
+        with confset.stats.collect() as collected:
+            config = confset.ConfigSettings(self.config_file, use_cache=False)
+            config.set('test', 'newvalue')
+        counters = collected.as_dict()['counters']
+        self.assertEqual(counters['files_parsed'], 1)
+        self.assertEqual(counters['bytes_read'], 29)
+        self.assertEqual(counters['backups_created'], 1)
+        self.assertEqual(counters['bytes_written'], 32)
+        self.assertGreaterEqual(counters['fsyncs'], 1)
+        self.assertGreater(collected.timings['write'], 0)
+        self.assertGreater(collected.timings['parse'], 0)
+
+    def test_collect_indexed_read(self):
+        confset.ConfigSettings(self.config_file).load()
+        with confset.stats.collect() as collected:
+            setting = confset.ConfigSettings(self.config_file).get_setting('test')
+        self.assertEqual(setting.value, 'value')
+        counters = collected.as_dict()['counters']
+        self.assertEqual(counters['files_parsed'], 1)
+        # Only the help and value of the setting are read, not the newline ending the file
+        self.assertEqual(counters['bytes_read'], 28)
+        self.assertGreater(collected.timings['parse'], 0)
+
+    def test_not_collecting(self):
+        confset.stats.count('files_parsed')
+        with confset.stats.timer('parse'):
+            pass
+        self.assertIsNone(confset.stats._current)
+
+    def test_nested_timers_are_exclusive(self):
+        with confset.stats.collect() as collected:
+            with mock.patch.object(confset.stats.time, 'perf_counter', side_effect=[0.0, 1.0, 3.0, 6.0]):
+                with confset.stats.timer('render'):
+                    with confset.stats.timer('parse'):
+                        pass
+        self.assertEqual(collected.timings['render'], 4.0)
+        self.assertEqual(collected.timings['parse'], 2.0)
+
+    def test_subscribe(self):
+        received = []
+        callback = confset.stats.subscribe(received.append)
+        try:
+            with confset.stats.collect() as collected:
+                confset.ConfigSettings(self.config_file).load()
+        finally:
+            confset.stats.unsubscribe(callback)
+        self.assertEqual(received, [collected])
+
+    def test_cli_stats_json(self):
+        stderr = io.StringIO()
+        with mock.patch('sys.argv', ['confset', '--stats', '--stats-format', 'json', 'teststats.test']):
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(stderr):
+                self.assertEqual(confset.cli.main(), 0)
+        data = json.loads(stderr.getvalue())
+        self.assertEqual(sorted(data['timings']), sorted(confset.stats.PHASES))
+        self.assertEqual(data['counters']['files_parsed'], 1)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.DEBUG)
+    unittest.main()
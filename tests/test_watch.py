@@ -0,0 +1,78 @@
+# Copyright (c) 2015, Dwight Hubbard
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Tests for the `confset.watch` module.
+"""
+import confset
+import confset.watch
+import os
+from base import ConfsetTestCase
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+# noinspection PyPep8Naming
+class TestWatch(ConfsetTestCase):
+    def setUp(self):
+        super().setUp()
+        for index in range(3):
+            self.write('testwatch%d' % index, 'first=%d\nsecond=%d\n' % (index, index))
+        self.diffs = []
+
+    def write(self, name, data):
+        with open(os.path.join(self.tempdir, name), 'w') as file_handle:
+            file_handle.write(data)
+
+    def check_changes(self, watcher, wait):
+        self.assertEqual(watcher.settings['testwatch1.first'].value, '1')
+        self.write('testwatch1', '# Help\nfirst=10\nthird=3\n')
+        os.remove(os.path.join(self.tempdir, 'testwatch2'))
+        self.write('testwatch3', 'first=3\n')
+        with mock.patch.object(confset.watch, 'load_config', side_effect=confset.watch.load_config) as mock_load:
+            diff = wait()
+        self.assertEqual(sorted(call[0][0] for call in mock_load.call_args_list), ['testwatch1', 'testwatch3'])
+        self.assertEqual(
+            diff.added, {'testwatch1.third': confset.Setting('3'), 'testwatch3.first': confset.Setting('3')}
+        )
+        self.assertEqual(
+            diff.changed, {'testwatch1.first': (confset.Setting('1'), confset.Setting('10', ['Help']))}
+        )
+        self.assertEqual(
+            diff.removed,
+            {
+                'testwatch1.second': confset.Setting('1'), 'testwatch2.first': confset.Setting('2'),
+                'testwatch2.second': confset.Setting('2')
+            }
+        )
+        self.assertEqual(self.diffs, [diff])
+        self.assertEqual(watcher.settings['testwatch1.first'].value, '10')
+        self.assertNotIn('testwatch2.first', watcher.snapshot())
+
+    def test_polling(self):
+        watcher = confset.watch.Watcher(self.diffs.append, use_inotify=False)
+        self.assertFalse(watcher.using_inotify)
+        self.check_changes(watcher, watcher.refresh)
+        self.assertEqual(watcher.refresh(), confset.watch.SettingsDiff({}, {}, {}))
+        self.assertEqual(len(self.diffs), 1)
+
+    def test_inotify(self):
+        watcher = confset.watch.Watcher(self.diffs.append)
+        if not watcher.using_inotify:
+            self.skipTest('inotify is not available')
+        try:
+            self.check_changes(watcher, lambda: watcher.wait(timeout=5))
+            self.assertEqual(watcher.wait(timeout=0), confset.watch.SettingsDiff({}, {}, {}))
+        finally:
+            watcher.stop()
+
+    def test_background_thread(self):
+        with confset.watch.Watcher(self.diffs.append, interval=0.01, use_inotify=False) as watcher:
+            self.write('testwatch0', 'first=changed\n')
+            for attempt in range(500):
+                if self.diffs:
+                    break
+                watcher._stop.wait(0.01)
+        self.assertEqual(self.diffs[0].changed['testwatch0.first'][1].value, 'changed')